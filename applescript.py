@@ -0,0 +1,350 @@
+import sys
+import json
+import asyncio
+import time
+import queue
+import threading
+import itertools
+import subprocess
+from collections import namedtuple
+import metrics
+
+ScriptResult = namedtuple('ScriptResult', ['returncode', 'stdout', 'stderr'])
+
+SCRIPT_SECONDS = metrics.histogram('imessage_applescript_seconds', 'AppleScript run time per script', ['script'])
+SCRIPT_ERRORS = metrics.counter('imessage_applescript_errors_total', 'AppleScript runs that failed', ['script'])
+
+
+class Script:
+    # A named AppleScript whose source never changes. Values are passed as
+    # `on run argv` arguments instead of being pasted into the source, so
+    # workers can compile it once and keep it.
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+
+
+# Runs inside a long-lived `osascript -l JavaScript` process. Reads one JSON
+# request per line from stdin, compiles each script once with NSAppleScript,
+# calls its run handler with the arguments and writes one JSON line back.
+WORKER_JS = r'''
+ObjC.import('Foundation');
+var stdin = $.NSFileHandle.fileHandleWithStandardInput;
+var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+var compiled = {};
+var buffer = '';
+
+function write(obj) {
+    stdout.writeData($(JSON.stringify(obj) + '\n').dataUsingEncoding($.NSUTF8StringEncoding));
+}
+
+function describe(desc) {
+    if (desc.isNil()) return '';
+    var type = desc.descriptorType;
+    if (type == 0x74727565) return 'true';
+    if (type == 0x66616c73) return 'false';
+    if (type == 0x626f6f6c) return desc.booleanValue ? 'true' : 'false';
+    if (type == 0x6e756c6c) return '';
+    if (type == 0x6c697374) {
+        var items = [];
+        for (var i = 1; i <= desc.numberOfItems; i++) items.push(describe(desc.descriptorAtIndex(i)));
+        return items.join(', ');
+    }
+    var s = desc.stringValue;
+    return s.isNil() ? '' : ObjC.unwrap(s);
+}
+
+function errorMessage(err) {
+    var info = ObjC.deepUnwrap(err[0]);
+    return info ? String(info.NSAppleScriptErrorMessage) : 'AppleScript error';
+}
+
+function run(request) {
+    if (request.source) {
+        var compiling = $.NSAppleScript.alloc.initWithSource(request.source);
+        var compileError = Ref();
+        if (!compiling.compileAndReturnError(compileError)) throw new Error(errorMessage(compileError));
+        compiled[request.name] = compiling;
+    }
+    var script = compiled[request.name];
+    if (!script) throw new Error('not compiled: ' + request.name);
+    var args = $.NSAppleEventDescriptor.listDescriptor;
+    request.args.forEach(function (arg, i) {
+        args.insertDescriptorAtIndex($.NSAppleEventDescriptor.descriptorWithString(String(arg)), i + 1);
+    });
+    var event = $.NSAppleEventDescriptor.appleEventWithEventClassEventIDTargetDescriptorReturnIDTransactionID(
+        0x61657674, 0x6f617070, $.NSAppleEventDescriptor.nullDescriptor, -1, 0);
+    event.setParamDescriptorForKeyword(args, 0x2d2d2d2d);
+    var error = Ref();
+    var result = script.executeAppleEventError(event, error);
+    if (result.isNil()) throw new Error(errorMessage(error));
+    return describe(result);
+}
+
+while (true) {
+    var data = stdin.availableData;
+    if (data.length == 0) break;
+    buffer += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+    var lines = buffer.split('\n');
+    buffer = lines.pop();
+    lines.forEach(function (line) {
+        if (!line) return;
+        var request = JSON.parse(line);
+        try {
+            write({id: request.id, ok: true, result: run(request)});
+        } catch (e) {
+            write({id: request.id, ok: false, error: String(e.message || e)});
+        }
+    });
+}
+'''
+
+# Same line protocol in Python, for exercising PersistentBackend off macOS.
+# Returns the arguments joined with ', '; the "sleep" script sleeps first.
+STUB_WORKER_PY = r'''
+import sys, json, time
+for line in sys.stdin:
+    request = json.loads(line)
+    if request['name'] == 'sleep':
+        time.sleep(float(request['args'][0]))
+    sys.stdout.write(json.dumps({'id': request['id'], 'ok': True, 'result': ', '.join(request['args'])}) + '\n')
+    sys.stdout.flush()
+'''
+
+WORKER_COMMAND = ['osascript', '-l', 'JavaScript', '-e', WORKER_JS]
+STUB_WORKER_COMMAND = [sys.executable, '-c', STUB_WORKER_PY]
+
+# One-shot stand-in for `osascript -e source args...` off macOS: sleeps for
+# its first argument, then prints the script's arguments joined with ', '
+STUB_SCRIPT_PY = r'''
+import sys, time
+time.sleep(float(sys.argv[1]))
+print(', '.join(sys.argv[3:]))
+'''
+
+
+def osascript_command(script, args):
+    return ['osascript', '-e', script.source, *args]
+
+
+def stub_command(latency=0):
+    def command(script, args):
+        return [sys.executable, '-c', STUB_SCRIPT_PY, str(latency), script.name, *args]
+    return command
+
+
+class OsascriptBackend:
+    # One osascript process per call, the way the server always used to work
+    def run(self, script, args, timeout):
+        try:
+            result = subprocess.run(osascript_command(script, args), capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return ScriptResult(-1, '', f'{script.name} timed out after {timeout}s')
+        return ScriptResult(result.returncode, result.stdout, result.stderr)
+
+    def close(self):
+        pass
+
+
+class PersistentBackend:
+    # One long-lived worker process. Scripts are sent (and compiled) the
+    # first time they are used; after that only the name and arguments go
+    # over the pipe. A worker that misses its timeout is killed and a fresh
+    # one is started for the next call.
+    def __init__(self, command=WORKER_COMMAND):
+        self.command = command
+        self.process = None
+        self.ids = itertools.count(1)
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.compiled = set()
+        self.responses = queue.Queue()
+        threading.Thread(target=self.read_responses, args=(self.process, self.responses), daemon=True).start()
+
+    def read_responses(self, process, responses):
+        for line in process.stdout:
+            try:
+                responses.put(json.loads(line))
+            except ValueError:
+                pass
+        responses.put(None)
+
+    def run(self, script, args, timeout):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        request = {'id': next(self.ids), 'name': script.name, 'args': list(args)}
+        if script.name not in self.compiled:
+            request['source'] = script.source
+        try:
+            self.process.stdin.write(json.dumps(request) + '\n')
+            self.process.stdin.flush()
+        except OSError as e:
+            self.close()
+            return ScriptResult(-1, '', f'worker died: {e}')
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                response = self.responses.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.close()
+                return ScriptResult(-1, '', f'{script.name} timed out after {timeout}s')
+            if response is None:
+                self.close()
+                return ScriptResult(-1, '', 'worker exited')
+            if response.get('id') == request['id']:
+                break
+        self.compiled.add(script.name)
+        if response['ok']:
+            return ScriptResult(0, response['result'] + '\n', '')
+        return ScriptResult(1, '', response['error'])
+
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+class StubBackend:
+    # In-process stand-in for tests and benchmarks off macOS. responses maps
+    # a script name to a string or to a callable taking the argument list.
+    def __init__(self, responses=None, latency=0):
+        self.responses = responses or {}
+        self.latency = latency
+        self.calls = []
+
+    def run(self, script, args, timeout):
+        self.calls.append((script.name, list(args)))
+        if self.latency:
+            time.sleep(self.latency)
+        response = self.responses.get(script.name, '')
+        if callable(response):
+            response = response(list(args))
+        if isinstance(response, ScriptResult):
+            return response
+        return ScriptResult(0, response + '\n', '')
+
+    def close(self):
+        pass
+
+
+class LatencyStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'max_ms': self.max * 1000,
+        }
+
+
+class LatencyRecorder:
+    # Per-script call counts, errors and latency
+    def __init__(self):
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def record(self, name, elapsed, failed):
+        SCRIPT_SECONDS.observe(elapsed, script=name)
+        if failed:
+            SCRIPT_ERRORS.inc(script=name)
+        with self.stats_lock:
+            stats = self.stats.setdefault(name, LatencyStats())
+            stats.count += 1
+            stats.errors += failed
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+
+    def latency(self):
+        with self.stats_lock:
+            return {name: stats.to_dict() for name, stats in self.stats.items()}
+
+
+class ScriptExecutor(LatencyRecorder):
+    # Pool of backends shared by every route that drives AppleScript
+    def __init__(self, backend_factory, workers=2, timeout=30):
+        super().__init__()
+        self.timeout = timeout
+        self.backends = [backend_factory() for _ in range(workers)]
+        self.pool = queue.Queue()
+        for backend in self.backends:
+            self.pool.put(backend)
+
+    def run(self, script, *args, timeout=None):
+        backend = self.pool.get()
+        start = time.perf_counter()
+        try:
+            result = backend.run(script, [str(arg) for arg in args], timeout or self.timeout)
+        except Exception as e:
+            result = ScriptResult(-1, '', str(e))
+        finally:
+            self.pool.put(backend)
+        self.record(script.name, time.perf_counter() - start, result.returncode != 0)
+        return result
+
+    def close(self):
+        for backend in self.backends:
+            backend.close()
+
+
+class AsyncScriptExecutor(LatencyRecorder):
+    # For the asyncio server: every call is its own osascript process,
+    # awaited instead of waited on, with at most limit running at once
+    def __init__(self, command=osascript_command, limit=2, timeout=30):
+        super().__init__()
+        self.command = command
+        self.limit = limit
+        self.timeout = timeout
+        self.semaphore = None
+
+    async def run(self, script, *args, timeout=None):
+        if self.semaphore is None:
+            # Created on first use so it belongs to the server's event loop
+            self.semaphore = asyncio.Semaphore(self.limit)
+        timeout = timeout or self.timeout
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                result = await self._run(script, [str(arg) for arg in args], timeout)
+            except Exception as e:
+                result = ScriptResult(-1, '', str(e))
+        self.record(script.name, time.perf_counter() - start, result.returncode != 0)
+        return result
+
+    async def _run(self, script, args, timeout):
+        process = await asyncio.create_subprocess_exec(
+            *self.command(script, args), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return ScriptResult(-1, '', f'{script.name} timed out after {timeout}s')
+        return ScriptResult(process.returncode, stdout.decode(), stderr.decode())
+
+
+BACKENDS = {
+    'persistent': PersistentBackend,
+    'osascript': OsascriptBackend,
+    'stub': StubBackend,
+}
+
+
+def create_executor(backend=None, workers=2, timeout=30):
+    if backend is None:
+        backend = 'persistent' if sys.platform == 'darwin' else 'stub'
+    return ScriptExecutor(BACKENDS[backend], workers, timeout)
+
+
+def create_async_executor(limit=2, timeout=30):
+    command = osascript_command if sys.platform == 'darwin' else stub_command()
+    return AsyncScriptExecutor(command, limit, timeout)
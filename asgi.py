@@ -0,0 +1,385 @@
+import io
+import os
+import re
+import sys
+import json
+import time
+import queue
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+import applescript
+import server
+
+# Serves the same API as server.py from an asyncio event loop:
+#
+#     uvicorn asgi:app --host 0.0.0.0 --port 3000
+#
+# The routes that drive the Messages UI are handled here natively. Their
+# AppleScript runs as asyncio subprocesses behind a limiter, and
+# /check_imessage awaits the shared single-flight lookup, so none of them
+# hold a thread while they wait. /stream and /messages/poll are native too
+# and wait for the Broadcaster to wake them, so open streams don't use up
+# the pool. Every other route is the Flask app, run on its own thread pool
+# that UI work never touches, so reads from the in-memory index don't
+# queue behind a login or a screenshot.
+
+THREADS = int(os.environ.get('ASGI_THREADS', '32'))
+pool = ThreadPoolExecutor(THREADS, thread_name_prefix='wsgi')
+# Flask responses that stream for as long as the client takes to read
+# them get their own threads, so a few slow downloads can't starve the
+# pool the quick reads run on
+STREAM_THREADS = int(os.environ.get('ASGI_STREAM_THREADS', '8'))
+stream_pool = ThreadPoolExecutor(STREAM_THREADS, thread_name_prefix='wsgi-stream')
+STREAMING_PATHS = re.compile(r'/messages/export|/check_imessage/bulk/[^/]+/stream')
+scripts = applescript.create_async_executor(limit=int(os.environ.get('APPLESCRIPT_WORKERS', '2')))
+
+# Chunks a streaming response may get ahead of the client
+STREAM_BUFFER = 8
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, body, status=200):
+    data = json.dumps(body).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': data})
+
+
+def header(scope, name):
+    name = name.encode('latin-1')
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def query_args(scope):
+    # First value of each argument, like request.args.get
+    args = {}
+    for name, value in parse_qsl(scope['query_string'].decode('latin-1')):
+        args.setdefault(name, value)
+    return args
+
+
+def authorized(scope):
+    return header(scope, 'api-key') == server.PASSWORD
+
+
+def wsgi_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+async def call_wsgi(scope, receive, send, executor=pool):
+    # Runs the Flask app on executor. Response chunks come back through a
+    # small queue, so a long export or SSE stream only gets STREAM_BUFFER
+    # chunks ahead of the client and stops once the client is gone.
+    body = await read_body(receive)
+    if body is None:
+        return
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(STREAM_BUFFER)
+    disconnected = threading.Event()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+    def run():
+        def start_response(status, headers, exc_info=None):
+            put(('start', status, headers))
+
+        try:
+            result = server.app(wsgi_environ(scope, body), start_response)
+            try:
+                for chunk in result:
+                    if disconnected.is_set():
+                        break
+                    if chunk:
+                        put(('body', chunk))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception as e:
+            print(f"Error in WSGI app: {e}")
+            traceback.print_exc()
+        finally:
+            put(('end',))
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    loop.run_in_executor(executor, run)
+    started = False
+    try:
+        while True:
+            item = await chunks.get()
+            if item[0] == 'end':
+                break
+            if disconnected.is_set():
+                continue
+            if item[0] == 'start':
+                status, headers = item[1], item[2]
+                started = True
+                await send({
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+                })
+            else:
+                await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+        if not disconnected.is_set():
+            if not started:
+                await send_json(send, {'error': 'Internal server error'}, 500)
+            else:
+                await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+
+
+async def check_imessage(scope, receive, send, phone_number):
+    if server.contacts.to_e164(phone_number) is None:
+        await send_json(send, server.INVALID_NUMBER_ERROR, 400)
+        return
+    print(f"\n=== Starting iMessage check for {phone_number} ===")
+    loop = asyncio.get_running_loop()
+    flight = await loop.run_in_executor(pool, server.checker.submit, phone_number)
+    done = loop.create_future()
+
+    def resolve(result):
+        if not done.done():
+            done.set_result(result)
+    flight.add_done_callback(lambda flight: loop.call_soon_threadsafe(resolve, flight.result))
+    try:
+        is_on_imessage, source = await done
+    except asyncio.CancelledError:
+        server.checker.release(flight)
+        raise
+    body, status = server.check_imessage_result(phone_number, is_on_imessage, source)
+    await send_json(send, body, status)
+
+
+async def wait_disconnect(receive, wake):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    wake.set()
+
+
+def subscribe(loop, wake):
+    # A Broadcaster subscriber that sets wake on the event loop
+    return server.broadcaster.subscribe(lambda: loop.call_soon_threadsafe(wake.set))
+
+
+async def stream_messages(scope, receive, send):
+    # Same events as the Flask route, but between messages the connection
+    # is only an asyncio.Event waiting to be set by the ingest thread
+    if not authorized(scope):
+        await send_json(send, {'error': 'Invalid API key'}, 401)
+        return
+    try:
+        since = server.stream_since(header(scope, 'last-event-id') or query_args(scope).get('since'))
+    except ValueError:
+        await send_json(send, {'error': 'since must be a message id'}, 400)
+        return
+
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    subscriber = subscribe(loop, wake)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive, wake))
+
+    async def send_text(text):
+        await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+    try:
+        replay, gap = server.broadcaster.since(since) if since is not None else ([], False)
+        headers = [(b'content-type', b'text/event-stream; charset=utf-8')]
+        headers += [(name.lower().encode(), value.encode()) for name, value in server.STREAM_HEADERS.items()]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        last = since or 0
+        text = server.GAP_EVENT if gap else ''
+        for rowid, message in replay:
+            text += server.sse_event(rowid, message)
+            last = rowid
+        if text:
+            await send_text(text)
+        while not disconnected.done():
+            try:
+                await asyncio.wait_for(wake.wait(), server.STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                await send_text(server.KEEPALIVE_EVENT)
+                continue
+            wake.clear()
+            text = ''
+            while True:
+                try:
+                    rowid, message = subscriber.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if rowid > last:
+                    text += server.sse_event(rowid, message)
+                    last = rowid
+            if text and not disconnected.done():
+                await send_text(text)
+            if subscriber.dropped:
+                break
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': server.OVERFLOW_EVENT.encode()})
+    finally:
+        server.broadcaster.unsubscribe(subscriber)
+        disconnected.cancel()
+
+
+async def poll_messages(scope, receive, send):
+    if not authorized(scope):
+        await send_json(send, {'error': 'Invalid API key'}, 401)
+        return
+    try:
+        since, timeout = server.poll_arguments(query_args(scope))
+    except ValueError:
+        await send_json(send, {'error': 'since must be a message id and timeout a number'}, 400)
+        return
+
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    subscriber = subscribe(loop, wake)
+    try:
+        deadline = loop.time() + timeout
+        events, gap = server.broadcaster.since(since)
+        # Woken by every publish, which may all be at or before since
+        while not events and loop.time() < deadline:
+            wake.clear()
+            try:
+                await asyncio.wait_for(wake.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                pass
+            events, gap = server.broadcaster.since(since)
+    finally:
+        server.broadcaster.unsubscribe(subscriber)
+    await send_json(send, server.poll_response(events, since, gap))
+
+
+async def logout_imessage(scope, receive, send):
+    body, status = server.logout_response(await scripts.run(server.LOGOUT_SCRIPT))
+    await send_json(send, body, status)
+
+
+async def login_imessage(scope, receive, send):
+    body = await read_body(receive)
+    try:
+        arguments = server.login_arguments(json.loads(body or b'null'))
+    except ValueError:
+        arguments = None
+    if arguments is None:
+        await send_json(send, server.LOGIN_ARGUMENTS_ERROR, 400)
+        return
+    body, status = server.login_response(await scripts.run(server.LOGIN_SCRIPT, *arguments))
+    await send_json(send, body, status)
+
+
+async def click_other_options_tab(scope, receive, send):
+    body, status = server.other_options_response(await scripts.run(server.OTHER_OPTIONS_SCRIPT))
+    await send_json(send, body, status)
+
+
+# (method, path pattern, handler, route label for metrics)
+ROUTES = [
+    ('GET', re.compile(r'/check_imessage/([^/]+)'), check_imessage, '/check_imessage/<phone_number>'),
+    ('GET', re.compile(r'/stream'), stream_messages, '/stream'),
+    ('GET', re.compile(r'/messages/poll'), poll_messages, '/messages/poll'),
+    ('POST', re.compile(r'/logout_imessage'), logout_imessage, '/logout_imessage'),
+    ('POST', re.compile(r'/login_imessage'), login_imessage, '/login_imessage'),
+    ('POST', re.compile(r'/click_other_options_tab'), click_other_options_tab, '/click_other_options_tab'),
+]
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            pool.shutdown(wait=False)
+            stream_pool.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    for method, pattern, handler, route in ROUTES:
+        match = pattern.fullmatch(scope['path'])
+        if match and scope['method'] == method:
+            start = time.perf_counter()
+            started = []
+
+            def record(status):
+                # Up to the response head like the Flask routes, so a
+                # stream isn't timed for as long as it stays open
+                started.append(status)
+                server.REQUEST_SECONDS.observe(time.perf_counter() - start, method=method, route=route,
+                                               status=status)
+
+            async def send_and_record(message):
+                if message['type'] == 'http.response.start':
+                    record(message['status'])
+                await send(message)
+            try:
+                await handler(scope, receive, send_and_record, *match.groups())
+            except Exception as e:
+                print(f"Error in {handler.__name__}: {e}")
+                traceback.print_exc()
+                if not started:
+                    record(500)
+                    await send_json(send, {'success': False, 'error': str(e)}, 500)
+            return
+    await call_wsgi(scope, receive, send, stream_pool if STREAMING_PATHS.fullmatch(scope['path']) else pool)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT_NUMBER', '3000')))
@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import applescript
+
+CALLS = 200
+SCRIPT = applescript.Script('echo', 'on run argv\n    return argv\nend run')
+
+
+class SpawnPerCallBackend:
+    # Starts a fresh worker for every call, standing in for one osascript
+    # process per request when not on macOS
+    def run(self, script, args, timeout):
+        request = json.dumps({'id': 1, 'name': script.name, 'source': script.source, 'args': args})
+        result = subprocess.run(applescript.STUB_WORKER_COMMAND, input=request + '\n',
+                                capture_output=True, text=True, timeout=timeout)
+        return applescript.ScriptResult(result.returncode, json.loads(result.stdout)['result'] + '\n', '')
+
+    def close(self):
+        pass
+
+
+def bench(label, backend_factory, calls):
+    executor = applescript.ScriptExecutor(backend_factory, workers=1)
+    executor.run(SCRIPT, 'warm up')
+    start = time.perf_counter()
+    for i in range(calls):
+        result = executor.run(SCRIPT, '+15555550100', f'message {i}')
+        assert result.returncode == 0, result
+    elapsed = time.perf_counter() - start
+    executor.close()
+    print(f"{label:>16}: {calls} calls in {elapsed:6.2f} s, {elapsed / calls * 1000:7.2f} ms per call")
+    return executor.latency()
+
+
+def main(calls):
+    if sys.platform == 'darwin':
+        bench('osascript', applescript.OsascriptBackend, calls)
+        bench('persistent', applescript.PersistentBackend, calls)
+    bench('spawn per call', SpawnPerCallBackend, calls)
+    bench('persistent stub', lambda: applescript.PersistentBackend(applescript.STUB_WORKER_COMMAND), calls)
+    bench('in-process stub', applescript.StubBackend, calls)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else CALLS)
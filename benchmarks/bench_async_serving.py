@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import threading
+import http.client
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_chatdb import make_chat_db
+
+MESSAGES = 100_000
+READERS = 8
+UI_CLIENTS = 4
+UI_SECONDS = 2.0
+PHASE_SECONDS = 6.0
+READ_PATHS = ['/messages?num_messages=20', '/conversations?num_conversations=20', '/recent_contacts?num_contacts=20']
+HEADERS = {'Api-Key': 'bench'}
+
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request(method, path, body=body, headers=dict(HEADERS, **{'Content-Type': 'application/json'}))
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def reader(port, stop, latencies):
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        status = request(port, 'GET', READ_PATHS[i % len(READ_PATHS)])
+        assert status == 200, status
+        latencies.append(time.perf_counter() - start)
+        i += 1
+
+
+def ui_client(port, stop):
+    while not stop.is_set():
+        request(port, 'POST', '/logout_imessage')
+
+
+def phase(port, with_ui):
+    stop = threading.Event()
+    latencies = []
+    threads = [threading.Thread(target=reader, args=(port, stop, latencies)) for _ in range(READERS)]
+    if with_ui:
+        threads += [threading.Thread(target=ui_client, args=(port, stop)) for _ in range(UI_CLIENTS)]
+    for thread in threads:
+        thread.start()
+    time.sleep(PHASE_SECONDS)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'p50_ms': median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def serve_wsgi(app, port, threaded):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    httpd = make_server('127.0.0.1', port, app, threaded=threaded)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd.shutdown
+
+
+def serve_asgi(app, port):
+    import uvicorn
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=uvicorn_server.run, daemon=True).start()
+    while not uvicorn_server.started:
+        time.sleep(0.05)
+
+    def stop():
+        uvicorn_server.should_exit = True
+    return stop
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'chat.db')
+    make_chat_db(db_path, MESSAGES)
+    os.environ.update(DB_FILEPATH=db_path, PASSWORD=HEADERS['Api-Key'], YOUR_NAME='Me', SNAPSHOT_FILEPATH='',
+                      CAPABILITY_CACHE_FILEPATH=os.path.join(tmp, 'capabilities.json'))
+    # Importing the server starts its ingest thread
+    import applescript
+    import asgi
+    import server
+    server.ready.wait()
+    # Every UI script takes UI_SECONDS, in both modes
+    server.executor = applescript.ScriptExecutor(lambda: applescript.StubBackend(latency=UI_SECONDS), workers=2)
+    asgi.scripts = applescript.AsyncScriptExecutor(applescript.stub_command(UI_SECONDS), limit=2)
+
+    modes = [
+        ('wsgi, 1 worker', lambda port: serve_wsgi(server.app, port, threaded=False)),
+        ('wsgi, threaded', lambda port: serve_wsgi(server.app, port, threaded=True)),
+        ('asgi', lambda port: serve_asgi(asgi.app, port)),
+    ]
+    results = {}
+    for port, (name, serve) in enumerate(modes, start=18700):
+        stop = serve(port)
+        idle = phase(port, with_ui=False)
+        busy = phase(port, with_ui=True)
+        stop()
+        results[name] = {'idle': idle, 'ui_in_progress': busy}
+        for label, stats in (('idle', idle), ('UI busy', busy)):
+            print(f"{name:>15} {label:>8}: {stats['requests']:6} reads | p50 {stats['p50_ms']:7.1f} ms | "
+                  f"p99 {stats['p99_ms']:7.1f} ms | max {stats['max_ms']:7.1f} ms")
+    print(json.dumps(results))
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
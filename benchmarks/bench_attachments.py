@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import tracemalloc
+
+from werkzeug.wsgi import FileWrapper
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import thumbnails
+from bench_chatdb import write_photo
+
+PHOTOS = 60
+CLIENTS = 8
+SIZE = 256
+# A big video-sized file for the streaming comparison
+FILE_MB = 200
+
+
+def gallery(fetch, photos, clients=CLIENTS):
+    # Every client opens the same gallery at once and asks for every photo
+    errors = []
+
+    def client():
+        for photo in photos:
+            try:
+                fetch(photo)
+            except Exception as e:
+                errors.append(e)
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors[:3]
+    return time.perf_counter() - start
+
+
+def naive(photo, out_dir):
+    # What each request would do without the cache: decode and resize
+    thumbnails.build_thumbnail(photo, os.path.join(out_dir, f'{threading.get_ident()}.jpg'), SIZE)
+
+
+def stream_peak(read):
+    tracemalloc.start()
+    read()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    try:
+        photos = [os.path.join(tmp, 'photos', f'{i}', 'IMG.jpeg') for i in range(PHOTOS)]
+        for i, photo in enumerate(photos):
+            write_photo(photo, i)
+
+        naive_dir = os.path.join(tmp, 'naive')
+        os.makedirs(naive_dir)
+        naive_time = gallery(lambda photo: naive(photo, naive_dir), photos)
+
+        cache = thumbnails.ThumbnailCache(os.path.join(tmp, 'cache'), workers=2)
+        cold = gallery(lambda photo: cache.get(photo, SIZE, timeout=60), photos)
+        built = thumbnails.BUILD_SECONDS.series[()][2]
+        warm = gallery(lambda photo: cache.get(photo, SIZE, timeout=60), photos)
+        print(f"{CLIENTS} clients x {PHOTOS} photos | build per request: {naive_time * 1000:7.1f} ms, "
+              f"{CLIENTS * PHOTOS} builds | cache cold: {cold * 1000:7.1f} ms, {built} builds | "
+              f"cache warm: {warm * 1000:6.1f} ms")
+
+        # A budget of a third of the gallery keeps the most recent third
+        small = thumbnails.ThumbnailCache(os.path.join(tmp, 'small'), max_bytes=cache.total_bytes // 3)
+        for photo in photos:
+            small.get(photo, SIZE)
+        print(f"LRU budget {small.max_bytes} bytes: {len(small.entries)} of {PHOTOS} kept, "
+              f"{small.total_bytes} bytes on disk")
+
+        big = os.path.join(tmp, 'video.mov')
+        with open(big, 'wb') as f:
+            f.truncate(FILE_MB * 2**20)
+
+        def whole():
+            with open(big, 'rb') as f:
+                return len(f.read())
+
+        def streamed():
+            # The way send_file reads it, one block at a time
+            with open(big, 'rb') as f:
+                return sum(len(block) for block in FileWrapper(f))
+        print(f"{FILE_MB} MB file | read() peak: {stream_peak(whole) / 2**20:7.1f} MB | "
+              f"streamed peak: {stream_peak(streamed) / 2**20:5.2f} MB")
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatdb
+
+SIZES = [10_000, 100_000, 1_000_000]
+HANDLES = 500
+GROUPS = 50
+PAGE = 50
+# One message in ATTACHMENT_EVERY carries a photo
+ATTACHMENT_EVERY = 25
+
+# The tables and columns of a real chat.db this project reads, with the
+# indexes Messages creates on them
+SCHEMA = """
+CREATE TABLE handle (ROWID INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, id TEXT NOT NULL, country TEXT,
+    service TEXT NOT NULL, uncanonicalized_id TEXT, person_centric_id TEXT, UNIQUE (id, service));
+CREATE TABLE message (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT UNIQUE NOT NULL, text TEXT,
+    handle_id INTEGER DEFAULT 0, service TEXT, account TEXT, date INTEGER, date_read INTEGER,
+    date_delivered INTEGER, is_from_me INTEGER DEFAULT 0, cache_has_attachments INTEGER DEFAULT 0,
+    attributedBody BLOB, destination_caller_id TEXT, date_edited INTEGER DEFAULT 0,
+    associated_message_type INTEGER DEFAULT 0);
+CREATE TABLE chat (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT UNIQUE NOT NULL, style INTEGER,
+    chat_identifier TEXT, service_name TEXT, display_name TEXT);
+CREATE TABLE chat_handle_join (chat_id INTEGER, handle_id INTEGER, UNIQUE (chat_id, handle_id));
+CREATE TABLE chat_message_join (chat_id INTEGER, message_id INTEGER, message_date INTEGER DEFAULT 0,
+    PRIMARY KEY (chat_id, message_id));
+CREATE TABLE attachment (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT UNIQUE NOT NULL,
+    created_date INTEGER DEFAULT 0, filename TEXT, uti TEXT, mime_type TEXT, transfer_name TEXT,
+    total_bytes INTEGER DEFAULT 0, is_outgoing INTEGER DEFAULT 0);
+CREATE TABLE message_attachment_join (message_id INTEGER, attachment_id INTEGER,
+    UNIQUE (message_id, attachment_id));
+CREATE INDEX message_idx_handle ON message (handle_id, date);
+CREATE INDEX message_idx_date ON message (date);
+CREATE INDEX chat_message_join_idx_message_date_id_chat_id ON chat_message_join (chat_id, message_date, message_id);
+CREATE INDEX chat_message_join_idx_message_id_only ON chat_message_join (message_id);
+"""
+
+WORDS = ['dinner', 'tonight', 'meeting', 'tomorrow', 'running', 'late', 'call', 'me', 'thanks', 'love']
+
+
+def attributed_body(text):
+    # Enough of an NSAttributedString typedstream for decode_attributed_body
+    data = text.encode()
+    if len(data) < 0x80:
+        length = bytes([len(data)])
+    else:
+        length = b'\x81' + len(data).to_bytes(2, 'little')
+    return (b'\x04\x0bstreamtyped\x81\xe8\x03\x84\x01@\x84\x84\x84\x12NSAttributedString\x00'
+            b'\x84\x84\x08NSObject\x00\x85\x92\x84\x84\x84\x08NSString\x01\x94\x84\x01+' +
+            length + data + b'\x86\x84\x02iI\x01\x01\x92\x84\x84\x84\x0cNSDictionary\x00')
+
+
+def make_chat_db(path, n, handles=HANDLES, groups=GROUPS, seed=0, start=1_600_000_000, attachments_dir=None):
+    # A chat.db with n messages over one chat per handle plus some group
+    # chats, about a third of them with the text only in attributedBody
+    # like newer macOS. What we send to a group has no handle, as in the
+    # real thing. Photos are only written to disk under attachments_dir;
+    # without it the attachment rows point at Messages' usual folder.
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany(
+        "INSERT INTO handle (ROWID, id, country, service) VALUES (?, ?, 'us', ?)",
+        [(i, f'+1555{i:07d}', 'iMessage' if i % 3 else 'SMS') for i in range(1, handles + 1)])
+    conn.executemany(
+        "INSERT INTO chat (ROWID, guid, style, chat_identifier, service_name) VALUES (?, ?, 45, ?, ?)",
+        [(i, f'iMessage;-;+1555{i:07d}', f'+1555{i:07d}', 'iMessage' if i % 3 else 'SMS')
+         for i in range(1, handles + 1)])
+    conn.executemany("INSERT INTO chat_handle_join VALUES (?, ?)", [(i, i) for i in range(1, handles + 1)])
+    members = {}
+    for chat_id in range(handles + 1, handles + groups + 1):
+        members[chat_id] = rng.sample(range(1, handles + 1), rng.randint(2, 6))
+        conn.execute("INSERT INTO chat (ROWID, guid, style, chat_identifier, service_name, display_name) "
+                     "VALUES (?, ?, 43, ?, 'iMessage', ?)",
+                     (chat_id, f'iMessage;+;chat{chat_id}', f'chat{chat_id}', f'Group {chat_id}'))
+        conn.executemany("INSERT INTO chat_handle_join VALUES (?, ?)", [(chat_id, h) for h in members[chat_id]])
+    conn.commit()
+    conn.close()
+    add_messages(path, 1, n, rng, handles, members, start, attachments_dir)
+    return members
+
+
+def attachment_row(rowid, date, is_from_me, attachments_dir=None):
+    guid = f'at_{rowid}'
+    transfer_name = f'IMG_{rowid % 10000:04d}.jpeg'
+    if attachments_dir is None:
+        filename = f'~/Library/Messages/Attachments/{rowid % 256:02x}/{rowid % 16:02d}/{guid}/{transfer_name}'
+        total_bytes = 150_000 + rowid % 1000 * 1000
+    else:
+        filename = os.path.join(attachments_dir, f'{rowid % 256:02x}', guid, transfer_name)
+        total_bytes = write_photo(filename, rowid)
+    return (rowid, guid, date, filename, 'public.jpeg', 'image/jpeg', transfer_name, total_bytes, is_from_me)
+
+
+def write_photo(path, seed):
+    # A small gradient JPEG, so thumbnailing has real decoding to do
+    from PIL import Image
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img = Image.linear_gradient('L').resize((640, 480)).convert('RGB')
+    img.paste((seed * 37 % 256, seed * 91 % 256, seed * 13 % 256), (0, 0, 320, 240))
+    img.save(path, 'JPEG', quality=80)
+    return os.path.getsize(path)
+
+
+def add_messages(path, first_rowid, n, rng, handles=HANDLES, members=None, start=1_600_000_000,
+                 attachments_dir=None):
+    # One in ten messages goes to a group chat when there are any. Some of
+    # the photo messages have a caption, the rest are just the photo.
+    conn = sqlite3.connect(path)
+    groups = sorted(members or {})
+    batch = []
+    attachments = []
+    for rowid in range(first_rowid, first_rowid + n):
+        is_from_me = rng.randint(0, 1)
+        if groups and rng.random() < 0.1:
+            chat_id = rng.choice(groups)
+            handle_id = 0 if is_from_me else rng.choice(members[chat_id])
+        else:
+            chat_id = handle_id = rng.randint(1, handles)
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 12)))
+        date = chatdb.to_apple_time(start + rowid * 30) + rng.randrange(chatdb.NANOSECONDS)
+        has_attachment = rowid % ATTACHMENT_EVERY == 0
+        if has_attachment:
+            text = chatdb.OBJECT_REPLACEMENT + (text if rng.random() < 0.3 else '')
+            attachments.append(attachment_row(rowid, date, is_from_me, attachments_dir))
+        in_body = rowid % 3 == 0
+        batch.append((rowid, f'guid-{rowid}', None if in_body else text, handle_id, 'iMessage', date, is_from_me,
+                      int(has_attachment), attributed_body(text) if in_body else None, 'e:me@example.com', chat_id))
+        if len(batch) == 10_000 or rowid == first_rowid + n - 1:
+            conn.executemany(
+                "INSERT INTO message (ROWID, guid, text, handle_id, service, date, is_from_me, "
+                "cache_has_attachments, attributedBody, destination_caller_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row[:-1] for row in batch])
+            conn.executemany("INSERT INTO chat_message_join VALUES (?, ?, ?)",
+                             [(row[-1], row[0], row[5]) for row in batch])
+            conn.executemany(
+                "INSERT INTO attachment (ROWID, guid, created_date, filename, uti, mime_type, transfer_name, "
+                "total_bytes, is_outgoing) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", attachments)
+            conn.executemany("INSERT INTO message_attachment_join VALUES (?, ?)",
+                             [(row[0], row[0]) for row in attachments])
+            batch = []
+            attachments = []
+    conn.commit()
+    conn.close()
+
+
+def full_fetch(path):
+    # What imessage_reader does on every refresh: a new connection and
+    # every row in the database
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT " + chatdb.MESSAGE_COLUMNS + chatdb.MESSAGES_FROM).fetchall()
+    finally:
+        conn.close()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in SIZES:
+            path = os.path.join(tmp, f'chat_{n}.db')
+            make_chat_db(path, n)
+            db = chatdb.ChatDB(path)
+            full_time, rows = timed(lambda: full_fetch(path))
+            since_time, new = timed(lambda: db.messages_since(n - 20))
+            page_time, (page, cursor) = timed(lambda: db.messages_for_handle('+15550000042', limit=PAGE))
+            next_time, _ = timed(lambda: db.messages_for_handle('+15550000042', before=cursor, limit=PAGE))
+            range_time, _ = timed(lambda: db.messages_between(1_600_000_000 + n * 15, limit=PAGE))
+            chats_time, _ = timed(lambda: db.chats(limit=PAGE))
+            assert len(rows) == n and len(new) == 20
+            print(f"{n:>9} msgs: full fetch {full_time * 1000:9.1f} ms | since rowid {since_time * 1000:6.2f} ms | "
+                  f"handle page {page_time * 1000:6.2f} ms, next {next_time * 1000:6.2f} ms | "
+                  f"date range {range_time * 1000:6.2f} ms | chats {chats_time * 1000:7.2f} ms")
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contacts
+
+SIZES = [1_000, 10_000]
+FIRST = ['John', 'Jo', 'Zoë', 'Ana', 'Mark', 'Li', 'Sam', 'Priya', 'Jürgen', 'Chloe', 'Omar', 'Kate']
+LAST = ['Doe', 'Dunn', 'Smith', 'García', 'Müller', 'Chen', 'Patel', 'Nguyen', 'Brown', 'Okafor']
+LOOKUPS = 10_000
+
+
+def make_vcards(n, seed=0):
+    rng = random.Random(seed)
+    cards = []
+    for i in range(n):
+        name = f'{rng.choice(FIRST)} {rng.choice(LAST)} {i}'
+        cards.append(f'BEGIN:VCARD\nVERSION:3.0\nFN:{name}\nTEL;type=CELL:(555) {i // 10000:03d}-{i % 10000:04d}\n'
+                     f'EMAIL:person{i}@example.com\nEND:VCARD\n')
+    return ''.join(cards)
+
+
+def naive_resolve(cards, name):
+    # What a send would do without an index: scan every card
+    for card_name, handles in cards:
+        if card_name.lower() == name.lower():
+            return contacts.to_e164(handles[0][0])
+    return None
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    for n in SIZES:
+        text = make_vcards(n)
+        start = time.perf_counter()
+        cards = contacts.parse_vcards(text)
+        index = contacts.Contacts(cards)
+        load = time.perf_counter() - start
+        name = cards[-1][0].upper()
+        handle = index.contacts[-1].handles[0]
+        assert naive_resolve(cards, name) == index.resolve(name)[0].handles[0]
+        scan = timed(lambda: naive_resolve(cards, name), 200)
+        folded = timed(lambda: index.resolve(name), LOOKUPS)
+        prefix = timed(lambda: index.resolve('jo d'), 1000)
+        by_handle = timed(lambda: index.by_handle.get(handle), LOOKUPS)
+        print(f"{n:>6} contacts | parse + index {load * 1000:7.1f} ms | scan per send {scan:8.1f} us | "
+              f"resolve {folded:5.2f} us | prefix 'jo d' {prefix:7.1f} us | name for handle {by_handle:5.3f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatdb
+import ingest
+from bench_chatdb import add_messages, make_chat_db
+from conversations import ConversationIndex
+
+SIZES = [int(sys.argv[1])] if len(sys.argv) > 1 else [10_000, 100_000, 1_000_000]
+PASSES = 20
+NEW_PER_PASS = 20
+
+# Every chat's totals straight from chat.db, what the dashboard used to
+# recompute from the whole message list
+RECOMPUTE_SQL = (
+    "SELECT chat_id, COUNT(*), SUM(message.is_from_me), ("
+    "  SELECT message_id FROM chat_message_join AS latest WHERE latest.chat_id = counts.chat_id "
+    "  ORDER BY message_date DESC, message_id DESC LIMIT 1) "
+    "FROM chat_message_join AS counts JOIN message ON message.ROWID = counts.message_id "
+    "GROUP BY chat_id"
+)
+
+
+def summaries(index):
+    return {
+        chat_id: (conversation.summary()['message_count'], conversation.sent, conversation.last()[1])
+        for chat_id, conversation in index.conversations.items()
+    }
+
+
+def change(path, rng, members, first_rowid):
+    # One pass worth of activity: new messages, an edit and a delete
+    add_messages(path, first_rowid, NEW_PER_PASS, rng, members=members)
+    conn = sqlite3.connect(path)
+    rowid = rng.randrange(1, first_rowid)
+    conn.execute("UPDATE message SET text = 'edited', date_edited = ? WHERE ROWID = ?", (first_rowid, rowid))
+    rowid = rng.randrange(1, first_rowid)
+    conn.execute("DELETE FROM message WHERE ROWID = ?", (rowid,))
+    conn.execute("DELETE FROM chat_message_join WHERE message_id = ?", (rowid,))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in SIZES:
+            rng = random.Random(1)
+            path = os.path.join(tmp, f'chat_{n}.db')
+            members = make_chat_db(path, n)
+            db = chatdb.ChatDB(path)
+            ingestor = ingest.MessageIngestor(db, deletion_check_interval=1)
+            index = ConversationIndex(db)
+            update_times = []
+
+            def update(added, changed, removed):
+                start = time.perf_counter()
+                index.update(added, changed, removed)
+                update_times.append(time.perf_counter() - start)
+            ingestor.add_listener(update)
+            start = time.perf_counter()
+            ingestor.ingest()
+            initial = time.perf_counter() - start
+
+            next_rowid = n + 1
+            for _ in range(PASSES):
+                change(path, rng, members, next_rowid)
+                next_rowid += NEW_PER_PASS
+                ingestor.ingest()
+
+            start = time.perf_counter()
+            fresh = ConversationIndex(db)
+            fresh.update({rowid: ingestor.messages.get(rowid) for rowid in ingestor.messages.store.slots}, {}, set())
+            rebuild = time.perf_counter() - start
+            expected = {chat_id: (count, sent, last) for chat_id, count, sent, last in db.query(RECOMPUTE_SQL)}
+            assert summaries(index) == summaries(fresh) == expected
+            assert list(index.recent.keys) == list(fresh.recent.keys)
+
+            start = time.perf_counter()
+            page, _ = index.page(50)
+            page_time = time.perf_counter() - start
+            print(f"{n:>9} msgs, {len(index):>3} chats: first ingest {initial * 1000:8.1f} ms | "
+                  f"summary update per pass {sum(update_times[1:]) / PASSES * 1000:5.2f} ms | "
+                  f"rebuild from scratch {rebuild * 1000:8.1f} ms | page of 50 {page_time * 1000:5.2f} ms")
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
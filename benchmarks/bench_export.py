@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatdb
+import export
+import ingest
+from bench_chatdb import make_chat_db
+
+SIZE = 2_000_000
+# How many of the newest messages each export covers
+EXPORTS = [10_000, 100_000, 1_000_000, None]
+START = 1_600_000_000
+JSON_LIMIT = 100_000
+
+
+def format_message(message):
+    # Same fields as server.format_message, without importing the server
+    user_id, text, date, service, account, is_from_me, timestamp = message
+    return {
+        'sender': 'Me' if is_from_me else user_id,
+        'handle': user_id,
+        'message': text,
+        'date': date,
+        'timestamp': timestamp,
+        'service': service,
+        'is_from_me': bool(is_from_me),
+    }
+
+
+def run_export(index, fmt, compress, start):
+    if fmt == 'json':
+        # The one big response this replaces
+        rows = [export.with_cursor(rowid, message, format_message)
+                for rowid, message in export.iter_messages(index, start=start)]
+        return len(json.dumps({'messages': rows}))
+    to_chunks, _ = export.FORMATS[fmt]
+    chunks = to_chunks(export.iter_messages(index, start=start), format_message)
+    if compress:
+        chunks = export.gzipped(chunks)
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+    return size
+
+
+def main(size=SIZE):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'chat.db')
+        began = time.perf_counter()
+        make_chat_db(path, size)
+        ingestor = ingest.MessageIngestor(chatdb.ChatDB(path))
+        ingestor.ingest()
+        index = ingestor.messages
+        print(f"{size} messages generated and ingested in {time.perf_counter() - began:.1f} s")
+
+        for count in EXPORTS:
+            if count is not None and count >= size:
+                continue
+            # make_chat_db spaces messages 30 seconds apart
+            start = None if count is None else START + (size - count + 1) * 30
+            exported = len(index) if count is None else count
+            for fmt, compress in (('json', False), ('ndjson', False), ('csv', False), ('ndjson', True)):
+                if fmt == 'json' and exported > JSON_LIMIT:
+                    # Several GB at these sizes
+                    continue
+                began = time.perf_counter()
+                run_export(index, fmt, compress, start)
+                elapsed = time.perf_counter() - began
+                tracemalloc.start()
+                out = run_export(index, fmt, compress, start)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                label = fmt + ('.gz' if compress else '')
+                print(f"{exported:>9} msgs {label:>9}: {out / 2**20:8.1f} MB out | {elapsed:6.2f} s "
+                      f"({exported / elapsed:8.0f} msg/s) | peak memory {peak / 2**20:5.2f} MB")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else SIZE)
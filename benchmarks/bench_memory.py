@@ -0,0 +1,63 @@
+import os
+import sys
+import gc
+import random
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_index import TimeIndex
+
+SIZES = [10_000, 100_000, 1_000_000]
+WORDS = ['ok', 'see you soon', 'on my way', 'lol', 'can you call me when you get a chance', 'thanks!']
+
+
+def make_rows(n, start=1_600_000_000):
+    # Built the way sqlite3 hands them back: a fresh string object per field
+    for rowid in range(1, n + 1):
+        timestamp = start + rowid * 30
+        yield rowid, (
+            ''.join(['+1555', str(rowid % 300).zfill(7)]),
+            ' '.join(random.choice(WORDS) for _ in range(random.randint(1, 4))),
+            datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'),
+            ''.join(['i', 'Message']),
+            ''.join(['e:', 'me@example.com']),
+            rowid % 2,
+            timestamp,
+        )
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, result
+
+
+def run(n):
+    list_bytes, _ = measure(lambda: [message for _, message in make_rows(n)])
+
+    def build_index():
+        index = TimeIndex()
+        batch = {}
+        for rowid, message in make_rows(n):
+            batch[rowid] = message
+            if len(batch) == 10_000:
+                index.add_many(batch)
+                batch = {}
+        index.add_many(batch)
+        return index
+    index_bytes, _ = measure(build_index)
+
+    print(f"{n:>9} messages | list of tuples: {list_bytes / 2**20:8.1f} MB | "
+          f"TimeIndex + MessageStore: {index_bytes / 2**20:8.1f} MB | "
+          f"{list_bytes / index_bytes:4.1f}x smaller")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    for n in sizes:
+        run(n)
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from profiler import SamplingProfiler
+
+N = 200_000
+
+
+def per_call(fn, n=N):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+def main():
+    registry = metrics.Registry()
+    plain = registry.histogram('plain_seconds', 'plain')
+    labelled = registry.histogram('labelled_seconds', 'labelled', ['method', 'route', 'status'])
+    counter = registry.counter('things_total', 'things', ['kind'])
+
+    print(f"{'operation':<32} {'us/call':>8}")
+    print(f"{'empty loop':<32} {per_call(lambda: None):>8.3f}")
+    print(f"{'counter.inc':<32} {per_call(lambda: counter.inc(kind='a')):>8.3f}")
+    print(f"{'histogram.observe':<32} {per_call(lambda: plain.observe(0.003)):>8.3f}")
+    print(f"{'histogram.observe (3 labels)':<32} "
+          f"{per_call(lambda: labelled.observe(0.003, method='GET', route='/messages', status=200)):>8.3f}")
+
+    def timed():
+        with plain.time():
+            pass
+    print(f"{'histogram.time()':<32} {per_call(timed):>8.3f}")
+
+    # A few hundred routes x statuses is more series than the server has
+    for i in range(300):
+        labelled.observe(0.01 * (i % 7), method='GET', route=f'/r{i}', status=200)
+    start = time.perf_counter()
+    text = registry.render()
+    print(f"\nrender {len(text.splitlines())} lines: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    # Profiler cost: CPU work on one thread while others idle, with and
+    # without sampling
+    idle = [threading.Thread(target=time.sleep, args=(3,), daemon=True) for _ in range(16)]
+    for thread in idle:
+        thread.start()
+    baseline = busy(1.0)
+    print(f"\n{'profiler':<12} {'interval':>8} {'work':>10} {'slowdown':>9} {'samples':>8}")
+    print(f"{'off':<12} {'':>8} {baseline:>10} {'':>9} {'':>8}")
+    for interval in (0.01, 0.001):
+        sampler = SamplingProfiler(interval)
+        sampler.start()
+        work = busy(1.0)
+        sampler.stop()
+        print(f"{'on':<12} {interval:>8} {work:>10} {(baseline / work - 1) * 100:>8.1f}% {sampler.samples:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import random
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pixel_classifier
+
+# (width, height) of the captured title bar: non-Retina, Retina, 5K
+SIZES = [(1440, 40), (2880, 80), (5120, 160)]
+TOKEN_COLORS = {'imessage': (45, 110, 235), 'sms': (75, 110, 75)}
+
+
+def make_title_bar(width, height, kind, seed=0):
+    # Grey title bar with a rounded recipient token and some noise, roughly
+    # what screencapture returns for a new message window
+    rng = random.Random(seed)
+    img = Image.new('RGB', (width, height), (236, 236, 236))
+    draw = ImageDraw.Draw(img)
+    left, top, right, bottom = pixel_classifier.token_box(width, height)
+    token = (left + (right - left) // 8, top + (bottom - top) // 6,
+             right - (right - left) // 8, bottom - (bottom - top) // 6)
+    draw.rounded_rectangle(token, radius=(token[3] - token[1]) // 2, fill=TOKEN_COLORS[kind])
+    draw.text((token[0] + 6, token[1] + 2), '+1 (555) 555-0100', fill=(255, 255, 255))
+    pixels = img.load()
+    for _ in range(width * height // 20):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r, g, b = pixels[x, y]
+        jitter = rng.randint(-25, 25)
+        pixels[x, y] = (max(0, min(255, r + jitter)), max(0, min(255, g + jitter)), max(0, min(255, b + jitter)))
+    return img
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main(out_dir=None):
+    for width, height in SIZES:
+        for kind in TOKEN_COLORS:
+            img = make_title_bar(width, height, kind)
+            if out_dir:
+                img.save(os.path.join(out_dir, f'title_bar_{kind}_{width}x{height}.png'))
+            loop_time, loop_counts = timed(lambda: pixel_classifier.classify_per_pixel(img), 3)
+            band_time, band_counts = timed(lambda: pixel_classifier.classify(img), 20)
+            assert loop_counts == band_counts, (loop_counts, band_counts)
+            print(f"{width}x{height} {kind:>8}: blue/green {band_counts} | getpixel loop {loop_time * 1000:8.2f} ms | "
+                  f"band ops {band_time * 1000:6.2f} ms | {loop_time / band_time:5.1f}x faster")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
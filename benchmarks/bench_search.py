@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex
+
+SIZE = 1_000_000
+BATCH = 10_000
+RARE_WORDS = [f'word{i}' for i in range(5000)]
+COMMON_WORDS = [
+    'dinner', 'tonight', 'meeting', 'tomorrow', 'birthday', 'party', 'flight', 'airport',
+    'running', 'late', 'call', 'me', 'when', 'you', 'can', 'love', 'thanks', 'happy',
+]
+QUERIES = [
+    'dinner',
+    'dinner tonight',
+    '"running late"',
+    'birth*',
+    'word42*',
+    'flight airport',
+]
+
+
+def make_batch(first_rowid, n, start=1_600_000_000):
+    added = {}
+    for rowid in range(first_rowid, first_rowid + n):
+        text = ' '.join(
+            random.choice(COMMON_WORDS if random.random() < 0.3 else RARE_WORDS)
+            for _ in range(random.randint(3, 15))
+        )
+        handle = f'+1555{rowid % 1000:07d}'
+        added[rowid] = (handle, text, '', 'iMessage', 'me', rowid % 2, start + rowid * 30)
+    return added
+
+
+def main(size):
+    index = SearchIndex()
+    start = time.perf_counter()
+    for first in range(1, size + 1, BATCH):
+        index.update(make_batch(first, min(BATCH, size - first + 1)), {}, {})
+    print(f"indexed {size} messages in {time.perf_counter() - start:.1f} s")
+
+    middle = 1_600_000_000 + size * 15
+    for query in QUERIES:
+        for label, kwargs in [
+            ('all', {}),
+            ('handle', {'handle': '+15550000042'}),
+            ('1 day', {'start': middle, 'end': middle + 86400}),
+            ('recent', {'order': 'recent'}),
+        ]:
+            runs = []
+            for _ in range(5):
+                t = time.perf_counter()
+                hits = index.search(query, limit=20, **kwargs)
+                runs.append(time.perf_counter() - t)
+            runs.sort()
+            print(f"{query!r:>20} {label:>7}: {len(hits):3} hits, median {runs[2] * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else SIZE)
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import random
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_index import TimeIndex
+
+SIZES = [10_000, 100_000, 1_000_000]
+NEW_PER_REFRESH = 20
+
+
+def sort_key(item):
+    return datetime.strptime(item[2], '%Y-%m-%d %H:%M:%S')
+
+
+def make_messages(n, start=1_600_000_000, first_rowid=1):
+    messages = {}
+    for rowid in range(first_rowid, first_rowid + n):
+        timestamp = start + rowid * 30 + random.randint(0, 29)
+        date = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        messages[rowid] = (f'+1555{rowid % 500:07d}', f'message {rowid}', date, 'iMessage', 'me', rowid % 2, timestamp)
+    return messages
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def run(n):
+    history = make_messages(n)
+    new = make_messages(NEW_PER_REFRESH, first_rowid=n + 1)
+    everything = list(history.values()) + list(new.values())
+
+    old_refresh, _ = timed(lambda: sorted(everything, key=sort_key, reverse=True))
+
+    index = TimeIndex()
+    build, _ = timed(lambda: index.add_many(history))
+    refresh, _ = timed(lambda: index.add_many(new))
+    newest, _ = timed(lambda: index.newest(50))
+    middle = index.all.times[len(index.all.times) // 2]
+    date_range, found = timed(lambda: index.between(middle, middle + 3600))
+
+    print(f"{n:>9} messages | sorted(key=sort_key): {old_refresh * 1000:9.1f} ms | "
+          f"index build: {build * 1000:8.1f} ms | index refresh: {refresh * 1000:6.3f} ms | "
+          f"newest(50): {newest * 1000:6.3f} ms | 1h range ({len(found)}): {date_range * 1000:6.3f} ms")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    for n in sizes:
+        run(n)
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_chatdb import GROUPS, HANDLES, make_chat_db
+from bench_pixel_classifier import SIZES as SCREEN_SIZES
+from bench_pixel_classifier import TOKEN_COLORS, make_title_bar
+
+USAGE = 'usage: python benchmarks/generate.py OUT_DIR [MESSAGES] [--attachments]'
+
+
+def generate(out_dir, n, attachments=False, handles=HANDLES, groups=GROUPS, seed=0):
+    # Everything the server reads, made up: OUT_DIR/chat.db in Apple's
+    # schema, optionally with its photos under OUT_DIR/Attachments, and
+    # title bar screenshots of each token colour at each screen size under
+    # OUT_DIR/screenshots. Point DB_FILEPATH at the chat.db to run the
+    # server against it.
+    os.makedirs(out_dir, exist_ok=True)
+    db_path = os.path.join(out_dir, 'chat.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    attachments_dir = os.path.join(out_dir, 'Attachments') if attachments else None
+    make_chat_db(db_path, n, handles, groups, seed, attachments_dir=attachments_dir)
+
+    screenshots = os.path.join(out_dir, 'screenshots')
+    os.makedirs(screenshots, exist_ok=True)
+    for width, height in SCREEN_SIZES:
+        for kind in TOKEN_COLORS:
+            make_title_bar(width, height, kind, seed).save(
+                os.path.join(screenshots, f'title_bar_{kind}_{width}x{height}.png'))
+    return db_path
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not args:
+        sys.exit(USAGE)
+    n = int(args[1]) if len(args) > 1 else 100_000
+    print(generate(args[0], n, attachments='--attachments' in sys.argv))
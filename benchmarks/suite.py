@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_chatdb import add_messages, make_chat_db
+
+# Runs the whole stack against synthetic data and writes one JSON file of
+# results, so runs on different commits can be compared:
+#
+#     python benchmarks/suite.py results.json [SIZE ...]
+#     python benchmarks/suite.py results.json --compare baseline.json
+#
+# Each size gets a fresh chat.db and its own server process (with the
+# AppleScript stub backend), so memory numbers don't carry over between
+# sizes. --compare exits 1 if anything is more than THRESHOLD worse.
+
+SIZES = [10_000, 100_000]
+REFRESHES = 20
+NEW_PER_REFRESH = 20
+IDLE_PASSES = 20
+REQUESTS = 50
+CLASSIFY_SECONDS = 1.0
+THRESHOLD = 0.2
+HEADERS = {'Api-Key': 'bench'}
+
+# The same reads the clients make, (name, path)
+QUERIES = [
+    ('messages', '/messages?num_messages=50'),
+    ('messages_handle', '/messages?num_messages=50&handle=%2B15550000042'),
+    ('recent_contacts', '/recent_contacts?num_contacts=50'),
+    ('conversations', '/conversations?num_conversations=50'),
+    ('search', '/search?q=dinner%20tonight&limit=20'),
+    ('export_1000', '/messages/export?start={start}'),
+]
+
+
+def result(name, value, unit, size=None, higher_is_better=False):
+    return {'name': name, 'size': size, 'value': round(value, 4), 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def rss_bytes():
+    # Current resident set size where /proc has it, peak elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def histogram_totals(histogram):
+    # (sum, count) over every series of a metrics.Histogram
+    with histogram.lock:
+        series = list(histogram.series.values())
+    return sum(s[1] for s in series), sum(s[2] for s in series)
+
+
+def run_server(db_path, n, tmp):
+    # Runs in the child process: imports the server against db_path and
+    # returns its results
+    os.environ.update(DB_FILEPATH=db_path, PASSWORD=HEADERS['Api-Key'], YOUR_NAME='Bench', SNAPSHOT_FILEPATH='',
+                      APPLESCRIPT_BACKEND='stub', CAPABILITY_CACHE_FILEPATH=os.path.join(tmp, 'capabilities.json'))
+    import flask
+    import PIL.Image
+    baseline = rss_bytes()
+    import ingest
+    import server
+    server.ready.wait()
+    cold = server.startup['seconds_to_ready']
+    results = [
+        result('ingest_cold', cold * 1000, 'ms', n),
+        result('ingest_throughput', n / cold, 'messages/s', n, higher_is_better=True),
+        result('memory_rss', (rss_bytes() - baseline) / 2**20, 'MB', n),
+        result('memory_per_message', (rss_bytes() - baseline) / n, 'bytes', n),
+    ]
+
+    # New messages written to chat.db until they are in every index,
+    # through the file watcher like in production
+    rng = random.Random(1)
+    members = {}
+    latencies = []
+    passes_before = histogram_totals(ingest.INGEST_SECONDS)
+    for i in range(REFRESHES):
+        first = n + 1 + i * NEW_PER_REFRESH
+        start = time.perf_counter()
+        add_messages(db_path, first, NEW_PER_REFRESH, rng, members=members)
+        while server.ingestor.last_rowid < first + NEW_PER_REFRESH - 1:
+            time.sleep(0.0005)
+        with server.ingestor.lock:
+            latencies.append(time.perf_counter() - start)
+    total, count = histogram_totals(ingest.INGEST_SECONDS)
+    results += [
+        result('refresh_latency_p50', median(latencies) * 1000, 'ms', n),
+        result('refresh_pass', (total - passes_before[0]) / max(1, count - passes_before[1]) * 1000, 'ms', n),
+    ]
+
+    # A pass that finds nothing new, what most passes are
+    idle = []
+    for _ in range(IDLE_PASSES):
+        start = time.perf_counter()
+        server.ingestor.ingest()
+        idle.append(time.perf_counter() - start)
+    results.append(result('refresh_idle_pass', median(idle) * 1000, 'ms', n))
+
+    client = server.app.test_client()
+    newest = server.messages.newest(1)[0][6]
+    for name, path in QUERIES:
+        path = path.format(start=newest - 1000 * 30)
+        timings = []
+        for _ in range(REQUESTS):
+            start = time.perf_counter()
+            response = client.get(path, headers=HEADERS)
+            response.get_data()
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, (path, response.status_code)
+        results += [
+            result(f'query_{name}_p50', median(timings) * 1000, 'ms', n),
+            result(f'query_{name}_p95', percentile(timings, 0.95) * 1000, 'ms', n),
+        ]
+
+    # Numbers with iMessage history (every handle not divisible by 3), so
+    # the first check answers from chat.db and the second from the cache
+    numbers = [f'+1555{i:07d}' for i in range(1, 3 * REQUESTS) if i % 3][:REQUESTS]
+    for source in ('db', 'cache'):
+        timings = []
+        for number in numbers:
+            start = time.perf_counter()
+            response = client.get(f'/check_imessage/{number}', headers=HEADERS)
+            timings.append(time.perf_counter() - start)
+            assert response.get_json()['source'] == source, response.get_json()
+        results.append(result(f'check_imessage_{source}_p50', median(timings) * 1000, 'ms', n))
+    return results
+
+
+def run_size(n):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'chat.db')
+        start = time.perf_counter()
+        make_chat_db(db_path, n)
+        print(f"{n} messages generated in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), '--server', db_path, str(n), tmp],
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run_pixel_classifier():
+    import pixel_classifier
+    from bench_pixel_classifier import SIZES as SCREEN_SIZES
+    from bench_pixel_classifier import TOKEN_COLORS, make_title_bar
+    results = []
+    for width, height in SCREEN_SIZES:
+        images = {kind: make_title_bar(width, height, kind) for kind in TOKEN_COLORS}
+        for kind, img in images.items():
+            blue, green = pixel_classifier.classify(img)
+            assert (blue > green) == (kind == 'imessage'), (kind, blue, green)
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < CLASSIFY_SECONDS:
+            for img in images.values():
+                pixel_classifier.classify(img)
+                count += 1
+        results.append(result(f'pixel_classify_{width}x{height}', count / (time.perf_counter() - start),
+                              'images/s', higher_is_better=True))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    # Results more than threshold worse than the same name and size in
+    # baseline, as (result, baseline value, relative change)
+    before = {(r['name'], r['size']): r['value'] for r in baseline['results']}
+    regressions = []
+    for r in results:
+        old = before.get((r['name'], r['size']))
+        if not old:
+            continue
+        change = (r['value'] - old) / old
+        if (-change if r['higher_is_better'] else change) > threshold:
+            regressions.append((r, old, change))
+    return regressions
+
+
+def main(out_path, sizes, baseline_path=None):
+    results = []
+    for n in sizes:
+        results += run_size(n)
+    results += run_pixel_classifier()
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(out_path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    for r in results:
+        size = f"{r['size']:>9}" if r['size'] else ' ' * 9
+        print(f"{r['name']:<32} {size} {r['value']:>14.3f} {r['unit']}")
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f))
+        for r, old, change in regressions:
+            print(f"REGRESSION {r['name']} ({r['size']}): {old} -> {r['value']} {r['unit']} ({change:+.0%})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--server']:
+        db_path, n, tmp = sys.argv[2], int(sys.argv[3]), sys.argv[4]
+        print(json.dumps(run_server(db_path, n, tmp)))
+        sys.stdout.flush()
+        # The server's ingest thread never exits on its own
+        os._exit(0)
+    args = sys.argv[1:]
+    baseline = None
+    if '--compare' in args:
+        i = args.index('--compare')
+        baseline = args[i + 1]
+        del args[i:i + 2]
+    if not args:
+        sys.exit('usage: python benchmarks/suite.py OUT.json [SIZE ...] [--compare BASELINE.json]')
+    sys.exit(main(args[0], [int(arg) for arg in args[1:]] or SIZES, baseline))
@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import threading
+import traceback
+from collections import OrderedDict
+
+
+class CapabilityCache:
+    # LRU of number -> (is_on_imessage, checked_at) with separate TTLs for
+    # yes and no answers, written to a JSON file so it survives restarts.
+    # Puts only mark the cache dirty; it is written save_delay seconds after
+    # the first one, so a bulk check writes the file a few times rather than
+    # once per number.
+    def __init__(self, path=None, max_entries=10000, positive_ttl=30 * 86400, negative_ttl=86400, save_delay=2):
+        self.path = path
+        self.max_entries = max_entries
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.save_delay = save_delay
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.timer = None
+        self.lock = threading.Lock()
+        # Held across the copy and the write, so saves land in order
+        self.save_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                for number, (value, checked_at) in json.load(f):
+                    self.entries[number] = (value, checked_at)
+        except Exception as e:
+            print(f"Error loading capability cache {self.path}: {e}")
+            traceback.print_exc()
+
+    def save(self):
+        # Writes the file if anything changed since the last save. Only the
+        # copy of the entries happens under self.lock, so lookups don't wait
+        # for the disk.
+        with self.save_lock:
+            with self.lock:
+                self.timer = None
+                if not self.path or not self.dirty:
+                    return
+                self.dirty = False
+                data = [[number, list(entry)] for number, entry in self.entries.items()]
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Error saving capability cache {self.path}: {e}")
+                with self.lock:
+                    self.dirty = True
+
+    def get(self, number):
+        with self.lock:
+            entry = self.entries.get(number)
+            if entry is None:
+                return None
+            value, checked_at = entry
+            ttl = self.positive_ttl if value else self.negative_ttl
+            if time.time() - checked_at > ttl:
+                del self.entries[number]
+                return None
+            self.entries.move_to_end(number)
+            return value
+
+    def put(self, number, value):
+        with self.lock:
+            self.entries[number] = (bool(value), time.time())
+            self.entries.move_to_end(number)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+            if self.timer is not None or not self.path:
+                return
+            self.timer = threading.Timer(self.save_delay, self.save)
+            self.timer.daemon = True
+            self.timer.start()
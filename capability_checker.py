@@ -0,0 +1,226 @@
+import uuid
+import queue
+import threading
+import traceback
+from collections import OrderedDict
+import metrics
+from contacts import to_e164
+
+CANCELLED = 'cancelled'
+# Source of a UI check that failed or timed out: is_on_imessage is None
+ERROR = 'error'
+
+LOOKUPS = metrics.counter('imessage_capability_lookups_total', 'iMessage capability lookups by answer source', ['source'])
+UI_CHECK_SECONDS = metrics.histogram('imessage_ui_check_seconds', 'Time for one check through the Messages UI')
+
+
+class Flight:
+    # One in-progress lookup of a number, shared by everyone asking for it
+    def __init__(self, number):
+        self.number = number
+        self.result = None
+        self.waiters = 1
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def resolve(self, result):
+        with self.lock:
+            self.result = result
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+
+class CapabilityChecker:
+    # Answers "is this number on iMessage" from the cache, then chat.db,
+    # then the Messages UI. Concurrent lookups of the same number share one
+    # Flight, and UI checks run one at a time on a single worker thread
+    # since they all drive the same Messages window and screenshot file.
+    def __init__(self, cache, db_check, ui_check, country_code='1'):
+        self.cache = cache
+        # Numbers are looked up in the form chat.db keeps handles in, the
+        # same way contacts are, see contacts.to_e164
+        self.country_code = country_code
+        self.db_check = db_check
+        self.ui_check = ui_check
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.ui_queue = queue.Queue()
+        threading.Thread(target=self.ui_worker, daemon=True).start()
+
+    def submit(self, phone_number):
+        number = to_e164(phone_number, self.country_code)
+        if number is None:
+            raise ValueError(f'{phone_number!r} is not a phone number or email address')
+        with self.lock:
+            flight = self.inflight.get(number)
+            if flight is not None:
+                flight.waiters += 1
+                return flight
+            flight = Flight(number)
+            self.inflight[number] = flight
+
+        cached = self.cache.get(number)
+        if cached is not None:
+            self.finish(flight, (cached, 'cache'))
+            return flight
+        try:
+            if self.db_check(number):
+                self.cache.put(number, True)
+                self.finish(flight, (True, 'db'))
+                return flight
+        except Exception as e:
+            print(f"Error checking chat.db for {number}: {e}")
+        self.ui_queue.put(flight)
+        return flight
+
+    def release(self, flight):
+        # The caller no longer wants the answer; a queued UI check nobody
+        # is waiting for gets skipped
+        with self.lock:
+            flight.waiters -= 1
+
+    def lookup(self, phone_number):
+        flight = self.submit(phone_number)
+        flight.event.wait()
+        return flight.result
+
+    def finish(self, flight, result):
+        LOOKUPS.inc(source=result[1])
+        with self.lock:
+            if self.inflight.get(flight.number) is flight:
+                del self.inflight[flight.number]
+        flight.resolve(result)
+
+    def ui_worker(self):
+        while True:
+            flight = self.ui_queue.get()
+            with self.lock:
+                wanted = flight.waiters > 0
+            if not wanted:
+                self.finish(flight, (None, CANCELLED))
+                continue
+            try:
+                with UI_CHECK_SECONDS.time():
+                    is_imessage = self.ui_check(flight.number)
+            except Exception as e:
+                print(f"Error in UI check for {flight.number}: {e}")
+                traceback.print_exc()
+                is_imessage = None
+            # A check that couldn't tell is not a "no", and isn't cached
+            if is_imessage is None:
+                self.finish(flight, (None, ERROR))
+                continue
+            self.cache.put(flight.number, is_imessage)
+            self.finish(flight, (bool(is_imessage), 'ui'))
+
+
+class BulkJob:
+    def __init__(self, checker, numbers):
+        self.id = uuid.uuid4().hex
+        self.checker = checker
+        normalized = [(n, to_e164(n, checker.country_code)) for n in numbers if n.strip()]
+        self.numbers = list(OrderedDict.fromkeys(number for _, number in normalized if number is not None))
+        # Entries that are neither a number nor an address, as given
+        self.invalid = [n for n, number in normalized if number is None]
+        self.flights = []
+        self.results = []
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        for number in self.numbers:
+            with self.condition:
+                if self.cancelled:
+                    return
+            flight = self.checker.submit(number)
+            with self.condition:
+                self.flights.append(flight)
+            flight.add_done_callback(self.on_done)
+
+    def on_done(self, flight):
+        is_imessage, source = flight.result
+        with self.condition:
+            self.results.append({
+                'phone_number': flight.number,
+                'is_on_imessage': is_imessage,
+                'source': source,
+            })
+            self.condition.notify_all()
+
+    def cancel(self):
+        with self.condition:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            pending = [flight for flight in self.flights if not flight.event.is_set()]
+            self.condition.notify_all()
+        for flight in pending:
+            self.checker.release(flight)
+
+    def finished(self):
+        return self.cancelled or len(self.results) >= len(self.numbers)
+
+    def status(self):
+        with self.condition:
+            if self.cancelled:
+                state = CANCELLED
+            else:
+                state = 'done' if len(self.results) >= len(self.numbers) else 'running'
+            return {
+                'job_id': self.id,
+                'status': state,
+                'total': len(self.numbers),
+                'completed': len(self.results),
+                'invalid': list(self.invalid),
+            }
+
+    def iter_results(self, start=0, keepalive=15):
+        # Yields results as they finish, None every keepalive seconds
+        # without one so a streaming response can check the client is there
+        index = start
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.results) > index or self.finished(), keepalive)
+                new = self.results[index:]
+                finished = self.finished()
+            if not new and not finished:
+                yield None
+            for result in new:
+                yield result
+            index += len(new)
+            if finished and index >= len(self.results):
+                return
+
+
+class BulkJobs:
+    def __init__(self, checker, max_jobs=100):
+        self.checker = checker
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def start(self, numbers):
+        job = BulkJob(self.checker, numbers)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        job.start()
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
@@ -0,0 +1,312 @@
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+
+DEFAULT_PATH = os.path.expanduser('~/Library/Messages/chat.db')
+
+# chat.db stores dates as nanoseconds since 2001-01-01 UTC
+APPLE_EPOCH = 978307200
+NANOSECONDS = 1000000000
+
+ATTACHMENT_TEXT = "<Message with no text, but an attachment.>"
+# Placeholder Messages leaves in the text where an attachment goes
+OBJECT_REPLACEMENT = '\ufffc'
+
+# The row shape imessage_reader's FetchData produces, plus the message ROWID
+# and the unix timestamp so nothing has to parse the date string again.
+MESSAGE_COLUMNS = (
+    "message.ROWID, "
+    "text, "
+    "datetime((date / 1000000000) + 978307200, 'unixepoch', 'localtime'), "
+    "handle.id, "
+    "COALESCE(handle.service, message.service), "
+    "message.destination_caller_id, "
+    "message.is_from_me, "
+    "message.attributedBody, "
+    "message.cache_has_attachments, "
+    "(date / 1000000000) + 978307200 "
+)
+
+ATTACHMENT_COLUMNS = (
+    "attachment.ROWID, attachment.guid, attachment.filename, attachment.mime_type, "
+    "attachment.transfer_name, attachment.total_bytes "
+)
+
+# LEFT JOIN: messages we send to a group chat have no handle (handle_id 0)
+MESSAGES_FROM = (
+    "FROM message "
+    "LEFT JOIN handle on message.handle_id=handle.ROWID "
+)
+
+
+def to_apple_time(timestamp):
+    return (timestamp - APPLE_EPOCH) * NANOSECONDS
+
+
+def decode_attributed_body(blob):
+    # The text of newer messages is only stored inside the attributedBody
+    # typedstream blob: the NSString class name, a '+' type marker, then the
+    # length (one byte, or 0x81 + int16 / 0x82 + int32 little endian) and
+    # the UTF-8 bytes.
+    try:
+        start = blob.index(b'NSString')
+        text = blob[blob.index(b'+', start + len(b'NSString')) + 1:]
+        if text[0] == 0x81:
+            length = int.from_bytes(text[1:3], 'little')
+            text = text[3:length + 3]
+        elif text[0] == 0x82:
+            length = int.from_bytes(text[1:5], 'little')
+            text = text[5:length + 5]
+        else:
+            length = text[0]
+            text = text[1:length + 1]
+        return text.decode()
+    except (ValueError, IndexError, UnicodeDecodeError) as e:
+        print(f"Error decoding attributedBody: {e}")
+        return None
+
+
+def row_to_attachment(row):
+    # filename is stored with a leading ~ for the user's home directory;
+    # it is None for attachments that were never downloaded
+    rowid, guid, filename, mime_type, transfer_name, total_bytes = row
+    return {
+        'id': rowid,
+        'guid': guid,
+        'path': os.path.expanduser(filename) if filename else None,
+        'mime_type': mime_type or None,
+        'name': transfer_name or (os.path.basename(filename) if filename else None),
+        'size': total_bytes,
+    }
+
+
+def row_to_message(row):
+    # (user id, message, date, service, account, is_from_me, timestamp).
+    # Unlike imessage_reader, text sent along with an attachment is kept and
+    # the placeholder is only used when there is no text at all.
+    text = row[1]
+    if text is None and row[7] is not None:
+        text = decode_attributed_body(row[7])
+    if text is not None:
+        text = text.replace(OBJECT_REPLACEMENT, '').strip() or None
+    if text is None and row[8] == 1:
+        text = ATTACHMENT_TEXT
+    return (row[3], text, row[2], row[4], row[5], row[6], row[9])
+
+
+class ChatDB:
+    # Read-only access to chat.db. Connections are opened with mode=ro and
+    # kept in a small pool. They stay in autocommit mode so no read
+    # transaction outlives a query: every query sees the latest WAL
+    # contents, and Messages can still checkpoint the WAL.
+    def __init__(self, path, pool_size=4, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(pool_size)
+        self._columns = {}
+
+    def open(self):
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=self.timeout,
+                               isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self.open()
+        try:
+            yield conn
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        else:
+            try:
+                self.pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def query(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def scalar(self, sql, params=()):
+        rows = self.query(sql, params)
+        return rows[0][0] if rows else None
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def columns(self, table):
+        if table not in self._columns:
+            self._columns[table] = {row[1] for row in self.query(f"PRAGMA table_info({table})")}
+        return self._columns[table]
+
+    def journal_mode(self):
+        return self.scalar("PRAGMA journal_mode")
+
+    def max_rowid(self):
+        return self.scalar("SELECT MAX(ROWID) FROM message")
+
+    def messages_since(self, rowid, limit=None):
+        # [(rowid, message)] oldest first; pass the last rowid back in to
+        # fetch the next page
+        sql = "SELECT " + MESSAGE_COLUMNS + MESSAGES_FROM + "WHERE message.ROWID > ? ORDER BY message.ROWID"
+        params = [rowid]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [(row[0], row_to_message(row)) for row in self.query(sql, params)]
+
+    def edited_since(self, date_edited, max_rowid, sent_after=None):
+        # [(rowid, message, date_edited)] for messages edited or unsent since.
+        # sent_after (unix time) limits it to messages sent after then, which
+        # is an index range instead of a scan of the whole table.
+        if 'date_edited' not in self.columns('message'):
+            return []
+        sql = "SELECT " + MESSAGE_COLUMNS + ", message.date_edited " + MESSAGES_FROM + "WHERE message.date_edited > ? "
+        params = [date_edited, max_rowid]
+        if sent_after is None:
+            sql += "AND message.ROWID <= ?"
+        else:
+            # The unary + keeps SQLite from walking the ROWID range instead
+            sql += "AND +message.ROWID <= ? AND message.date > ?"
+            params.append(to_apple_time(sent_after))
+        return [(row[0], row_to_message(row), row[10]) for row in self.query(sql, params)]
+
+    def max_date_edited(self):
+        if 'date_edited' not in self.columns('message'):
+            return 0
+        return self.scalar("SELECT MAX(date_edited) FROM message") or 0
+
+    def message_rowids(self, max_rowid):
+        # The handle join is a LEFT JOIN, so every message row is a message
+        return [row[0] for row in self.query("SELECT ROWID FROM message WHERE ROWID <= ?", (max_rowid,))]
+
+    def count_messages(self, max_rowid):
+        return self.scalar("SELECT COUNT(*) FROM message WHERE ROWID <= ?", (max_rowid,))
+
+    def _page(self, where, params, before, limit):
+        # Keyset pagination newest first on the raw (date, ROWID). Returns
+        # ([(rowid, message)], cursor) where cursor is passed back as before
+        # for the next page, or None on the last page.
+        sql = "SELECT " + MESSAGE_COLUMNS + ", message.date " + MESSAGES_FROM + "WHERE " + where
+        params = list(params)
+        if before is not None:
+            # The extra date <= bound lets SQLite use it as an index range
+            sql += " AND message.date <= ? AND (message.date < ? OR message.ROWID < ?)"
+            params += [before[0], before[0], before[1]]
+        sql += " ORDER BY message.date DESC, message.ROWID DESC LIMIT ?"
+        params.append(limit)
+        rows = self.query(sql, params)
+        cursor = (rows[-1][10], rows[-1][0]) if rows and len(rows) == limit else None
+        return [(row[0], row_to_message(row)) for row in rows], cursor
+
+    def messages_for_handle(self, handle, before=None, limit=50):
+        return self._page("handle.id = ?", [handle], before, limit)
+
+    def messages_between(self, start=None, end=None, before=None, limit=50):
+        # start <= timestamp < end, unix seconds
+        where = ["1"]
+        params = []
+        if start is not None:
+            where.append("message.date >= ?")
+            params.append(to_apple_time(start))
+        if end is not None:
+            where.append("message.date < ?")
+            params.append(to_apple_time(end))
+        return self._page(" AND ".join(where), params, before, limit)
+
+    def has_imessage_history(self, handle):
+        return self.scalar(
+            "SELECT 1 FROM handle "
+            "JOIN message on message.handle_id=handle.ROWID "
+            "WHERE handle.id = ? AND handle.service = 'iMessage' "
+            "LIMIT 1", (handle,)) is not None
+
+    def attachment(self, rowid):
+        rows = self.query("SELECT " + ATTACHMENT_COLUMNS + "FROM attachment WHERE ROWID = ?", (rowid,))
+        return row_to_attachment(rows[0]) if rows else None
+
+    def attachments_for(self, message_rowid):
+        return [row_to_attachment(row) for row in self.query(
+            "SELECT " + ATTACHMENT_COLUMNS + "FROM message_attachment_join "
+            "JOIN attachment ON attachment.ROWID = message_attachment_join.attachment_id "
+            "WHERE message_attachment_join.message_id = ? ORDER BY attachment.ROWID", (message_rowid,))]
+
+    def chat_ids(self, rowids):
+        # {message rowid: chat ROWID}; a message in more than one chat goes
+        # with the oldest. Long lists scan the rowid range instead of IN.
+        rowids = sorted(rowids)
+        if not rowids:
+            return {}
+        sql = "SELECT message_id, MIN(chat_id) FROM chat_message_join WHERE "
+        if len(rowids) > 500:
+            wanted = set(rowids)
+            rows = self.query(sql + "message_id BETWEEN ? AND ? GROUP BY message_id", (rowids[0], rowids[-1]))
+            return {rowid: chat_id for rowid, chat_id in rows if rowid in wanted}
+        placeholders = ', '.join('?' * len(rowids))
+        return dict(self.query(sql + f"message_id IN ({placeholders}) GROUP BY message_id", rowids))
+
+    def chat_details(self, chat_ids):
+        # {chat ROWID: {chat_identifier, display_name, service, is_group, participants}}
+        chat_ids = list(chat_ids)
+        details = {}
+        for i in range(0, len(chat_ids), 500):
+            batch = chat_ids[i:i + 500]
+            placeholders = ', '.join('?' * len(batch))
+            for rowid, identifier, display_name, service, style in self.query(
+                    "SELECT ROWID, chat_identifier, display_name, service_name, style FROM chat "
+                    f"WHERE ROWID IN ({placeholders})", batch):
+                details[rowid] = {
+                    'chat_identifier': identifier,
+                    'display_name': display_name or None,
+                    # 43 is a group chat, 45 a one to one conversation
+                    'is_group': style == 43,
+                    'service': service,
+                    'participants': [],
+                }
+            for chat_id, handle in self.query(
+                    "SELECT chat_handle_join.chat_id, handle.id FROM chat_handle_join "
+                    "JOIN handle ON chat_handle_join.handle_id = handle.ROWID "
+                    f"WHERE chat_handle_join.chat_id IN ({placeholders}) ORDER BY handle.id", batch):
+                if chat_id in details:
+                    details[chat_id]['participants'].append(handle)
+        return details
+
+    def chats(self, before=None, limit=50):
+        # ([{chat}], cursor) most recently active first, paged like _page
+        # One index lookup per chat for its latest message rather than
+        # grouping all of chat_message_join
+        sql = (
+            "SELECT * FROM ("
+            "  SELECT chat.ROWID AS chat_rowid, chat.chat_identifier, chat.display_name, chat.service_name, "
+            "  (SELECT MAX(message_date) FROM chat_message_join WHERE chat_id = chat.ROWID) AS last_date "
+            "  FROM chat"
+            ") WHERE last_date IS NOT NULL "
+        )
+        params = []
+        if before is not None:
+            sql += "AND (last_date < ? OR (last_date = ? AND chat_rowid < ?)) "
+            params += [before[0], before[0], before[1]]
+        sql += "ORDER BY last_date DESC, chat_rowid DESC LIMIT ?"
+        params.append(limit)
+        rows = self.query(sql, params)
+        cursor = (rows[-1][4], rows[-1][0]) if rows and len(rows) == limit else None
+        return [
+            {
+                'chat_id': row[0],
+                'chat_identifier': row[1],
+                'display_name': row[2] or None,
+                'service': row[3],
+                'last_message_timestamp': row[4] // NANOSECONDS + APPLE_EPOCH,
+            }
+            for row in rows
+        ], cursor
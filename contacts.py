@@ -0,0 +1,263 @@
+import os
+import json
+import quopri
+import threading
+import traceback
+import unicodedata
+from bisect import bisect_left
+
+DEFAULT_PATH = 'contacts.json'
+
+
+def to_e164(value, country_code='1'):
+    # The form chat.db keeps handles in: +<country><number> for phone
+    # numbers, lowercased addresses for email, bare digits for short codes
+    value = value.strip()
+    if value.lower().startswith('tel:'):
+        value = value[4:]
+    if '@' in value:
+        return value.lower()
+    # Drop extensions and dial strings: "555 0100 ext. 12", "5550100;w12"
+    for mark in ('x', 'X', 'ext', ';', ',', 'p', 'w'):
+        value = value.split(mark, 1)[0]
+    digits = ''.join(c for c in value if c.isdigit())
+    if not digits:
+        return None
+    if value.lstrip().startswith('+'):
+        return '+' + digits
+    if len(digits) < 7:
+        return digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    if country_code == '1':
+        if digits.startswith('011'):
+            return '+' + digits[3:]
+        if len(digits) == 11 and digits.startswith('1'):
+            return '+' + digits
+        # Only a full 10 digit number can take the country code; anything
+        # else (a 7 digit local number) is kept as it is rather than made
+        # into a number that was never dialled
+        return '+1' + digits if len(digits) == 10 else digits
+    # Elsewhere a national number starts with the trunk prefix 0
+    return '+' + country_code + digits.lstrip('0')
+
+
+def fold(text):
+    # Case and accent insensitive form of a name: "Zoë" and "zoe" match
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+def unescape_vcard(value):
+    if '\\' not in value:
+        return value
+    out = []
+    chars = iter(value)
+    for c in chars:
+        if c == '\\':
+            c = next(chars, '')
+            out.append('\n' if c in 'nN' else c)
+        else:
+            out.append(c)
+    return ''.join(out)
+
+
+def vcard_lines(text):
+    # Unfolds continuation lines (RFC 6350 3.2) and quoted-printable soft
+    # line breaks from vCard 2.1 exports
+    lines = []
+    for line in text.splitlines():
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        elif lines and lines[-1].endswith('=') and 'QUOTED-PRINTABLE' in lines[-1].upper():
+            lines[-1] = lines[-1][:-1] + line
+        else:
+            lines.append(line)
+    return lines
+
+
+def parse_vcards(text):
+    # [(name, [(handle, preferred)])] for every card with a name and at
+    # least one phone number or email address
+    cards = []
+    card = None
+    for line in vcard_lines(text):
+        if ':' not in line:
+            continue
+        head, value = line.split(':', 1)
+        params = head.split(';')
+        prop = params[0].split('.')[-1].upper()
+        params = [param.upper() for param in params[1:]]
+        if 'ENCODING=QUOTED-PRINTABLE' in params:
+            value = quopri.decodestring(value.encode('latin-1')).decode('utf-8', 'replace')
+        if prop == 'BEGIN' and value.strip().upper() == 'VCARD':
+            card = {'fn': None, 'n': None, 'org': None, 'handles': []}
+        elif card is None:
+            continue
+        elif prop == 'END':
+            name = card['fn'] or card['n'] or card['org']
+            if name and card['handles']:
+                cards.append((name, card['handles']))
+            card = None
+        elif prop == 'FN':
+            card['fn'] = unescape_vcard(value).strip() or None
+        elif prop == 'N':
+            # Family;Given;Additional;Prefix;Suffix
+            parts = [unescape_vcard(part).strip() for part in value.split(';')] + [''] * 5
+            card['n'] = ' '.join(part for part in (parts[3], parts[1], parts[2], parts[0], parts[4]) if part) or None
+        elif prop == 'ORG':
+            card['org'] = unescape_vcard(value.split(';')[0]).strip() or None
+        elif prop in ('TEL', 'EMAIL'):
+            preferred = any('PREF' in param for param in params)
+            card['handles'].append((unescape_vcard(value), preferred))
+    return cards
+
+
+def parse_json(data):
+    # Either {"name": "number" or [numbers...]} or a list of objects with a
+    # name and any of handles/numbers/phones/phone/emails/email, the first
+    # handle being the one to send to
+    if isinstance(data, dict):
+        data = [{'name': name, 'numbers': value} for name, value in data.items()]
+    cards = []
+    for entry in data:
+        name = entry.get('name') or entry.get('full_name')
+        handles = []
+        for key in ('handles', 'numbers', 'phones', 'phone', 'emails', 'email'):
+            value = entry.get(key) or []
+            handles += [(handle, False) for handle in ([value] if isinstance(value, str) else value)]
+        if name and handles:
+            cards.append((name, handles))
+    return cards
+
+
+def parse_file(path):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    if path.lower().endswith(('.vcf', '.vcard')) or text.lstrip().upper().startswith('BEGIN:VCARD'):
+        return parse_vcards(text)
+    return parse_json(json.loads(text))
+
+
+class Contact:
+    __slots__ = ('name', 'handles')
+
+    def __init__(self, name, handles):
+        self.name = name
+        self.handles = handles
+
+    def to_dict(self):
+        return {'name': self.name, 'handles': list(self.handles)}
+
+
+class Contacts:
+    # One immutable set of indexes; ContactIndex swaps in a new one on
+    # reload, so readers never see a half-built index and never lock
+    def __init__(self, cards=(), country_code='1'):
+        self.contacts = []
+        self.by_handle = {}
+        self.by_name = {}
+        self.by_folded = {}
+        # Sorted (folded word, contact position) for prefix matching
+        self.words = []
+        for name, raw_handles in cards:
+            handles = []
+            # Preferred numbers first, otherwise in file order
+            for handle, _ in sorted(raw_handles, key=lambda handle: not handle[1]):
+                handle = to_e164(handle, country_code)
+                if handle and handle not in handles:
+                    handles.append(handle)
+            if not handles:
+                continue
+            i = len(self.contacts)
+            contact = Contact(name.strip(), tuple(handles))
+            self.contacts.append(contact)
+            for handle in handles:
+                self.by_handle.setdefault(handle, contact.name)
+            self.by_name.setdefault(contact.name, []).append(i)
+            folded = fold(contact.name)
+            self.by_folded.setdefault(folded, []).append(i)
+            self.words += [(word, i) for word in set(folded.split())]
+        self.words.sort()
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def prefix(self, query):
+        # Contacts where every word of the query starts some word of the
+        # name: "jo d" finds "John Doe" and "Jo Dunn"
+        terms = fold(query).split()
+        if not terms:
+            return []
+        matches = None
+        for term in terms:
+            found = set()
+            i = bisect_left(self.words, (term,))
+            while i < len(self.words) and self.words[i][0].startswith(term):
+                found.add(self.words[i][1])
+                i += 1
+            matches = found if matches is None else matches & found
+            if not matches:
+                return []
+        return sorted(matches)
+
+    def exact(self, name):
+        return [self.contacts[i] for i in self.by_name.get(name.strip(), [])]
+
+    def resolve(self, name):
+        # Exact name, then case and accent insensitive, then prefix; the
+        # first that matches anything wins
+        positions = self.by_name.get(name.strip()) or self.by_folded.get(fold(name)) or self.prefix(name)
+        return [self.contacts[i] for i in positions]
+
+
+class ContactIndex:
+    # Contacts from a vCard or JSON export, reloaded when the file changes
+    def __init__(self, path=DEFAULT_PATH, country_code='1'):
+        self.path = path
+        self.country_code = country_code
+        self.current = Contacts()
+        self.signature = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.current)
+
+    def stat(self):
+        try:
+            st = os.stat(self.path)
+        except (OSError, TypeError):
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def reload(self):
+        # True if the file changed and was loaded. A file that fails to
+        # parse keeps the contacts from the last good one.
+        with self.lock:
+            signature = self.stat()
+            if signature == self.signature:
+                return False
+            self.signature = signature
+            if signature is None:
+                self.current = Contacts()
+                return True
+            try:
+                cards = parse_file(self.path)
+                if not cards and signature[1]:
+                    raise ValueError('no contacts with a name and a number or email found')
+                self.current = Contacts(cards, self.country_code)
+            except Exception as e:
+                print(f"Error loading contacts {self.path}: {e}")
+                traceback.print_exc()
+                return False
+            print(f"Loaded {len(self.current)} contacts from {self.path}")
+            return True
+
+    def name_for(self, handle):
+        return self.current.by_handle.get(handle)
+
+    def exact(self, name):
+        return self.current.exact(name)
+
+    def resolve(self, name):
+        return self.current.resolve(name)
@@ -0,0 +1,126 @@
+import threading
+from message_index import TIMESTAMP, Ordering, encode_cursor
+
+# Position of is_from_me in a message tuple:
+# (user id, message, date, service, account, is_from_me, timestamp)
+IS_FROM_ME = 5
+
+
+class Conversation:
+    # Running totals for one chat. The messages themselves stay in the
+    # TimeIndex; this only keeps (timestamp, rowid) so the last message can
+    # be found again when it's deleted.
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.details = {}
+        self.messages = Ordering()
+        self.sent = 0
+        self.last_activity = None
+
+    def last(self):
+        return self.messages.last()
+
+    def summary(self):
+        return dict(
+            self.details,
+            chat_id=self.chat_id,
+            message_count=len(self.messages),
+            sent_count=self.sent,
+            received_count=len(self.messages) - self.sent,
+        )
+
+
+class ConversationIndex:
+    # One summary per chat, group chats included, kept up to date from the
+    # ingest delta: chat_db is only asked which chat new messages belong to
+    # and for the details of chats that changed.
+    def __init__(self, chat_db):
+        self.chat_db = chat_db
+        self.conversations = {}
+        self.chat_of = {}
+        self.from_me = set()
+        self.recent = Ordering()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.conversations)
+
+    def update(self, added, changed, removed):
+        # Ingest listener. Edits keep their chat, date and sender, so only
+        # messages we haven't placed yet are looked up.
+        new = {rowid: message for rowid, message in list(added.items()) + list(changed.items())
+               if rowid not in self.chat_of}
+        chat_ids = self.chat_db.chat_ids(new)
+        with self.lock:
+            touched = set()
+            for rowid in removed:
+                chat_id = self.chat_of.pop(rowid, None)
+                if chat_id is not None:
+                    touched.add(chat_id)
+                    self._remove(chat_id, rowid)
+            by_chat = {}
+            for rowid, chat_id in chat_ids.items():
+                message = new[rowid]
+                self.chat_of[rowid] = chat_id
+                by_chat.setdefault(chat_id, []).append((message[TIMESTAMP], rowid))
+                if message[IS_FROM_ME]:
+                    self.from_me.add(rowid)
+                    self.conversation(chat_id).sent += 1
+            for chat_id, pairs in by_chat.items():
+                self.conversation(chat_id).messages.insert_many(sorted(pairs))
+                touched.add(chat_id)
+            for rowid in changed:
+                chat_id = self.chat_of.get(rowid)
+                if chat_id is not None:
+                    touched.add(chat_id)
+        # Names and participants can change along with any new message
+        details = self.chat_db.chat_details(touched)
+        with self.lock:
+            for chat_id in touched:
+                self._update_recent(chat_id, details.get(chat_id))
+
+    def conversation(self, chat_id):
+        conversation = self.conversations.get(chat_id)
+        if conversation is None:
+            conversation = self.conversations[chat_id] = Conversation(chat_id)
+        return conversation
+
+    def _remove(self, chat_id, rowid):
+        conversation = self.conversations[chat_id]
+        ordering = conversation.messages
+        ordering.remove(ordering.times[ordering.keys.index(rowid)], rowid)
+        if rowid in self.from_me:
+            self.from_me.discard(rowid)
+            conversation.sent -= 1
+
+    def _update_recent(self, chat_id, details):
+        conversation = self.conversations.get(chat_id)
+        if conversation is None:
+            return
+        if details is not None:
+            conversation.details = details
+        if conversation.last_activity is not None:
+            self.recent.remove(conversation.last_activity, chat_id)
+        last = conversation.last()
+        if last is None:
+            del self.conversations[chat_id]
+            return
+        conversation.last_activity = last[0]
+        self.recent.insert_many([(last[0], chat_id)])
+
+    def get(self, chat_id):
+        # (summary, last message rowid) or None
+        with self.lock:
+            conversation = self.conversations.get(chat_id)
+            if conversation is None:
+                return None
+            return conversation.summary(), conversation.last()[1]
+
+    def page(self, n, before=None):
+        # [(summary, last message rowid)] most recently active first, plus
+        # the cursor for the next page
+        with self.lock:
+            pairs = self.recent.newest(n, before)
+            page = [self.get(chat_id) for _, chat_id in pairs]
+            cursor = encode_cursor(*pairs[-1]) if pairs and len(pairs) == n else None
+            return page, cursor
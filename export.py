@@ -0,0 +1,75 @@
+import io
+import csv
+import json
+import zlib
+from message_index import TIMESTAMP, encode_cursor
+
+CHUNK_SIZE = 1000
+CSV_FIELDS = ('id', 'cursor', 'timestamp', 'date', 'sender', 'handle', 'contact_name', 'service', 'is_from_me', 'message')
+
+
+def iter_messages(index, handle=None, sent=True, start=None, end=None, before=None, chunk_size=CHUNK_SIZE):
+    # (rowid, message) newest first with start <= timestamp < end and older
+    # than the before cursor. The index is locked one chunk at a time, so
+    # ingest carries on during a long export and memory stays at a chunk.
+    if end is not None and (before is None or (end, 0) < before):
+        before = (end, 0)
+    while True:
+        chunk = index.items(chunk_size, before, handle=handle, sent=sent)
+        for rowid, message in chunk:
+            if start is not None and message[TIMESTAMP] < start:
+                return
+            yield rowid, message
+        if len(chunk) < chunk_size:
+            return
+        rowid, message = chunk[-1]
+        before = (message[TIMESTAMP], rowid)
+
+
+def with_cursor(rowid, message, format_message):
+    # Any line's cursor passed back as before resumes after that line
+    return dict(format_message(message), id=rowid, cursor=encode_cursor(message[TIMESTAMP], rowid))
+
+
+def ndjson_chunks(messages, format_message, chunk_size=CHUNK_SIZE):
+    lines = []
+    for rowid, message in messages:
+        lines.append(json.dumps(with_cursor(rowid, message, format_message)) + '\n')
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def csv_chunks(messages, format_message, chunk_size=CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    rows = 0
+    for rowid, message in messages:
+        writer.writerow(with_cursor(rowid, message, format_message))
+        rows += 1
+        if rows >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzipped(chunks, level=6):
+    # One gzip stream over all the chunks, compressed as they come
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+FORMATS = {
+    'ndjson': (ndjson_chunks, 'application/x-ndjson'),
+    'csv': (csv_chunks, 'text/csv'),
+}
@@ -0,0 +1,24 @@
+import sys
+import json
+import contacts
+
+# Turns an iCloud vCard export into the contacts.json the server reads:
+#
+#     python3 icloud_parser.py [contacts.vcf] [contacts.json]
+#
+# The server can also read the .vcf directly (CONTACTS_FILEPATH=contacts.vcf);
+# the JSON is smaller and easy to edit by hand.
+
+
+def convert(src, dst):
+    # Numbers are normalized the same way the server does on load
+    index = contacts.Contacts(contacts.parse_file(src))
+    with open(dst, 'w') as f:
+        json.dump([contact.to_dict() for contact in index.contacts], f, indent=1, ensure_ascii=False)
+    return len(index)
+
+
+if __name__ == '__main__':
+    src = sys.argv[1] if len(sys.argv) > 1 else 'contacts.vcf'
+    dst = sys.argv[2] if len(sys.argv) > 2 else contacts.DEFAULT_PATH
+    print(f"Wrote {convert(src, dst)} contacts to {dst}")
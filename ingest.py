@@ -0,0 +1,121 @@
+import time
+import threading
+import traceback
+import metrics
+import snapshot
+from message_index import TimeIndex
+
+INGEST_SECONDS = metrics.histogram('imessage_ingest_seconds', 'Time for one ingest pass over chat.db')
+INDEX_UPDATE_SECONDS = metrics.histogram(
+    'imessage_index_update_seconds', 'Time merging one pass into the sorted message index')
+LISTENER_SECONDS = metrics.histogram(
+    'imessage_ingest_listener_seconds', 'Time in each ingest listener per pass', ['listener'])
+INGESTED = metrics.counter('imessage_ingested_messages_total', 'Messages picked up by ingest passes', ['change'])
+
+
+# Messages can be edited for 15 minutes after sending and unsent for 2, so
+# between full scans only messages sent this long before the previous pass
+# are checked for edits
+EDIT_WINDOW = 20 * 60
+
+
+class MessageIngestor:
+    def __init__(self, chat_db, deletion_check_interval=12):
+        self.chat_db = chat_db
+        self.deletion_check_interval = deletion_check_interval
+        self.last_rowid = 0
+        self.last_edit = 0
+        self.last_edit_scan = None
+        self.messages = TimeIndex()
+        self.passes = 0
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def add_listener(self, listener):
+        # listener(added, changed, removed) runs after every pass that saw
+        # a change, on the ingest thread
+        self.listeners.append(listener)
+
+    def restore(self, path):
+        # Starts from a snapshot saved by save() so the first ingest only
+        # has to catch up on what changed since. False if there was none.
+        loaded = snapshot.load(path)
+        if loaded is None:
+            return False
+        index, header = loaded
+        if header['db_filepath'] != self.chat_db.path or header['last_rowid'] > (self.chat_db.max_rowid() or 0):
+            print(f"Ignoring snapshot {path}: it was taken from a different chat.db")
+            return False
+        with self.lock:
+            self.messages = index
+            self.last_rowid = header['last_rowid']
+            self.last_edit = header['last_edit']
+        return True
+
+    def save(self, path):
+        with self.lock:
+            snapshot.save(self.messages, path, db_filepath=self.chat_db.path,
+                          last_rowid=self.last_rowid, last_edit=self.last_edit)
+
+    def ingest(self):
+        with self.lock:
+            with INGEST_SECONDS.time():
+                added, changed, removed = self._ingest()
+            INGESTED.inc(len(added), change='added')
+            INGESTED.inc(len(changed), change='changed')
+            INGESTED.inc(len(removed), change='removed')
+            if added or changed or removed:
+                for listener in self.listeners:
+                    start = time.perf_counter()
+                    try:
+                        listener(added, changed, removed)
+                    except Exception as e:
+                        print(f"Error in ingest listener {listener}: {e}")
+                        traceback.print_exc()
+                    LISTENER_SECONDS.observe(time.perf_counter() - start,
+                                             listener=getattr(listener, '__qualname__', repr(listener)))
+            return added, changed, removed
+
+    def _ingest(self):
+        # The watermark only moves to rows actually fetched: MAX(ROWID) from
+        # a separate query can include a row committed after this one ran
+        added = dict(self.chat_db.messages_since(self.last_rowid))
+        if added:
+            self.last_rowid = max(self.last_rowid, max(added))
+
+        # date_edited has no index, so a scan of every message only runs
+        # with the deletion check; other passes look at recent messages
+        # through the date index
+        self.passes += 1
+        full_check = self.passes % self.deletion_check_interval == 0
+        sent_after = None
+        if self.last_edit_scan is not None and not full_check:
+            sent_after = self.last_edit_scan - EDIT_WINDOW
+        self.last_edit_scan = time.time()
+
+        changed = {}
+        if len(self.messages):
+            for rowid, message, date_edited in self.chat_db.edited_since(self.last_edit, self.last_rowid, sent_after):
+                self.last_edit = max(self.last_edit, date_edited)
+                if self.messages.get(rowid) is not None and rowid not in added:
+                    changed[rowid] = message
+        else:
+            self.last_edit = self.chat_db.max_date_edited()
+
+        with INDEX_UPDATE_SECONDS.time():
+            self.messages.add_many(added)
+            self.messages.add_many(changed)
+
+        # After the adds, so the count below compares like with like
+        removed = set()
+        if len(self.messages) and full_check:
+            removed = self._find_deleted()
+            with INDEX_UPDATE_SECONDS.time():
+                self.messages.remove_many(removed)
+        return added, changed, removed
+
+    def _find_deleted(self):
+        if self.chat_db.count_messages(self.last_rowid) >= len(self.messages):
+            return set()
+        present = set(self.chat_db.message_rowids(self.last_rowid))
+        return set(self.messages.store.slots) - present
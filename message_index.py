@@ -0,0 +1,229 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from message_store import MessageStore
+
+# Position of the epoch timestamp parsed at ingest time in a message tuple:
+# (user id, message, date, service, account, is_from_me, timestamp)
+TIMESTAMP = 6
+
+
+def encode_cursor(timestamp, key):
+    return f'{timestamp}:{key}'
+
+
+def decode_cursor(cursor):
+    # Raises ValueError on anything that isn't 'timestamp:key'
+    if not cursor:
+        return None
+    timestamp, key = cursor.split(':')
+    return int(timestamp), int(key)
+
+
+class Ordering:
+    # (timestamp, key) pairs kept ascending in two parallel int64 arrays
+    def __init__(self):
+        self.times = array('q')
+        self.keys = array('q')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def position(self, timestamp, key):
+        lo = bisect_left(self.times, timestamp)
+        hi = bisect_right(self.times, timestamp, lo)
+        return bisect_left(self.keys, key, lo, hi)
+
+    def insert_many(self, pairs):
+        # pairs must be sorted
+        if not pairs:
+            return
+        if not self.times or pairs[0] >= (self.times[-1], self.keys[-1]):
+            # Common case, everything new is newer than what we have
+            self.times.extend(t for t, _ in pairs)
+            self.keys.extend(k for _, k in pairs)
+        elif len(pairs) < 64:
+            for timestamp, key in pairs:
+                i = self.position(timestamp, key)
+                self.times.insert(i, timestamp)
+                self.keys.insert(i, key)
+        else:
+            merged = sorted(list(zip(self.times, self.keys)) + pairs)
+            self.times = array('q', (t for t, _ in merged))
+            self.keys = array('q', (k for _, k in merged))
+
+    def remove(self, timestamp, key):
+        i = self.position(timestamp, key)
+        if i < len(self.keys) and self.keys[i] == key and self.times[i] == timestamp:
+            del self.times[i]
+            del self.keys[i]
+
+    def last(self):
+        if not self.keys:
+            return None
+        return self.times[-1], self.keys[-1]
+
+    def newest(self, n, before=None):
+        # Up to n pairs strictly older than the before cursor, newest first
+        hi = len(self.keys) if before is None else self.position(*before)
+        lo = max(0, hi - n)
+        return [(self.times[i], self.keys[i]) for i in range(hi - 1, lo - 1, -1)]
+
+    def between(self, start=None, end=None, limit=None):
+        # Pairs with start <= timestamp < end, newest first
+        lo = 0 if start is None else bisect_left(self.times, start)
+        hi = len(self.times) if end is None else bisect_left(self.times, end)
+        if limit is not None:
+            lo = max(lo, hi - limit)
+        return [(self.times[i], self.keys[i]) for i in range(hi - 1, lo - 1, -1)]
+
+
+class TimeIndex:
+    # Messages ordered by (timestamp, rowid). Alongside the full ordering it
+    # keeps one per handle, a received-only split of each, and the handles
+    # themselves ordered by their last activity, all updated on every ingest.
+    # Iterating yields newest first, the same order the old sorted list had.
+    def __init__(self):
+        self.all = Ordering()
+        self.received = Ordering()
+        self.by_handle = {}
+        self.received_by_handle = {}
+        self.recent_handles = Ordering()
+        self.last_activity = {}
+        self.store = MessageStore()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.all)
+
+    def __iter__(self):
+        return iter(self.newest(len(self.all)))
+
+    def __getitem__(self, i):
+        with self.lock:
+            n = len(self.all)
+            rowids = self.all.keys
+            if isinstance(i, slice):
+                return [self.store.get(rowids[n - 1 - j]) for j in range(*i.indices(n))]
+            if i < 0:
+                i += n
+            if not 0 <= i < n:
+                raise IndexError('message index out of range')
+            return self.store.get(rowids[n - 1 - i])
+
+    def get(self, rowid):
+        with self.lock:
+            return self.store.get(rowid)
+
+    def handle_id(self, user_id):
+        return self.store.handles.lookup(user_id)
+
+    def add_many(self, added):
+        # added: {rowid: message}
+        if not added:
+            return
+        with self.lock:
+            touched = set()
+            for rowid, message in added.items():
+                if rowid in self.store:
+                    touched.add(self._remove(rowid))
+                self.store.put(rowid, message)
+            new = sorted((message[TIMESTAMP], rowid) for rowid, message in added.items())
+            received = []
+            by_handle = {}
+            received_by_handle = {}
+            for timestamp, rowid in new:
+                slot = self.store.slots[rowid]
+                handle = self.store.handle[slot]
+                by_handle.setdefault(handle, []).append((timestamp, rowid))
+                if not self.store.is_from_me[slot]:
+                    received.append((timestamp, rowid))
+                    received_by_handle.setdefault(handle, []).append((timestamp, rowid))
+            self.all.insert_many(new)
+            self.received.insert_many(received)
+            for handle, pairs in by_handle.items():
+                self.by_handle.setdefault(handle, Ordering()).insert_many(pairs)
+                touched.add(handle)
+            for handle, pairs in received_by_handle.items():
+                self.received_by_handle.setdefault(handle, Ordering()).insert_many(pairs)
+            self._update_recent(touched)
+
+    def _remove(self, rowid):
+        slot = self.store.slots[rowid]
+        timestamp = self.store.timestamp[slot]
+        handle = self.store.handle[slot]
+        self.all.remove(timestamp, rowid)
+        self.by_handle[handle].remove(timestamp, rowid)
+        if not self.store.is_from_me[slot]:
+            self.received.remove(timestamp, rowid)
+            self.received_by_handle[handle].remove(timestamp, rowid)
+        self.store.remove(rowid)
+        return handle
+
+    def remove_many(self, rowids):
+        with self.lock:
+            touched = set()
+            for rowid in rowids:
+                if rowid in self.store:
+                    touched.add(self._remove(rowid))
+            self._update_recent(touched)
+
+    def _update_recent(self, handles):
+        for handle in handles:
+            previous = self.last_activity.pop(handle, None)
+            if previous is not None:
+                self.recent_handles.remove(previous, handle)
+            last = self.by_handle[handle].last()
+            # Messages we sent to a group chat have no handle
+            if last is not None and self.store.handles.values[handle] is not None:
+                self.last_activity[handle] = last[0]
+                self.recent_handles.insert_many([(last[0], handle)])
+
+    def _ordering(self, handle=None, sent=True):
+        if handle is None:
+            return self.all if sent else self.received
+        orderings = self.by_handle if sent else self.received_by_handle
+        return orderings.get(handle)
+
+    def newest(self, n, before=None, handle=None, sent=True):
+        # handle is an interned handle id, see handle_id()
+        with self.lock:
+            ordering = self._ordering(handle, sent)
+            if ordering is None:
+                return []
+            return [self.store.get(rowid) for _, rowid in ordering.newest(n, before)]
+
+    def page(self, n, before=None, handle=None, sent=True):
+        # Like newest() but also returns the cursor for the next page
+        with self.lock:
+            ordering = self._ordering(handle, sent)
+            pairs = [] if ordering is None else ordering.newest(n, before)
+            messages = [self.store.get(rowid) for _, rowid in pairs]
+            cursor = encode_cursor(*pairs[-1]) if pairs and len(pairs) == n else None
+            return messages, cursor
+
+    def items(self, n, before=None, handle=None, sent=True):
+        # Like newest() but [(rowid, message)], for callers that keep
+        # their own cursor
+        with self.lock:
+            ordering = self._ordering(handle, sent)
+            if ordering is None:
+                return []
+            return [(rowid, self.store.get(rowid)) for _, rowid in ordering.newest(n, before)]
+
+    def between(self, start=None, end=None, limit=None, handle=None, sent=True):
+        # Messages with start <= timestamp < end, newest first
+        with self.lock:
+            ordering = self._ordering(handle, sent)
+            if ordering is None:
+                return []
+            return [self.store.get(rowid) for _, rowid in ordering.between(start, end, limit)]
+
+    def recent_contacts(self, n, before=None):
+        # [(user id, last message timestamp)] most recently active first,
+        # plus the cursor for the next page
+        with self.lock:
+            pairs = self.recent_handles.newest(n, before)
+            contacts = [(self.store.handles.values[handle], timestamp) for timestamp, handle in pairs]
+            cursor = encode_cursor(*pairs[-1]) if pairs and len(pairs) == n else None
+            return contacts, cursor
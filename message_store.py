@@ -0,0 +1,126 @@
+import time
+from array import array
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class Interner:
+    # Maps repeated strings (handles, services, accounts) to small ints
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        i = self.ids.get(value)
+        if i is None:
+            i = len(self.values)
+            self.values.append(value)
+            self.ids[value] = i
+        return i
+
+    def lookup(self, value):
+        return self.ids.get(value)
+
+
+class MessageStore:
+    # Column store for message tuples. Every message gets a slot; columns
+    # are typed arrays indexed by slot and the message bodies share one
+    # UTF-8 buffer. Tuples are only materialized when asked for, in the
+    # same (user id, message, date, service, account, is_from_me, timestamp)
+    # shape imessage_reader uses.
+    def __init__(self):
+        self.handles = Interner()
+        self.services = Interner()
+        self.accounts = Interner()
+        self.slots = {}
+        self.rowid = array('q')
+        self.timestamp = array('q')
+        self.handle = array('i')
+        self.service = array('i')
+        self.account = array('i')
+        self.is_from_me = array('b')
+        self.text_start = array('q')
+        self.text_length = array('i')
+        self.text = bytearray()
+        self.dead_text = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, rowid):
+        return rowid in self.slots
+
+    def put(self, rowid, message):
+        user_id, text, _, service, account, is_from_me, timestamp = message
+        if rowid in self.slots:
+            self.remove(rowid)
+        self.slots[rowid] = len(self.rowid)
+        self.rowid.append(rowid)
+        self.timestamp.append(timestamp)
+        self.handle.append(self.handles.intern(user_id))
+        self.service.append(self.services.intern(service))
+        self.account.append(self.accounts.intern(account))
+        self.is_from_me.append(is_from_me)
+        if text is None:
+            self.text_start.append(0)
+            self.text_length.append(-1)
+        else:
+            encoded = text.encode()
+            self.text_start.append(len(self.text))
+            self.text_length.append(len(encoded))
+            self.text += encoded
+
+    def remove(self, rowid):
+        slot = self.slots.pop(rowid)
+        self.dead_text += max(0, self.text_length[slot])
+        self.rowid[slot] = -1
+        if self.dead_text > 1 << 20 and self.dead_text > len(self.text) // 2:
+            self.compact()
+
+    def text_at(self, slot):
+        length = self.text_length[slot]
+        if length < 0:
+            return None
+        start = self.text_start[slot]
+        return self.text[start:start + length].decode()
+
+    def message_at(self, slot):
+        timestamp = self.timestamp[slot]
+        return (
+            self.handles.values[self.handle[slot]],
+            self.text_at(slot),
+            time.strftime(DATE_FORMAT, time.localtime(timestamp)),
+            self.services.values[self.service[slot]],
+            self.accounts.values[self.account[slot]],
+            self.is_from_me[slot],
+            timestamp,
+        )
+
+    def get(self, rowid):
+        slot = self.slots.get(rowid)
+        if slot is None:
+            return None
+        return self.message_at(slot)
+
+    def compact(self):
+        # Drop removed slots and the text they no longer reference
+        live = sorted(self.slots.values())
+        columns = ('rowid', 'timestamp', 'handle', 'service', 'account', 'is_from_me', 'text_length')
+        for name in columns:
+            old = getattr(self, name)
+            setattr(self, name, array(old.typecode, (old[slot] for slot in live)))
+        text = bytearray()
+        starts = array('q')
+        for new_slot, slot in enumerate(live):
+            starts.append(len(text))
+            length = self.text_length[new_slot]
+            if length > 0:
+                start = self.text_start[slot]
+                text += self.text[start:start + length]
+        self.text = text
+        self.text_start = starts
+        self.dead_text = 0
+        self.slots = {rowid: slot for slot, rowid in enumerate(self.rowid)}
@@ -0,0 +1,84 @@
+# PIL is imported where it's used so importing this module stays cheap for
+# a server that may never check a number
+
+# Inclusive (low, high) per band for the recipient token in the Messages
+# title bar: blue for iMessage, green for SMS
+BLUE_RANGES = ((30, 60), (60, 130), (90, 250))
+GREEN_RANGES = ((60, 90), (100, 120), (60, 90))
+
+
+def is_greenish(pixel):
+    r, g, b = pixel
+    return (60 <= r <= 90 and
+            100 <= g <= 120 and
+            60 <= b <= 90)
+
+def is_blueish(pixel):
+    r, g, b = pixel
+    return (30 <= r <= 60 and
+            60 <= g <= 130 and
+            90 <= b <= 250)
+
+
+def token_box(width, height):
+    # The part of the title bar the recipient token sits in
+    token_start_x = width // 3
+    token_width = width // 5
+    token_area_y = height // 4
+    token_height = height // 2
+    return (token_start_x, token_area_y, token_start_x + token_width, token_area_y + token_height)
+
+
+def color_mask(bands, ranges):
+    from PIL import ImageChops
+    mask = None
+    for band, (low, high) in zip(bands, ranges):
+        lut = [255 if low <= v <= high else 0 for v in range(256)]
+        band_mask = band.point(lut, '1')
+        mask = band_mask if mask is None else ImageChops.logical_and(mask, band_mask)
+    return mask
+
+
+def count_pixels(mask):
+    return mask.histogram()[255]
+
+
+def classify(img, box=None):
+    # (blue_count, green_count) over box, whole-region band operations.
+    # A pixel matching both ranges counts as blue, like the per-pixel loop.
+    from PIL import ImageChops
+    if box is None:
+        box = token_box(*img.size)
+    region = img.crop(box).convert('RGB')
+    bands = region.split()
+    blue = color_mask(bands, BLUE_RANGES)
+    green = color_mask(bands, GREEN_RANGES)
+    both = ImageChops.logical_and(blue, green)
+    return count_pixels(blue), count_pixels(green) - count_pixels(both)
+
+
+def classify_per_pixel(img, box=None):
+    # The original getpixel loop, kept as the reference for classify()
+    if box is None:
+        box = token_box(*img.size)
+    img = img.convert('RGB')
+    left, top, right, bottom = box
+    blue_count = 0
+    green_count = 0
+    for x in range(left, right):
+        for y in range(top, bottom):
+            pixel = img.getpixel((x, y))
+            if is_blueish(pixel):
+                blue_count += 1
+            elif is_greenish(pixel):
+                green_count += 1
+    return blue_count, green_count
+
+
+def save_debug_image(img, box, path):
+    from PIL import ImageDraw
+    debug_img = img.convert('RGB').copy()
+    draw = ImageDraw.Draw(debug_img)
+    left, top, right, bottom = box
+    draw.rectangle([(left, top), (right, bottom)], outline=(255, 0, 0), width=2)
+    debug_img.save(path)
@@ -0,0 +1,80 @@
+import sys
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    # Samples every thread's stack every interval seconds while running and
+    # counts them in collapsed form ("outer;inner;leaf count" per line), the
+    # input flamegraph.pl and speedscope take. Off by default; it costs
+    # nothing until started and can be started and stopped at runtime.
+    def __init__(self, interval=0.01, max_stacks=10000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=None):
+        with self.lock:
+            if interval:
+                self.interval = interval
+            if self.running:
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+
+    def run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = []
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                sampled.append(';'.join(reversed(stack)))
+            with self.lock:
+                for stack in sampled:
+                    if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[stack] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        with self.lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def status(self):
+        with self.lock:
+            return {
+                'running': self.running,
+                'interval': self.interval,
+                'samples': self.samples,
+                'stacks': len(self.stacks),
+            }
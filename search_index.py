@@ -0,0 +1,105 @@
+import re
+import sqlite3
+import threading
+
+# Most results one search returns; SQLite would otherwise read and
+# snippet every match for a huge or negative (unlimited) LIMIT
+MAX_LIMIT = 100
+
+QUERY_TOKENS = re.compile(r'"([^"]*)"|(\S+)')
+WORD = re.compile(r'\w+')
+
+
+def to_fts_query(query):
+    # Turns user input into a safe FTS5 query: "quoted text" stays a phrase,
+    # a trailing * makes a prefix search and everything else is ANDed terms.
+    parts = []
+    for phrase, term in QUERY_TOKENS.findall(query):
+        if phrase:
+            words = WORD.findall(phrase)
+            if words:
+                parts.append('"' + ' '.join(words) + '"')
+            continue
+        words = WORD.findall(term)
+        if not words:
+            continue
+        prefix = term.endswith('*')
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            parts.append(f'"{word}"' + ('*' if prefix and last else ''))
+    return ' '.join(parts)
+
+
+class SearchIndex:
+    # FTS5 sidecar kept in step with the message index by the ingest loop.
+    # rowid is the chat.db message ROWID.
+    def __init__(self, path=':memory:'):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            if path != ':memory:':
+                # Rebuilt from chat.db if lost, so it needn't survive a
+                # power cut, only be quick to commit every pass
+                self.conn.execute("PRAGMA journal_mode = WAL")
+                self.conn.execute("PRAGMA synchronous = NORMAL")
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+                "text, handle UNINDEXED, timestamp UNINDEXED, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            self.conn.commit()
+
+    def update(self, added, changed, removed):
+        rows = [
+            (rowid, message[1], message[0], message[6])
+            for rowid, message in list(added.items()) + list(changed.items())
+            if message[1]
+        ]
+        with self.lock:
+            # Edited messages may have lost their text, clear them first
+            self.conn.executemany("DELETE FROM message_fts WHERE rowid = ?",
+                                  [(rowid,) for rowid in list(changed) + list(removed)])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO message_fts(rowid, text, handle, timestamp) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+    def search(self, query, handle=None, start=None, end=None, limit=20, offset=0, order='rank'):
+        # [(rowid, snippet)] best match first, or newest first with
+        # order='recent' which skips scoring every match
+        if not 1 <= limit <= MAX_LIMIT or offset < 0:
+            raise ValueError(f'limit must be 1 to {MAX_LIMIT} and offset not negative')
+        fts_query = to_fts_query(query)
+        if not fts_query:
+            return []
+        sql = ("SELECT rowid, snippet(message_fts, 0, '[', ']', '...', 12) "
+               "FROM message_fts WHERE message_fts MATCH ?")
+        params = [fts_query]
+        if handle is not None:
+            sql += " AND handle = ?"
+            params.append(handle)
+        if start is not None:
+            sql += " AND timestamp >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND timestamp < ?"
+            params.append(end)
+        sql += " ORDER BY rowid DESC" if order == 'recent' else " ORDER BY rank"
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM message_fts")
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM message_fts").fetchone()[0]
+
+    def last_rowid(self):
+        with self.lock:
+            return self.conn.execute("SELECT MAX(rowid) FROM message_fts").fetchone()[0] or 0
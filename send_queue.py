@@ -0,0 +1,167 @@
+import time
+import uuid
+import queue
+import threading
+import traceback
+from collections import OrderedDict
+from applescript import Script
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+# The batch went wrong before reporting on this message, which may or may
+# not have gone out
+UNKNOWN = 'unknown'
+FINISHED = (SENT, FAILED, UNKNOWN)
+
+
+# argv is recipient, message, recipient, message, ... Every send is wrapped
+# in its own try so one bad recipient doesn't fail the rest, and the script
+# returns one "ok" / "error: ..." line per message.
+SEND_BATCH_SCRIPT = Script('send_batch', '''
+on run argv
+    tell application "Messages"
+        set targetService to 1st service whose service type = iMessage
+        set results to {}
+        repeat with i from 1 to (count of argv) by 2
+            try
+                set targetBuddy to buddy (item i of argv) of targetService
+                send (item (i + 1) of argv) to targetBuddy
+                set end of results to "ok"
+            on error errMsg
+                set end of results to "error: " & errMsg
+            end try
+        end repeat
+        set AppleScript's text item delimiters to linefeed
+        return results as text
+    end tell
+end run
+''')
+
+
+class SendJob:
+    __slots__ = ('id', 'recipient', 'message', 'status', 'error', 'created', 'updated')
+
+    def __init__(self, recipient, message):
+        self.id = uuid.uuid4().hex
+        self.recipient = recipient
+        self.message = message
+        self.status = QUEUED
+        self.error = None
+        self.created = self.updated = time.time()
+
+    def set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.updated = time.time()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'recipient': self.recipient,
+            'status': self.status,
+            'error': self.error,
+            'created': self.created,
+            'updated': self.updated,
+        }
+
+
+class RateLimiter:
+    # Token bucket shared by all send workers
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SendQueue:
+    # Jobs for a recipient always land on the same worker, so they go out
+    # in the order they were submitted. Each worker sends whatever has piled
+    # up on its queue, up to batch_size, with one AppleScript run.
+    def __init__(self, executor, workers=2, batch_size=10,
+                 per_minute=60, burst=10, max_jobs=10000):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(per_minute, burst)
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.jobs_lock = threading.Lock()
+        self.queues = [queue.Queue() for _ in range(workers)]
+        for q in self.queues:
+            threading.Thread(target=self.worker, args=(q,), daemon=True).start()
+
+    def submit(self, recipient, message):
+        job = SendJob(recipient, message)
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+            # Forget the oldest finished jobs once we hold too many
+            while len(self.jobs) > self.max_jobs:
+                oldest = next(iter(self.jobs.values()))
+                if oldest.status not in FINISHED:
+                    break
+                self.jobs.popitem(last=False)
+        self.queues[hash(recipient) % len(self.queues)].put(job)
+        return job
+
+    def get(self, job_id):
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def worker(self, q):
+        while True:
+            batch = [q.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.send_batch(batch)
+            except Exception as e:
+                print(f"Error sending batch of {len(batch)} messages: {e}")
+                traceback.print_exc()
+                for job in batch:
+                    if job.status not in FINISHED:
+                        job.set_status(FAILED, str(e))
+
+    def send_batch(self, batch):
+        for job in batch:
+            self.limiter.acquire()
+            job.set_status(SENDING)
+        args = []
+        for job in batch:
+            args += [job.recipient, job.message]
+        returncode, stdout, stderr = self.executor.run(SEND_BATCH_SCRIPT, *args)
+        results = stdout.strip().split('\n') if stdout.strip() else []
+        if len(results) > len(batch):
+            # Can't tell which line belongs to which message
+            results = []
+        # Results come back in order, so whatever was reported is trusted
+        # even if the run then failed; the rest are unknown, not failed,
+        # since a timed out run may still have sent them
+        for job, result in zip(batch, results):
+            if result == 'ok':
+                job.set_status(SENT)
+            elif result.startswith('error: '):
+                job.set_status(FAILED, result[len('error: '):])
+            else:
+                job.set_status(UNKNOWN, result)
+        if returncode != 0 or len(results) != len(batch):
+            error = stderr.strip() or f'osascript returned {returncode}: {stdout.strip()}'
+            for job in batch[len(results):]:
+                job.set_status(UNKNOWN, error)
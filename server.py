@@ -1,19 +1,57 @@
 import time
+import atexit
 import json
+import queue
 import threading
 import os
+import mimetypes
 from datetime import datetime
-from flask import Flask, request, jsonify
-from imessage_reader import fetch_data
+from flask import Flask, Response, g, request, jsonify, send_file
 import subprocess
+import applescript
+import capability_cache
+import capability_checker
 from functools import wraps
 from dotenv import load_dotenv
 import traceback
-from PIL import Image, ImageDraw
+import chatdb
+import contacts
+import conversations
+import export
+import ingest
+import message_index
+import metrics
+import pixel_classifier
+import profiler
+import search_index
+import send_queue
+import stream
+import thumbnails
+import watcher
 
 load_dotenv()
 
 app = Flask(__name__)
+
+REQUEST_SECONDS = metrics.histogram(
+    'imessage_http_request_seconds', 'Time to produce a response, per route', ['method', 'route', 'status'])
+CLASSIFY_SECONDS = metrics.histogram(
+    'imessage_pixel_classify_seconds', 'Time classifying the title bar screenshot in check_imessage')
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Streaming responses are timed up to their first byte
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route,
+                                status=response.status_code)
+    return response
+
 PASSWORD = os.environ.get('PASSWORD')
 MY_NAME = os.environ.get('YOUR_NAME')
 
@@ -27,97 +65,666 @@ def require_api_key(f):
 
 global messages
 
-DB_FILEPATH = os.environ.get('DB_FILEPATH')
+DB_FILEPATH = os.environ.get('DB_FILEPATH') or chatdb.DEFAULT_PATH
+
+# auto, kqueue, inotify, poll, or interval for the old fixed 5 second loop
+WATCH_MODE = os.environ.get('WATCH_MODE', 'auto')
+
+chat_db = chatdb.ChatDB(DB_FILEPATH)
+ingestor = ingest.MessageIngestor(chat_db)
+messages = ingestor.messages
+
+# The message index is saved here so a restart only has to catch up on
+# what changed since, rather than read the whole history again
+SNAPSHOT_FILEPATH = os.environ.get('SNAPSHOT_FILEPATH', 'message_index.snapshot')
+SNAPSHOT_INTERVAL = int(os.environ.get('SNAPSHOT_INTERVAL', '300'))
+
+# Kept next to the snapshot by default, so a restart doesn't have to index
+# every message for search again
+SEARCH_DB_FILEPATH = os.environ.get('SEARCH_DB_FILEPATH') or (
+    SNAPSHOT_FILEPATH + '.search' if SNAPSHOT_FILEPATH else ':memory:')
+search = search_index.SearchIndex(SEARCH_DB_FILEPATH)
+ingestor.add_listener(search.update)
+
+broadcaster = stream.Broadcaster()
+
+def publish_messages(added, changed, removed):
+    # The first pass without a snapshot reads the whole history, which is
+    # not news to anyone streaming; it only moves the resume floor
+    if not ready.is_set() and not startup['snapshot_loaded']:
+        broadcaster.reset(ingestor.last_rowid)
+        return
+    broadcaster.publish(added, changed, removed)
+
+ingestor.add_listener(publish_messages)
+
+chats = conversations.ConversationIndex(chat_db)
+ingestor.add_listener(chats.update)
+
+# Set once the first pass has caught up with chat.db, see /ready
+ready = threading.Event()
+startup = {'snapshot_loaded': False, 'seconds_to_ready': None}
+# (after, through) ROWIDs of restored messages search hasn't indexed yet
+search_backfill = None
+# Set once conversation summaries cover every message; after a snapshot
+# restore that is shortly after /ready
+conversations_ready = threading.Event()
+
+def restore_snapshot():
+    global messages, search_backfill
+    try:
+        if not ingestor.restore(SNAPSHOT_FILEPATH):
+            return
+    except Exception as e:
+        print(f"Error loading snapshot {SNAPSHOT_FILEPATH}: {e}")
+        traceback.print_exc()
+        return
+    messages = ingestor.messages
+    startup['snapshot_loaded'] = True
+    # Cursors from the previous run can't be replayed
+    broadcaster.reset(ingestor.last_rowid)
+    # Snapshot rows the search index is missing, indexed after /ready by
+    # backfill_search; the first pass delivers everything newer
+    if search.last_rowid() < ingestor.last_rowid:
+        search_backfill = (search.last_rowid(), ingestor.last_rowid)
+
+def rebuild_conversations():
+    # After a restore the summaries are built from the whole index on the
+    # ingest thread once /ready is set. Messages the first pass already
+    # placed are skipped by update.
+    current = {rowid: messages.get(rowid) for rowid in list(messages.store.slots)}
+    chats.update(current, {}, set())
+    print(f"Summarized {len(chats)} conversations from the restored messages")
+
+def backfill_search():
+    # Runs on the ingest thread so it can't interleave with a pass, and
+    # takes messages from the index as it is now, edits and deletions
+    # included
+    global search_backfill
+    first, last = search_backfill
+    backfill = {}
+    for rowid in list(messages.store.slots):
+        if first < rowid <= last:
+            message = messages.get(rowid)
+            if message is not None:
+                backfill[rowid] = message
+    search.update(backfill, {}, set())
+    # Only once it worked, so a failed backfill is tried again next pass
+    search_backfill = None
+    print(f"Indexed {len(backfill)} restored messages for search")
+
+def save_snapshot():
+    try:
+        ingestor.save(SNAPSHOT_FILEPATH)
+    except Exception as e:
+        print(f"Error saving snapshot {SNAPSHOT_FILEPATH}: {e}")
+        traceback.print_exc()
 
 def update_fd():
     global messages
+    started = time.time()
+    if SNAPSHOT_FILEPATH:
+        restore_snapshot()
+    if not startup['snapshot_loaded']:
+        # The first pass indexes everything, and a search index left from
+        # another run may hold messages deleted since
+        search.clear()
+    db_watcher = watcher.create_watcher([DB_FILEPATH, DB_FILEPATH + '-wal'], WATCH_MODE)
+    last_saved = None
+    dirty = True
     while True:
-        messages = sorted(fetch_data.FetchData(DB_FILEPATH).get_messages(), key=sort_key, reverse=True)
-        time.sleep(5)
+        try:
+            added, changed, removed = ingestor.ingest()
+            messages = ingestor.messages
+            dirty = dirty or bool(added or changed or removed)
+            if not ready.is_set():
+                startup['seconds_to_ready'] = round(time.time() - started, 3)
+                ready.set()
+                if startup['snapshot_loaded']:
+                    try:
+                        rebuild_conversations()
+                    except Exception as e:
+                        print(f"Error summarizing restored conversations: {e}")
+                        traceback.print_exc()
+                # Even after a failed rebuild, so /conversations serves what
+                # later passes add rather than 503 for good
+                conversations_ready.set()
+            if search_backfill:
+                backfill_search()
+            if SNAPSHOT_FILEPATH and dirty and (last_saved is None or time.time() - last_saved >= SNAPSHOT_INTERVAL):
+                save_snapshot()
+                last_saved = time.time()
+                dirty = False
+        except Exception as e:
+            print(f"Error ingesting messages: {e}")
+            traceback.print_exc()
+        if db_watcher is None:
+            time.sleep(5)
+        else:
+            # Re-check once a minute even without events, in case one was missed
+            db_watcher.wait_for_change(timeout=60)
+
+threading.Thread(target=update_fd, daemon=True).start()
 
-threading.Thread(target=update_fd).start()
+# persistent (default on macOS), osascript for one process per call, or stub
+executor = applescript.create_executor(
+    os.environ.get('APPLESCRIPT_BACKEND'),
+    workers=int(os.environ.get('APPLESCRIPT_WORKERS', '2')),
+)
 
-def sort_key(item):
-    return datetime.strptime(item[2], '%Y-%m-%d %H:%M:%S')
+send_jobs = send_queue.SendQueue(
+    executor,
+    workers=int(os.environ.get('SEND_WORKERS', '2')),
+    batch_size=int(os.environ.get('SEND_BATCH_SIZE', '10')),
+    per_minute=int(os.environ.get('SEND_RATE_PER_MINUTE', '60')),
+)
 
 def send(phone_number, message):
-    message = message.replace('"', '\\"')
-    applescript = f'''
-    tell application "Messages"
-        set targetService to 1st service whose service type = iMessage
-        set targetBuddy to buddy "{phone_number}" of targetService
-        send "{message}" to targetBuddy
-    end tell
-    '''
-    try:
-        subprocess.run(['osascript', '-e', applescript])
-    except Exception as e:
-        print(f"Error sending message to {phone_number}: {e}")
+    return send_jobs.submit(phone_number, message)
+
+# Names for /send and for contact_name in message responses, from a vCard
+# or JSON export (see icloud_parser.py), reloaded whenever the file changes
+CONTACTS_FILEPATH = os.environ.get('CONTACTS_FILEPATH', contacts.DEFAULT_PATH)
+# Country code for numbers written without one, for contacts and checks
+DEFAULT_COUNTRY_CODE = os.environ.get('DEFAULT_COUNTRY_CODE', '1')
+contact_index = contacts.ContactIndex(CONTACTS_FILEPATH, DEFAULT_COUNTRY_CODE)
+contact_index.reload()
+
+def watch_contacts():
+    contacts_watcher = watcher.create_watcher([CONTACTS_FILEPATH], WATCH_MODE)
+    while True:
+        if contacts_watcher is None:
+            time.sleep(5)
+        else:
+            contacts_watcher.wait_for_change(timeout=60)
+        contact_index.reload()
+
+threading.Thread(target=watch_contacts, daemon=True).start()
+
+def preferred_handle(contact):
+    # The contact's first number or address we already have messages
+    # with, so a name goes to the same thread as before
+    for handle in contact.handles:
+        if messages.handle_id(handle) is not None:
+            return handle
+    return contact.handles[0]
+
+@app.route('/send', methods=['POST'])
+@require_api_key
+def send_route():
+    data = request.json
+    if not data or not data.get('recipient') or not data.get('message'):
+        return jsonify({'error': 'recipient and message are required'}), 400
+    recipient = data['recipient']
+    if str(data.get('name', True)).lower() == 'true':
+        # Only the exact name sends; looser matches are offered instead so
+        # a message never goes to someone the sender didn't spell out
+        matches = contact_index.exact(str(recipient))
+        if not matches:
+            return jsonify({
+                'error': f'No contact is named {recipient!r}',
+                'matches': [contact.to_dict() for contact in contact_index.resolve(str(recipient))[:10]],
+            }), 404
+        if len(matches) > 1:
+            return jsonify({
+                'error': f'More than one contact is named {recipient!r}, send to a number instead',
+                'matches': [contact.to_dict() for contact in matches[:10]],
+            }), 409
+        recipient = preferred_handle(matches[0])
+
+    job = send(recipient, data['message'])
+    return jsonify(job.to_dict()), 202
+
+@app.route('/send/<job_id>')
+@require_api_key
+def send_status(job_id):
+    job = send_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
 
 @app.route('/')
 def root():
     print(request)
     return jsonify({'messages': "root"}), 200
 
-def is_greenish(pixel):
-    r, g, b = pixel
-    return (60 <= r <= 90 and 
-            100 <= g <= 120 and 
-            60 <= b <= 90)
+metrics.gauge('imessage_messages', 'Messages in the in-memory index', callback=lambda: len(messages))
+metrics.gauge('imessage_index_text_bytes', 'Bytes of message text held in memory',
+              callback=lambda: len(messages.store.text))
+metrics.gauge('imessage_last_rowid', 'Highest chat.db message ROWID ingested', callback=lambda: ingestor.last_rowid)
+metrics.gauge('imessage_ready', '1 once the first ingest pass has caught up', callback=lambda: int(ready.is_set()))
+metrics.gauge('imessage_conversations', 'Chats with a summary', callback=lambda: len(chats))
+metrics.gauge('imessage_stream_subscribers', 'Open /stream and long-poll subscribers',
+              callback=lambda: len(broadcaster.subscribers))
+metrics.gauge('imessage_contacts', 'Contacts loaded from CONTACTS_FILEPATH', callback=lambda: len(contact_index))
+metrics.gauge('imessage_send_queue_depth', 'Messages waiting to be sent',
+              callback=lambda: sum(q.qsize() for q in send_jobs.queues))
 
-def is_blueish(pixel):
-    r, g, b = pixel
-    return (30 <= r <= 60 and 
-            60 <= g <= 130 and 
-            90 <= b <= 250)
+@app.route('/metrics')
+def metrics_route():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
-    
-def check_imessage(phone_number):
-    # Clean and format the phone number
-    raw_number = phone_number.replace("+", "").replace("-", "").replace(" ", "").replace("(", "").replace(")", "")
-    if raw_number.startswith("1"):
-        raw_number = raw_number[1:]
-    
-    setup_script = '''
+sampler = profiler.SamplingProfiler()
+
+@app.route('/debug/profiler', methods=['GET', 'POST', 'DELETE'])
+@require_api_key
+def profiler_route():
+    # POST {"interval": 0.01} starts sampling, DELETE stops it, GET returns
+    # the collapsed stacks so far (?format=json for the status instead)
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            interval = float(data.get('interval', sampler.interval))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'interval must be a number of seconds'}), 400
+        if data.get('reset'):
+            sampler.reset()
+        sampler.start(max(interval, 0.001))
+        return jsonify(sampler.status())
+    if request.method == 'DELETE':
+        sampler.stop()
+        return jsonify(sampler.status())
+    if request.args.get('format') == 'json':
+        return jsonify(sampler.status())
+    return Response(sampler.collapsed(), mimetype='text/plain')
+
+@app.route('/ready')
+def readiness():
+    # 503 until the message index has caught up with chat.db
+    status = dict(startup, ready=ready.is_set(), messages=len(messages), last_rowid=ingestor.last_rowid)
+    return jsonify(status), 200 if ready.is_set() else 503
+
+def format_message(message):
+    user_id, text, date, service, account, is_from_me, timestamp = message
+    return {
+        'sender': MY_NAME if is_from_me else user_id,
+        'handle': user_id,
+        'contact_name': contact_index.name_for(user_id),
+        'message': text,
+        'date': date,
+        'timestamp': timestamp,
+        'service': service,
+        'is_from_me': bool(is_from_me),
+    }
+
+@app.route('/messages')
+@require_api_key
+def get_messages():
+    try:
+        num_messages = int(request.args.get('num_messages', 10))
+        cursor = message_index.decode_cursor(request.args.get('before'))
+    except ValueError:
+        return jsonify({'error': 'num_messages must be an integer and before a cursor from next_cursor'}), 400
+    sent = request.args.get('sent', 'true').lower() == 'true'
+    formatted = request.args.get('formatted', 'true').lower() == 'true'
+    handle = None
+    if request.args.get('handle'):
+        handle = messages.handle_id(request.args['handle'])
+        if handle is None:
+            return jsonify({'messages': [], 'next_cursor': None})
+
+    page, next_cursor = messages.page(num_messages, cursor, handle=handle, sent=sent)
+    if formatted:
+        page = [format_message(message) for message in page]
+    return jsonify({'messages': page, 'next_cursor': next_cursor})
+
+@app.route('/messages/export')
+@require_api_key
+def export_messages():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    try:
+        cursor = message_index.decode_cursor(request.args.get('before'))
+        start = int(request.args['start']) if 'start' in request.args else None
+        end = int(request.args['end']) if 'end' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'start and end must be integers and before a cursor from an exported line'}), 400
+    sent = request.args.get('sent', 'true').lower() == 'true'
+    compress = request.args.get('gzip', 'false').lower() == 'true'
+    handle = None
+    if request.args.get('handle'):
+        handle = messages.handle_id(request.args['handle'])
+
+    to_chunks, mimetype = export.FORMATS[fmt]
+    if request.args.get('handle') and handle is None:
+        rows = iter(())
+    else:
+        rows = export.iter_messages(messages, handle, sent, start, end, cursor)
+    chunks = to_chunks(rows, format_message)
+    filename = f'messages.{fmt}'
+    if compress:
+        chunks = export.gzipped(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/recent_contacts')
+@require_api_key
+def recent_contacts():
+    try:
+        num_contacts = int(request.args.get('num_contacts', 10))
+        cursor = message_index.decode_cursor(request.args.get('before'))
+    except ValueError:
+        return jsonify({'error': 'num_contacts must be an integer and before a cursor from next_cursor'}), 400
+
+    contacts, next_cursor = messages.recent_contacts(num_contacts, cursor)
+    return jsonify({
+        'contacts': [
+            {'handle': user_id, 'name': contact_index.name_for(user_id), 'last_message_timestamp': timestamp}
+            for user_id, timestamp in contacts
+        ],
+        'next_cursor': next_cursor,
+    })
+
+@app.route('/contacts')
+@require_api_key
+def search_contacts():
+    # Looser matching than /send, for picking a recipient by name
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    matches = contact_index.resolve(query)
+    return jsonify({'contacts': [contact.to_dict() for contact in matches[:limit]], 'total': len(matches)})
+
+@app.route('/conversations')
+@require_api_key
+def get_conversations():
+    try:
+        num_conversations = int(request.args.get('num_conversations', 10))
+        cursor = message_index.decode_cursor(request.args.get('before'))
+    except ValueError:
+        return jsonify({'error': 'num_conversations must be an integer and before a cursor from next_cursor'}), 400
+    if not conversations_ready.is_set():
+        return jsonify({'error': 'Conversations are still loading'}), 503, {'Retry-After': '1'}
+
+    page, next_cursor = chats.page(num_conversations, cursor)
+    results = []
+    for summary, last_rowid in page:
+        last = messages.get(last_rowid)
+        results.append(dict(
+            summary,
+            participant_names=[contact_index.name_for(handle) for handle in summary.get('participants', [])],
+            last_message=format_message(last) if last else None,
+            last_message_timestamp=last[6] if last else None,
+            last_is_from_me=bool(last[5]) if last else None,
+        ))
+    return jsonify({'conversations': results, 'next_cursor': next_cursor})
+
+# Attachments are only served from under these directories (os.pathsep
+# separated), by default the folder chat.db is in, which holds Messages'
+# Attachments folder
+ATTACHMENT_ROOTS = [
+    os.path.realpath(os.path.expanduser(root))
+    for root in (os.environ.get('ATTACHMENT_ROOTS') or os.path.dirname(os.path.abspath(DB_FILEPATH))).split(os.pathsep)
+]
+# With USE_X_SENDFILE=true, files are handed to the fronting web server
+# (nginx, Apache) with X-Sendfile instead of being read by Python
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+
+thumbnail_cache = thumbnails.ThumbnailCache(
+    os.environ.get('THUMBNAIL_CACHE_DIR', 'thumbnails'),
+    max_bytes=int(os.environ.get('THUMBNAIL_CACHE_MB', '256')) * 2**20,
+    workers=int(os.environ.get('THUMBNAIL_WORKERS', '2')),
+)
+metrics.gauge('imessage_thumbnail_cache_bytes', 'Bytes of thumbnails on disk',
+              callback=lambda: thumbnail_cache.total_bytes)
+# How long a thumbnail request waits for its build before answering 202
+THUMBNAIL_WAIT = float(os.environ.get('THUMBNAIL_WAIT', '5'))
+
+def attachment_mime_type(attachment):
+    return attachment['mime_type'] or mimetypes.guess_type(attachment['name'] or '')[0] or 'application/octet-stream'
+
+def attachment_info(attachment):
+    info = dict(
+        {key: attachment[key] for key in ('id', 'guid', 'name', 'size')},
+        mime_type=attachment_mime_type(attachment),
+        url=f"/attachments/{attachment['id']}",
+        thumbnail_url=None,
+    )
+    if thumbnails.can_thumbnail(info['mime_type']):
+        info['thumbnail_url'] = f"/attachments/{attachment['id']}/thumbnail"
+    return info
+
+def attachment_file(attachment_id):
+    # (attachment, path) for a downloaded attachment under ATTACHMENT_ROOTS,
+    # or (attachment, None)
+    attachment = chat_db.attachment(attachment_id)
+    if attachment is None or attachment['path'] is None:
+        return attachment, None
+    path = os.path.realpath(attachment['path'])
+    if not any(path.startswith(root + os.sep) for root in ATTACHMENT_ROOTS) or not os.path.isfile(path):
+        return attachment, None
+    return attachment, path
+
+@app.route('/messages/<int:message_id>/attachments')
+@require_api_key
+def message_attachments(message_id):
+    return jsonify({'attachments': [attachment_info(attachment) for attachment in chat_db.attachments_for(message_id)]})
+
+@app.route('/attachments/<int:attachment_id>')
+@require_api_key
+def get_attachment(attachment_id):
+    # Streamed from disk in blocks, with Range and If-Range support for
+    # seeking in videos and resuming downloads. Servers that provide
+    # wsgi.file_wrapper (gunicorn) send it with sendfile().
+    attachment, path = attachment_file(attachment_id)
+    if path is None:
+        return jsonify({'error': 'Attachment not found' if attachment is None else 'Attachment is not on disk'}), 404
+    response = send_file(path, mimetype=attachment_mime_type(attachment), conditional=True,
+                         as_attachment=request.args.get('download', 'false').lower() == 'true',
+                         download_name=attachment['name'], max_age=86400)
+    # Tells players up front that they can seek with Range
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@app.route('/attachments/<int:attachment_id>/thumbnail')
+@require_api_key
+def get_attachment_thumbnail(attachment_id):
+    try:
+        size = int(request.args.get('size', 256))
+    except ValueError:
+        return jsonify({'error': 'size must be an integer'}), 400
+    attachment, path = attachment_file(attachment_id)
+    if path is None:
+        return jsonify({'error': 'Attachment not found' if attachment is None else 'Attachment is not on disk'}), 404
+    if not thumbnails.can_thumbnail(attachment_mime_type(attachment)):
+        return jsonify({'error': 'No thumbnail for this type of attachment'}), 415
+    try:
+        thumbnail = thumbnail_cache.get(path, size, timeout=THUMBNAIL_WAIT)
+    except thumbnails.Busy:
+        return jsonify({'error': 'Too many thumbnails waiting to be built'}), 503, {'Retry-After': '1'}
+    except thumbnails.ThumbnailError:
+        return jsonify({'error': 'No thumbnail for this type of attachment'}), 415
+    f = None
+    if thumbnail is not None:
+        try:
+            # Opened here so eviction can't remove it between the lookup
+            # and the response
+            f = open(thumbnail, 'rb')
+        except FileNotFoundError:
+            pass
+    if f is None:
+        return jsonify({'status': 'pending'}), 202, {'Retry-After': '1'}
+    return send_file(f, mimetype='image/jpeg', conditional=True, max_age=86400,
+                     last_modified=os.fstat(f.fileno()).st_mtime)
+
+@app.route('/search')
+@require_api_key
+def search_messages():
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = int(request.args.get('limit', 20))
+        offset = int(request.args.get('offset', 0))
+        start = int(request.args['start']) if 'start' in request.args else None
+        end = int(request.args['end']) if 'end' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'limit, offset, start and end must be integers'}), 400
+    if not 1 <= limit <= search_index.MAX_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {search_index.MAX_LIMIT}'}), 400
+    if offset < 0:
+        return jsonify({'error': 'offset must not be negative'}), 400
+
+    order = request.args.get('order', 'rank')
+    if order not in ('rank', 'recent'):
+        return jsonify({'error': 'order must be rank or recent'}), 400
+
+    hits = search.search(query, request.args.get('handle'), start, end, limit, offset, order)
+    results = []
+    for rowid, snippet in hits:
+        message = messages.get(rowid)
+        if message is not None:
+            results.append(dict(format_message(message), snippet=snippet))
+    return jsonify({
+        'results': results,
+        'next_offset': offset + limit if len(hits) == limit else None,
+    })
+
+def sse_event(rowid, message):
+    return f"id: {rowid}\nevent: message\ndata: {json.dumps(format_message(message))}\n\n"
+
+# Shared with the native stream handlers in asgi.py
+STREAM_KEEPALIVE = 15
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+GAP_EVENT = "event: gap\ndata: {}\n\n"
+# Fell too far behind, reconnecting with Last-Event-ID catches up
+OVERFLOW_EVENT = "event: overflow\ndata: {}\n\n"
+KEEPALIVE_EVENT = ": keepalive\n\n"
+
+def stream_since(value):
+    # The Last-Event-ID or since of a /stream request; ValueError if it
+    # isn't a message id
+    return int(value) if value else None
+
+def poll_arguments(args):
+    # (since, timeout) of a /messages/poll request; ValueError if they
+    # aren't numbers
+    since = int(args.get('since', broadcaster.latest()))
+    timeout = max(0.0, min(float(args.get('timeout', 25)), 60))
+    return since, timeout
+
+def poll_response(events, since, gap):
+    return {
+        'messages': [dict(format_message(message), id=rowid) for rowid, message in events],
+        'cursor': events[-1][0] if events else since,
+        'gap': gap,
+    }
+
+@app.route('/stream')
+@require_api_key
+def stream_messages():
+    try:
+        since = stream_since(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'since must be a message id'}), 400
+
+    # Subscribe before replaying so nothing lands in between
+    subscriber = broadcaster.subscribe()
+    replay, gap = broadcaster.since(since) if since is not None else ([], False)
+
+    def generate():
+        last = since or 0
+        try:
+            if gap:
+                yield GAP_EVENT
+            for rowid, message in replay:
+                yield sse_event(rowid, message)
+                last = rowid
+            while not subscriber.dropped:
+                try:
+                    rowid, message = subscriber.queue.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield KEEPALIVE_EVENT
+                    continue
+                if rowid <= last:
+                    continue
+                yield sse_event(rowid, message)
+                last = rowid
+            yield OVERFLOW_EVENT
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers=STREAM_HEADERS)
+
+@app.route('/messages/poll')
+@require_api_key
+def poll_messages():
+    try:
+        since, timeout = poll_arguments(request.args)
+    except ValueError:
+        return jsonify({'error': 'since must be a message id and timeout a number'}), 400
+
+    events, gap = broadcaster.wait(since, timeout)
+    return jsonify(poll_response(events, since, gap))
+
+# Write messages_debug_<number>.png with the scanned area outlined
+CHECK_IMESSAGE_DEBUG = os.environ.get('CHECK_IMESSAGE_DEBUG', '').lower() == 'true'
+
+CHECK_IMESSAGE_SCRIPT = applescript.Script('check_imessage', '''
+on run argv
     tell application "Messages"
         activate
         delay 0.1
     end tell
-    
+
     tell application "System Events"
         tell process "Messages"
             -- Create new message window
             keystroke "n" using {command down}
             delay 0.1
-            
+
             -- Type the phone number
-            keystroke "''' + phone_number + '''"
+            keystroke (item 1 of argv)
             delay 0.1
-            
+
             -- Press Return/Enter
             keystroke return
             delay 0.1
-            
+
             -- Get window position and size
             set msgWindow to window 1
             set winPos to position of msgWindow
             set winSize to size of msgWindow
-            
+
             -- Get the title bar height (approximately 40 pixels)
             set titleBarHeight to 40
-            
+
             -- Return coordinates for just the title bar area
             return {item 1 of winPos, item 2 of winPos, item 1 of winSize, titleBarHeight}
         end tell
     end tell
-    '''
+end run
+''')
+
+CLOSE_WINDOW_SCRIPT = applescript.Script('close_window', '''
+on run argv
+    tell application "System Events"
+        tell process "Messages"
+            keystroke "w" using {command down}
+        end tell
+    end tell
+end run
+''')
+
+def check_imessage(phone_number):
+    # Clean and format the phone number
+    raw_number = phone_number.replace("+", "").replace("-", "").replace(" ", "").replace("(", "").replace(")", "")
+    if raw_number.startswith("1"):
+        raw_number = raw_number[1:]
     
     try:
         print(f"\nChecking iMessage status for {phone_number}")
         
         # First make sure Messages app is running and window is set up
         print("Opening Messages app and setting up window...")
-        setup_result = subprocess.run(['osascript', '-e', setup_script], capture_output=True, text=True)
+        setup_result = executor.run(CHECK_IMESSAGE_SCRIPT, phone_number)
         print(f"Setup script output: {setup_result.stdout.strip()}")
         
         # Parse window coordinates from the output
@@ -137,62 +744,30 @@ def check_imessage(phone_number):
                 if os.path.exists(screenshot_path):
                     print(f"Screenshot created successfully")
                     
+                    from PIL import Image
                     with Image.open(screenshot_path) as img:
                         img = img.convert('RGB')
                         width, height = img.size
                         print(f"Title bar image dimensions: {width}x{height}")
                         
-                        # Adjust scan area to focus more precisely on token
-                        token_start_x = width // 3
-                        token_width = width // 5  # Make this smaller to focus on just the token
-                        token_area_y = height // 4  # Start 1/4 down from top
-                        token_height = height // 2  # Scan middle half of height
-                        
-                        blue_count = 0
-                        green_count = 0
-                        
-                        # Scan just the token area with more precise boundaries
+                        # Classify the token area with whole-image band operations
+                        box = pixel_classifier.token_box(width, height)
                         print("\nScanning token area for colors...")
-                        for x in range(token_start_x, token_start_x + token_width):
-                            for y in range(token_area_y, token_area_y + token_height):
-                                pixel = img.getpixel((x, y))
-                                if is_blueish(pixel):
-                                    blue_count += 1
-                                elif is_greenish(pixel):
-                                    green_count += 1
-                        
+                        with CLASSIFY_SECONDS.time():
+                            blue_count, green_count = pixel_classifier.classify(img, box)
                         print(f"\nPixel counts - Blue: {blue_count}, Green: {green_count}")
-                        # Create debug image with overlay
-                        debug_img = img.copy()
-                        draw = ImageDraw.Draw(debug_img)
-                        
-                        # Draw scan area rectangle
-                        draw.rectangle(
-                            [
-                                (token_start_x, token_area_y), 
-                                (token_start_x + token_width, token_area_y + token_height)
-                            ],
-                            outline=(255, 0, 0),
-                            width=2
-                        )
                         
-                        # Save debug image with overlay
-                        debug_path = os.getcwd() + f"/messages_debug_{phone_number}.png"
-                        debug_img.save(debug_path)
-                        print(f"Debug screenshot saved to {debug_path}")
+                        if CHECK_IMESSAGE_DEBUG:
+                            # Save debug image with the scan area outlined
+                            debug_path = os.getcwd() + f"/messages_debug_{phone_number}.png"
+                            pixel_classifier.save_debug_image(img, box, debug_path)
+                            print(f"Debug screenshot saved to {debug_path}")
                         
                         # Clean up original
                         os.remove(screenshot_path)
                         
                         # Close Messages window
-                        close_script = '''
-                        tell application "System Events"
-                            tell process "Messages"
-                                keystroke "w" using {command down}
-                            end tell
-                        end tell
-                        '''
-                        subprocess.run(['osascript', '-e', close_script])
+                        executor.run(CLOSE_WINDOW_SCRIPT)
                         
                         # Determine if it's iMessage based on color counts
                         is_imessage = blue_count > green_count
@@ -206,328 +781,430 @@ def check_imessage(phone_number):
                 print(f"Error processing screenshot: {e}")
                 traceback.print_exc()
         
-        return False
+        # None means we couldn't tell, so it isn't cached as a "no"
+        return None
         
     except Exception as e:
         print(f"Error in lookup: {str(e)}")
         traceback.print_exc()
-        return False
+        return None
+
+capabilities = capability_cache.CapabilityCache(
+    os.environ.get('CAPABILITY_CACHE_FILEPATH', 'imessage_capability_cache.json'),
+    positive_ttl=int(os.environ.get('CAPABILITY_POSITIVE_TTL', str(30 * 86400))),
+    negative_ttl=int(os.environ.get('CAPABILITY_NEGATIVE_TTL', '86400')),
+)
+# Writes whatever the save timer hasn't yet
+atexit.register(capabilities.save)
+metrics.gauge('imessage_capability_cache_entries', 'Numbers in the iMessage capability cache',
+              callback=lambda: len(capabilities.entries))
+
+checker = capability_checker.CapabilityChecker(
+    capabilities,
+    chat_db.has_imessage_history,
+    lambda number: check_imessage(number),
+    DEFAULT_COUNTRY_CODE,
+)
+bulk_checks = capability_checker.BulkJobs(checker)
+
+def lookup_imessage(phone_number):
+    # (is_on_imessage, source): the cache first, then existing iMessage
+    # history in chat.db, and only then the Messages UI
+    return checker.lookup(phone_number)
+
+def check_imessage_response(phone_number, is_on_imessage, source):
+    response_data = {
+        'phone_number': phone_number,
+        'is_on_imessage': is_on_imessage,
+        'source': source,
+        'debug_info': {
+            'timestamp': datetime.now().isoformat(),
+            'phone_format': 'valid' if phone_number.startswith('+') else 'invalid'
+        }
+    }
+    print(f"Returning response: {json.dumps(response_data, indent=2)}")
+    return response_data
+
+INVALID_NUMBER_ERROR = {'error': 'Not a phone number or email address'}
+
+def check_imessage_result(phone_number, is_on_imessage, source):
+    # (body, status) for a finished lookup; a UI check that couldn't tell
+    # is a 503 so clients try again
+    status = 503 if source == capability_checker.ERROR else 200
+    return check_imessage_response(phone_number, is_on_imessage, source), status
 
 @app.route('/check_imessage/<phone_number>')
 def check_imessage_route(phone_number):
+    if contacts.to_e164(phone_number) is None:
+        return jsonify(INVALID_NUMBER_ERROR), 400
     try:
         print(f"\n=== Starting iMessage check for {phone_number} ===")
-        is_on_imessage = check_imessage(phone_number)
-        response_data = {
-            'phone_number': phone_number,
-            'is_on_imessage': is_on_imessage,
-            'debug_info': {
-                'timestamp': datetime.now().isoformat(),
-                'phone_format': 'valid' if phone_number.startswith('+') else 'invalid'
-            }
-        }
-        print(f"Returning response: {json.dumps(response_data, indent=2)}")
-        return jsonify(response_data)
+        body, status = check_imessage_result(phone_number, *lookup_imessage(phone_number))
+        return jsonify(body), status
     except Exception as e:
         print(f"Error in route handler: {str(e)}")
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/logout_imessage', methods=['POST'])
-def logout_imessage():
+def bulk_result_lines(job, start=0):
+    for result in job.iter_results(start):
+        # Blank lines keep the connection alive while a UI check runs
+        yield '\n' if result is None else json.dumps(result) + '\n'
+
+@app.route('/check_imessage/bulk', methods=['POST'])
+@require_api_key
+def check_imessage_bulk():
+    data = request.json
+    if not data or not isinstance(data.get('numbers'), list):
+        return jsonify({'error': 'numbers must be a list of phone numbers'}), 400
+
+    numbers = [str(number) for number in data['numbers'] if str(number).strip()]
+    invalid = [number for number in numbers if contacts.to_e164(number) is None]
+    if invalid and len(invalid) == len(numbers):
+        return jsonify({'error': 'numbers has no phone numbers or email addresses', 'invalid': invalid}), 400
+
+    job = bulk_checks.start(numbers)
+    if data.get('stream'):
+        def generate():
+            yield json.dumps(job.status()) + '\n'
+            yield from bulk_result_lines(job)
+        return Response(generate(), mimetype='application/x-ndjson')
+    return jsonify(job.status()), 202
+
+@app.route('/check_imessage/bulk/<job_id>', methods=['GET', 'DELETE'])
+@require_api_key
+def check_imessage_bulk_status(job_id):
+    job = bulk_checks.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if request.method == 'DELETE':
+        job.cancel()
+    status = job.status()
+    with job.condition:
+        status['results'] = list(job.results)
+    return jsonify(status)
+
+@app.route('/check_imessage/bulk/<job_id>/stream')
+@require_api_key
+def check_imessage_bulk_stream(job_id):
+    job = bulk_checks.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
     try:
-        logout_script = '''
-        tell application "Messages"
-            activate
-        end tell
-        
-        tell application "System Events"
-            tell process "Messages"
-                -- Open Preferences
-                keystroke "," using command down
-                delay 0.3
-                
-                -- Click on iMessage tab
-                click button "iMessage" of toolbar 1 of window 1
-                delay 0.3
-                
-                -- Try to find the Sign Out button by its UI element description
-                set foundButton to false
-                
-                -- Get all UI elements in the window
-                set allElements to entire contents of window 1
-                
-                -- Loop through all elements looking for the Sign Out button
-                repeat with anElement in allElements
+        start = int(request.args.get('start', 0))
+    except ValueError:
+        return jsonify({'error': 'start must be an integer'}), 400
+    return Response(bulk_result_lines(job, start), mimetype='application/x-ndjson')
+
+LOGOUT_SCRIPT = applescript.Script('logout_imessage', '''
+on run argv
+    tell application "Messages"
+        activate
+    end tell
+
+    tell application "System Events"
+        tell process "Messages"
+            -- Open Preferences
+            keystroke "," using command down
+            delay 0.3
+
+            -- Click on iMessage tab
+            click button "iMessage" of toolbar 1 of window 1
+            delay 0.3
+
+            -- Try to find the Sign Out button by its UI element description
+            set foundButton to false
+
+            -- Get all UI elements in the window
+            set allElements to entire contents of window 1
+
+            -- Loop through all elements looking for the Sign Out button
+            repeat with anElement in allElements
+                try
+                    if name of anElement is "Sign Out" then
+                        click anElement
+                        set foundButton to true
+                        delay 0.3
+                        exit repeat
+                    end if
+                end try
+            end repeat
+
+            -- If we couldn't find it by name, try by class and position
+            if not foundButton then
+                -- Get all buttons
+                set allButtons to buttons of window 1
+
+                -- Look for buttons in the top right area
+                repeat with aButton in allButtons
                     try
-                        if name of anElement is "Sign Out" then
-                            click anElement
+                        set btnPos to position of aButton
+
+                        -- Check if this looks like our Sign Out button (in top right)
+                        if (item 1 of btnPos) > 700 and (item 2 of btnPos) < 350 then
+                            click aButton
                             set foundButton to true
                             delay 0.3
                             exit repeat
                         end if
                     end try
                 end repeat
-                
-                -- If we couldn't find it by name, try by class and position
-                if not foundButton then
-                    -- Get all buttons
-                    set allButtons to buttons of window 1
-                    
-                    -- Look for buttons in the top right area
-                    repeat with aButton in allButtons
-                        try
-                            set btnPos to position of aButton
-                            
-                            -- Check if this looks like our Sign Out button (in top right)
-                            if (item 1 of btnPos) > 700 and (item 2 of btnPos) < 350 then
-                                click aButton
-                                set foundButton to true
-                                delay 0.3
-                                exit repeat
-                            end if
-                        end try
-                    end repeat
-                end if
-                
-                -- If still not found, try a direct click at the position from the screenshot
-                if not foundButton then
-                    -- Based on your screenshot, try clicking at this position
-                    click at {813, 305}
-                    delay 0.3
-                end if
-                
-                -- Try to confirm Sign Out if dialog appears
-                try
-                    click button "Sign Out" of sheet 1 of window 1
-                    delay 0.2
-                end try
-                
-                -- Close preferences window
-                keystroke "w" using command down
-            end tell
+            end if
+
+            -- If still not found, try a direct click at the position from the screenshot
+            if not foundButton then
+                -- Based on your screenshot, try clicking at this position
+                click at {813, 305}
+                delay 0.3
+            end if
+
+            -- Try to confirm Sign Out if dialog appears
+            try
+                click button "Sign Out" of sheet 1 of window 1
+                delay 0.2
+            end try
+
+            -- Close preferences window
+            keystroke "w" using command down
         end tell
-        
-        return "Logout successful"
-        '''
-        
-        result = subprocess.run(['osascript', '-e', logout_script], capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            return jsonify({
-                'success': True, 
-                'message': 'Successfully logged out of iMessage'
-            })
-        else:
-            return jsonify({
-                'success': False, 
-                'error': result.stderr
-            }), 500
+    end tell
+
+    return "Logout successful"
+end run
+''')
+
+def logout_response(result):
+    # (body, status) for a LOGOUT_SCRIPT result
+    if result.returncode == 0:
+        return {
+            'success': True, 
+            'message': 'Successfully logged out of iMessage'
+        }, 200
+    return {
+        'success': False, 
+        'error': result.stderr
+    }, 500
+
+@app.route('/logout_imessage', methods=['POST'])
+def logout_imessage():
+    try:
+        body, status = logout_response(executor.run(LOGOUT_SCRIPT))
+        return jsonify(body), status
             
     except Exception as e:
         print(f"Error logging out of iMessage: {str(e)}")
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/login_imessage', methods=['POST'])
-def login_imessage():
-    try:
-        data = request.json
-        if not data or 'apple_id' not in data or 'password' not in data:
-            return jsonify({'success': False, 'error': 'Apple ID and password are required'}), 400
-            
-        apple_id = data['apple_id']
-        password = data['password']
-        
-        login_script = f'''
-        tell application "Messages"
-            activate
-        end tell
-        
-        delay 0.5
-        
-        tell application "System Events"
-            tell process "Messages"
-                -- First screen: Enter Apple ID
-                try
-                    -- Clear any existing text in the first field (Apple ID)
-                    set value of text field 1 of window 1 to ""
-                    delay 0.1
-                    set value of text field 1 of window 1 to "{apple_id}"
-                    delay 0.1
-                on error
-                    -- If setting value directly fails, try keystroke
-                    keystroke "a" using {{command down}}
-                    keystroke "{apple_id}"
-                    delay 0.1
-                end try
-                
-                -- Click Next/Continue button or press return
-                try
-                    click button "Sign In" of window 1
-                on error
-                    try
-                        click button "Next" of window 1
-                    on error
-                        try
-                            click button "Continue" of window 1
-                        on error
-                            keystroke return
-                        end try
-                    end try
-                end try
-                
-                -- Wait for second screen
-                delay 1
-                
-                -- Second screen: Enter Apple ID again and password
-                -- First make sure we're in the first field (Apple ID)
-                click text field 1 of window 1
-                delay 0.1
-                
-                -- Clear and enter Apple ID again
-                keystroke "a" using {{command down}}
-                keystroke (ASCII character 8) -- backspace
-                delay 0.1
-                keystroke "{apple_id}"
-                delay 0.1
-                
-                -- Explicitly click the password field
-                try
-                    click text field 2 of window 1
-                on error
-                    -- If clicking fails, try tabbing
-                    keystroke tab
-                end try
-                
+LOGIN_SCRIPT = applescript.Script('login_imessage', '''
+on run argv
+    set appleId to item 1 of argv
+    tell application "Messages"
+        activate
+    end tell
+
+    delay 0.5
+
+    tell application "System Events"
+        tell process "Messages"
+            -- First screen: Enter Apple ID
+            try
+                -- Clear any existing text in the first field (Apple ID)
+                set value of text field 1 of window 1 to ""
                 delay 0.1
-                
-                -- Clear any existing text in password field
-                keystroke "a" using {{command down}}
-                keystroke (ASCII character 8) -- backspace
+                set value of text field 1 of window 1 to appleId
                 delay 0.1
-                
-                -- Type password character by character
-                set pwd to "{password}"
-                repeat with i from 1 to length of pwd
-                    set c to character i of pwd
-                    keystroke c
-                    delay 0.05 -- Small delay between characters
-                end repeat
-                
+            on error
+                -- If setting value directly fails, try keystroke
+                keystroke "a" using {command down}
+                keystroke appleId
                 delay 0.1
-                
-                -- Click Sign In button in bottom right
+            end try
+
+            -- Click Next/Continue button or press return
+            try
+                click button "Sign In" of window 1
+            on error
                 try
-                    click button "Sign In" of window 1
+                    click button "Next" of window 1
                 on error
-                    -- If button click fails, try tab + return to reach the button
-                    keystroke tab
-                    keystroke tab
-                    keystroke return
+                    try
+                        click button "Continue" of window 1
+                    on error
+                        keystroke return
+                    end try
                 end try
-                
-                return "Login initiated"
-            end tell
+            end try
+
+            -- Wait for second screen
+            delay 1
+
+            -- Second screen: Enter Apple ID again and password
+            -- First make sure we're in the first field (Apple ID)
+            click text field 1 of window 1
+            delay 0.1
+
+            -- Clear and enter Apple ID again
+            keystroke "a" using {command down}
+            keystroke (ASCII character 8) -- backspace
+            delay 0.1
+            keystroke appleId
+            delay 0.1
+
+            -- Explicitly click the password field
+            try
+                click text field 2 of window 1
+            on error
+                -- If clicking fails, try tabbing
+                keystroke tab
+            end try
+
+            delay 0.1
+
+            -- Clear any existing text in password field
+            keystroke "a" using {command down}
+            keystroke (ASCII character 8) -- backspace
+            delay 0.1
+
+            -- Type password character by character
+            set pwd to item 2 of argv
+            repeat with i from 1 to length of pwd
+                set c to character i of pwd
+                keystroke c
+                delay 0.05 -- Small delay between characters
+            end repeat
+
+            delay 0.1
+
+            -- Click Sign In button in bottom right
+            try
+                click button "Sign In" of window 1
+            on error
+                -- If button click fails, try tab + return to reach the button
+                keystroke tab
+                keystroke tab
+                keystroke return
+            end try
+
+            return "Login initiated"
         end tell
-        '''
-        
-        result = subprocess.run(['osascript', '-e', login_script], capture_output=True, text=True)
+    end tell
+end run
+''')
+
+def login_arguments(data):
+    # (apple_id, password), or None if the request body lacks them
+    if not data or 'apple_id' not in data or 'password' not in data:
+        return None
+    return data['apple_id'], data['password']
+
+LOGIN_ARGUMENTS_ERROR = {'success': False, 'error': 'Apple ID and password are required'}
+
+def login_response(result):
+    if result.returncode == 0:
+        return {
+            'success': True, 
+            'message': 'Login initiated, now call /click_other_options'
+        }, 200
+    return {'success': False, 'error': result.stderr}, 500
+
+@app.route('/login_imessage', methods=['POST'])
+def login_imessage():
+    try:
+        arguments = login_arguments(request.json)
+        if arguments is None:
+            return jsonify(LOGIN_ARGUMENTS_ERROR), 400
         
-        if result.returncode == 0:
-            return jsonify({
-                'success': True, 
-                'message': 'Login initiated, now call /click_other_options'
-            })
-        else:
-            return jsonify({'success': False, 'error': result.stderr}), 500
+        body, status = login_response(executor.run(LOGIN_SCRIPT, *arguments))
+        return jsonify(body), status
             
     except Exception as e:
         print(f"Error logging into iMessage: {str(e)}")
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/click_other_options_tab', methods=['POST'])
-def click_other_options_tab():
-    try:
-        # This script uses tab navigation to reach the "Other options" button
-        
-        tab_script = '''
-        tell application "Messages"
-            activate
-        end tell
-        
-        -- Wait for Messages to come to the foreground
-        delay 1
-        
-        -- Take a screenshot before we start
-        do shell script "screencapture -x /tmp/before_tab.png"
-        
-        tell application "System Events"
-            tell process "Messages"
-                -- Get the window position and size for screenshots
-                set winPosition to position of window 1
-                set winSize to size of window 1
-                set winLeft to item 1 of winPosition
-                set winTop to item 2 of winPosition
-                set winWidth to item 1 of winSize
-                set winHeight to item 2 of winSize
-                
-                -- Press tab twice to navigate to the "Other options" button
-                -- First tab should go to "Learn more..."
-                -- Second tab should go to "Other options"
-                keystroke tab
-                delay 0.5
-                keystroke tab
-                delay 0.5
-                
-                -- Take a screenshot after tabbing
-                do shell script "screencapture -x -R" & winLeft & "," & winTop & "," & winWidth & "," & winHeight & " /tmp/after_tab.png"
-                
-                -- Press return/enter to click the button
-                keystroke return
-                
-                -- Wait for any UI changes
-                delay 1
-                
-                -- Take a screenshot after clicking
-                do shell script "screencapture -x -R" & winLeft & "," & winTop & "," & winWidth & "," & winHeight & " /tmp/after_click_tab.png"
-                
-                -- Check if we now have a verification code field
-                set success to false
-                try
-                    if exists text field 1 of window 1 then
-                        set fieldValue to value of attribute "AXPlaceholderValue" of text field 1 of window 1
-                        if fieldValue contains "code" or fieldValue contains "verification" then
-                            set success to true
-                        end if
+OTHER_OPTIONS_SCRIPT = applescript.Script('click_other_options_tab', '''
+on run argv
+    tell application "Messages"
+        activate
+    end tell
+
+    -- Wait for Messages to come to the foreground
+    delay 1
+
+    -- Take a screenshot before we start
+    do shell script "screencapture -x /tmp/before_tab.png"
+
+    tell application "System Events"
+        tell process "Messages"
+            -- Get the window position and size for screenshots
+            set winPosition to position of window 1
+            set winSize to size of window 1
+            set winLeft to item 1 of winPosition
+            set winTop to item 2 of winPosition
+            set winWidth to item 1 of winSize
+            set winHeight to item 2 of winSize
+
+            -- Press tab twice to navigate to the "Other options" button
+            -- First tab should go to "Learn more..."
+            -- Second tab should go to "Other options"
+            keystroke tab
+            delay 0.5
+            keystroke tab
+            delay 0.5
+
+            -- Take a screenshot after tabbing
+            do shell script "screencapture -x -R" & winLeft & "," & winTop & "," & winWidth & "," & winHeight & " /tmp/after_tab.png"
+
+            -- Press return/enter to click the button
+            keystroke return
+
+            -- Wait for any UI changes
+            delay 1
+
+            -- Take a screenshot after clicking
+            do shell script "screencapture -x -R" & winLeft & "," & winTop & "," & winWidth & "," & winHeight & " /tmp/after_click_tab.png"
+
+            -- Check if we now have a verification code field
+            set success to false
+            try
+                if exists text field 1 of window 1 then
+                    set fieldValue to value of attribute "AXPlaceholderValue" of text field 1 of window 1
+                    if fieldValue contains "code" or fieldValue contains "verification" then
+                        set success to true
                     end if
-                on error
-                    -- Not a verification code screen
-                end try
-                
-                -- Press Escape to dismiss any remaining dialogs
-                delay 2
-                key code 53
-                delay 0.5
+                end if
+            on error
+                -- Not a verification code screen
+            end try
+
+            -- Press Escape to dismiss any remaining dialogs
+            delay 2
+            key code 53
+            delay 0.5
 
-                return success
-            end tell
+            return success
         end tell
-        '''
-        
-        result = subprocess.run(['osascript', '-e', tab_script], 
-                               capture_output=True, text=True)
+    end tell
+end run
+''')
+
+def other_options_response(result):
+    if result.returncode == 0:
+        success = result.stdout.strip().lower() == "true"
         
-        if result.returncode == 0:
-            success = result.stdout.strip().lower() == "true"
-            
-            return jsonify({
-                'success': True,
-                'verification_screen_reached': success,
-            })
-        else:
-            return jsonify({'success': False, 'error': result.stderr}), 500
+        return {
+            'success': True,
+            'verification_screen_reached': success,
+        }, 200
+    return {'success': False, 'error': result.stderr}, 500
+
+@app.route('/click_other_options_tab', methods=['POST'])
+def click_other_options_tab():
+    try:
+        # This script uses tab navigation to reach the "Other options" button
+        body, status = other_options_response(executor.run(OTHER_OPTIONS_SCRIPT))
+        return jsonify(body), status
             
     except Exception as e:
         print(f"Error with tab navigation: {str(e)}")
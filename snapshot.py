@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import struct
+from array import array
+from message_index import Ordering, TimeIndex
+
+# File layout: MAGIC, the header length as a little endian uint32, the JSON
+# header, then every array in header['arrays'] order as raw machine bytes.
+# Loading is a read and one frombytes per array; nothing is re-sorted.
+MAGIC = b'IMSGIDX2'
+STORE_COLUMNS = ('rowid', 'timestamp', 'handle', 'service', 'account', 'is_from_me', 'text_start', 'text_length')
+
+
+def ordering_arrays(name, ordering):
+    return [(name + '.times', ordering.times), (name + '.keys', ordering.keys)]
+
+
+def concat_orderings(name, orderings):
+    # A dict of handle -> Ordering as two arrays plus the handles and lengths
+    handles = sorted(orderings)
+    times = array('q')
+    keys = array('q')
+    for handle in handles:
+        times.extend(orderings[handle].times)
+        keys.extend(orderings[handle].keys)
+    lengths = [len(orderings[handle]) for handle in handles]
+    return [(name + '.times', times), (name + '.keys', keys)], {'handles': handles, 'lengths': lengths}
+
+
+def save(index, path, **meta):
+    # Writes the index stamped with meta (last_rowid etc.), atomically
+    with index.lock:
+        store = index.store
+        if store.dead_text or len(store.rowid) != len(store.slots):
+            store.compact()
+        arrays = [(name, getattr(store, name)) for name in STORE_COLUMNS]
+        arrays += ordering_arrays('all', index.all)
+        arrays += ordering_arrays('received', index.received)
+        arrays += ordering_arrays('recent_handles', index.recent_handles)
+        by_handle, by_handle_meta = concat_orderings('by_handle', index.by_handle)
+        received_by_handle, received_meta = concat_orderings('received_by_handle', index.received_by_handle)
+        arrays += by_handle + received_by_handle
+        header = dict(
+            meta,
+            byteorder=sys.byteorder,
+            arrays=[[name, a.typecode, a.itemsize, len(a)] for name, a in arrays],
+            text_length=len(store.text),
+            handles=store.handles.values,
+            services=store.services.values,
+            accounts=store.accounts.values,
+            by_handle=by_handle_meta,
+            received_by_handle=received_meta,
+        )
+        encoded = json.dumps(header).encode()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(encoded)))
+            f.write(encoded)
+            for _, a in arrays:
+                a.tofile(f)
+            f.write(store.text)
+    os.replace(tmp_path, path)
+
+
+def split_orderings(times, keys, meta):
+    orderings = {}
+    offset = 0
+    for handle, length in zip(meta['handles'], meta['lengths']):
+        ordering = Ordering()
+        ordering.times = times[offset:offset + length]
+        ordering.keys = keys[offset:offset + length]
+        orderings[handle] = ordering
+        offset += length
+    return orderings
+
+
+def load(path):
+    # (TimeIndex, header) or None if there is no usable snapshot at path
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        print(f"Ignoring snapshot {path}: not a snapshot this version can read")
+        return None
+    header_length, = struct.unpack_from('<I', data, len(MAGIC))
+    offset = len(MAGIC) + 4
+    header = json.loads(data[offset:offset + header_length])
+    offset += header_length
+    if header['byteorder'] != sys.byteorder:
+        print(f"Ignoring snapshot {path}: written on a {header['byteorder']} endian machine")
+        return None
+
+    view = memoryview(data)
+    arrays = {}
+    for name, typecode, itemsize, length in header['arrays']:
+        a = array(typecode)
+        if a.itemsize != itemsize:
+            print(f"Ignoring snapshot {path}: {typecode} arrays are {a.itemsize} bytes here, not {itemsize}")
+            return None
+        a.frombytes(view[offset:offset + itemsize * length])
+        arrays[name] = a
+        offset += itemsize * length
+
+    index = TimeIndex()
+    store = index.store
+    for name in STORE_COLUMNS:
+        setattr(store, name, arrays[name])
+    store.text = bytearray(view[offset:offset + header['text_length']])
+    store.slots = dict(zip(store.rowid, range(len(store.rowid))))
+    store.handles.values = header['handles']
+    store.handles.ids = {value: i for i, value in enumerate(store.handles.values)}
+    store.services.values = header['services']
+    store.services.ids = {value: i for i, value in enumerate(store.services.values)}
+    store.accounts.values = header['accounts']
+    store.accounts.ids = {value: i for i, value in enumerate(store.accounts.values)}
+
+    for name in ('all', 'received', 'recent_handles'):
+        ordering = getattr(index, name)
+        ordering.times = arrays[name + '.times']
+        ordering.keys = arrays[name + '.keys']
+    index.by_handle = split_orderings(arrays['by_handle.times'], arrays['by_handle.keys'], header['by_handle'])
+    index.received_by_handle = split_orderings(
+        arrays['received_by_handle.times'], arrays['received_by_handle.keys'], header['received_by_handle'])
+    index.last_activity = dict(zip(index.recent_handles.keys, index.recent_handles.times))
+    return index, header
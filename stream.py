@@ -0,0 +1,95 @@
+import queue
+import threading
+from collections import deque
+
+HISTORY = 1000
+SUBSCRIBER_BUFFER = 256
+
+
+class Subscriber:
+    def __init__(self, buffer_size, notify=None):
+        self.queue = queue.Queue(buffer_size)
+        # Set when the buffer filled up; the subscriber gets no more events
+        # and its stream should end so the client reconnects and catches up
+        # from the replay history instead
+        self.dropped = False
+        # Called on the ingest thread after events are queued or the
+        # subscriber is dropped, for subscribers that wait on an event loop
+        # rather than block on the queue
+        self.notify = notify
+
+
+class Broadcaster:
+    # Fans newly ingested messages out to every subscriber from the single
+    # ingest pass. Events are (message ROWID, message), so a ROWID works as
+    # the resume cursor, and the last HISTORY of them are kept for replay.
+    def __init__(self, history=HISTORY, buffer_size=SUBSCRIBER_BUFFER):
+        self.recent = deque(maxlen=history)
+        self.buffer_size = buffer_size
+        # Anything at or below floor has fallen out of the replay history
+        self.floor = 0
+        self.subscribers = set()
+        self.condition = threading.Condition()
+
+    def publish(self, added, changed, removed):
+        if not added:
+            return
+        events = sorted(added.items())[-self.recent.maxlen:]
+        notify = []
+        with self.condition:
+            for event in events:
+                if len(self.recent) == self.recent.maxlen:
+                    self.floor = self.recent[0][0]
+                self.recent.append(event)
+            for subscriber in list(self.subscribers):
+                for event in events:
+                    try:
+                        subscriber.queue.put_nowait(event)
+                    except queue.Full:
+                        subscriber.dropped = True
+                        self.subscribers.discard(subscriber)
+                        break
+                if subscriber.notify is not None:
+                    notify.append(subscriber.notify)
+            self.condition.notify_all()
+        for callback in notify:
+            callback()
+
+    def reset(self, rowid):
+        # Starts the history after rowid, for messages that were never
+        # published: a client resuming from before it gets a gap
+        with self.condition:
+            self.recent.clear()
+            self.floor = rowid
+
+    def subscribe(self, notify=None):
+        subscriber = Subscriber(self.buffer_size, notify)
+        with self.condition:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.condition:
+            self.subscribers.discard(subscriber)
+
+    def latest(self):
+        with self.condition:
+            return self.recent[-1][0] if self.recent else self.floor
+
+    def since(self, rowid):
+        # ([events after rowid], gap) where gap means some were already
+        # dropped from the history and the client should resync
+        with self.condition:
+            events = []
+            for event in reversed(self.recent):
+                if event[0] <= rowid:
+                    break
+                events.append(event)
+            events.reverse()
+            return events, rowid < self.floor
+
+    def wait(self, rowid, timeout):
+        # Long-poll: block until something newer than rowid arrives
+        with self.condition:
+            self.condition.wait_for(lambda: self.recent and self.recent[-1][0] > rowid, timeout)
+            return self.since(rowid)
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import chatdb
+from bench_chatdb import make_chat_db
+
+# Small enough to build per test, big enough that paging and group chats
+# come into it
+MESSAGES = 600
+
+
+@pytest.fixture
+def chat_db_path(tmp_path):
+    path = str(tmp_path / 'chat.db')
+    make_chat_db(path, MESSAGES, handles=20, groups=3)
+    return path
+
+
+@pytest.fixture
+def chat_db(chat_db_path):
+    db = chatdb.ChatDB(chat_db_path)
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    # The server configures itself from the environment at import, so it
+    # is imported once per run against its own chat.db with photos on disk
+    tmp = tmp_path_factory.mktemp('server')
+    make_chat_db(str(tmp / 'chat.db'), 100, handles=10, groups=2, attachments_dir=str(tmp / 'Attachments'))
+    os.environ.update(
+        DB_FILEPATH=str(tmp / 'chat.db'), PASSWORD='test', YOUR_NAME='Test', APPLESCRIPT_BACKEND='stub',
+        SNAPSHOT_FILEPATH='', THUMBNAIL_CACHE_DIR=str(tmp / 'thumbnails'),
+        CAPABILITY_CACHE_FILEPATH=str(tmp / 'capabilities.json'), CONTACTS_FILEPATH=str(tmp / 'contacts.json'))
+    import server
+    assert server.ready.wait(10)
+    return server
+
+
+@pytest.fixture
+def client(server):
+    client = server.app.test_client()
+    client.environ_base['HTTP_API_KEY'] = 'test'
+    return client
@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import pytest
+
+ROWID = 10_000_000
+MESSAGE = ('+15550000001', 'hello', '2024-01-01 00:00:00', 'iMessage', 'e:me@example.com', 0, 1_704_067_200)
+
+
+@pytest.fixture
+def asgi(server):
+    import asgi
+    return asgi
+
+
+def scope(path, query=b'', headers=((b'api-key', b'test'),)):
+    return {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'headers': list(headers)}
+
+
+async def call(asgi, scope, until=None, timeout=5):
+    # Runs the app until it finishes, or until the body so far contains
+    # until, then disconnects. Returns (status, headers, body).
+    disconnect = asyncio.Event()
+    sent = []
+
+    async def receive():
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+        body = b''.join(m.get('body', b'') for m in sent)
+        if until is not None and until in body:
+            disconnect.set()
+
+    await asyncio.wait_for(asgi.app(scope, receive, send), timeout)
+    start = sent[0]
+    return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def test_stream_is_native(asgi, server):
+    async def run():
+        task = asyncio.ensure_future(call(asgi, scope('/stream'), until=b'"hello"'))
+        await asyncio.sleep(0.1)
+        server.broadcaster.publish({ROWID: MESSAGE}, {}, set())
+        return await task
+
+    status, headers, body = asyncio.run(run())
+    assert status == 200
+    assert headers[b'content-type'].startswith(b'text/event-stream')
+    assert f'id: {ROWID}\nevent: message\n'.encode() in body
+
+
+def test_stream_overflow(asgi, server, monkeypatch):
+    monkeypatch.setattr(server.broadcaster, 'buffer_size', 2)
+
+    async def run():
+        task = asyncio.ensure_future(call(asgi, scope('/stream')))
+        await asyncio.sleep(0.1)
+        server.broadcaster.publish({ROWID + i: MESSAGE for i in range(1, 4)}, {}, set())
+        return await task
+
+    status, _, body = asyncio.run(run())
+    assert body.endswith(b'event: overflow\ndata: {}\n\n')
+    assert not server.broadcaster.subscribers
+
+
+def test_stream_errors(asgi):
+    assert asyncio.run(call(asgi, scope('/stream', headers=())))[0] == 401
+    assert asyncio.run(call(asgi, scope('/stream', b'since=x')))[0] == 400
+
+
+def test_poll(asgi, server):
+    async def run():
+        latest = server.broadcaster.latest()
+        task = asyncio.ensure_future(call(asgi, scope('/messages/poll', f'since={latest}&timeout=5'.encode())))
+        await asyncio.sleep(0.1)
+        server.broadcaster.publish({latest + 1: MESSAGE}, {}, set())
+        return latest, await task
+
+    latest, (status, _, body) = asyncio.run(run())
+    body = json.loads(body)
+    assert status == 200
+    assert body['cursor'] == latest + 1
+    assert [message['id'] for message in body['messages']] == [latest + 1]
+
+
+def test_poll_timeout(asgi, server):
+    latest = server.broadcaster.latest()
+    status, _, body = asyncio.run(call(asgi, scope('/messages/poll', f'since={latest}&timeout=0.1'.encode())))
+    assert json.loads(body) == {'messages': [], 'cursor': latest, 'gap': False}
+
+
+def test_check_imessage_invalid(asgi):
+    status, _, body = asyncio.run(call(asgi, scope('/check_imessage/abc')))
+    assert status == 400
+    assert json.loads(body) == {'error': 'Not a phone number or email address'}
+
+
+def test_check_imessage_ui_error(asgi, server, monkeypatch):
+    # No iMessage history, so the lookup falls through to a UI check
+    # that can't tell
+    monkeypatch.setattr(server.checker, 'ui_check', lambda number: None)
+    status, _, body = asyncio.run(call(asgi, scope('/check_imessage/+15559990003')))
+    assert status == 503
+    assert json.loads(body)['source'] == 'error'
+
+
+def test_poll_skips_first_pass(asgi, server):
+    # The whole history read at startup was never published, so a client
+    # resuming from before it is told to resync
+    status, _, body = asyncio.run(call(asgi, scope('/messages/poll', b'since=0&timeout=0.1')))
+    body = json.loads(body)
+    assert body['gap'] is True
+    assert server.broadcaster.floor >= server.ingestor.last_rowid > 0
+    assert all(message['id'] > server.ingestor.last_rowid for message in body['messages'])
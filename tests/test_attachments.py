@@ -0,0 +1,97 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def photo(server):
+    # Every 25th message has a photo, with the attachment ROWID of the
+    # message
+    return server.chat_db.attachment(25)
+
+
+def test_message_attachments(client):
+    [info] = client.get('/messages/25/attachments').get_json()['attachments']
+    assert info['mime_type'] == 'image/jpeg'
+    assert info['url'] == '/attachments/25'
+    assert info['thumbnail_url'] == '/attachments/25/thumbnail'
+    assert client.get('/messages/24/attachments').get_json() == {'attachments': []}
+
+
+def test_full_download(client, photo):
+    response = client.get('/attachments/25')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'image/jpeg'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    with open(photo['path'], 'rb') as f:
+        assert response.get_data() == f.read()
+
+
+def test_range(client, photo):
+    with open(photo['path'], 'rb') as f:
+        data = f.read()
+    response = client.get('/attachments/25', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+    assert response.get_data() == data[100:200]
+    response = client.get('/attachments/25', headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206
+    assert response.get_data() == data[-10:]
+
+
+def test_unsatisfiable_range(client, photo):
+    response = client.get('/attachments/25', headers={'Range': f"bytes={photo['size'] + 10}-"})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f"bytes */{photo['size']}"
+
+
+def test_missing_attachment(client):
+    assert client.get('/attachments/999999').status_code == 404
+    assert client.get('/attachments/999999/thumbnail').status_code == 404
+
+
+def test_outside_attachment_roots(client, server, monkeypatch):
+    monkeypatch.setattr(server, 'ATTACHMENT_ROOTS', [os.path.realpath('/nonexistent')])
+    assert client.get('/attachments/25').status_code == 404
+
+
+def test_thumbnail(client, server):
+    response = client.get('/attachments/50/thumbnail?size=200')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'image/jpeg'
+    # Rounded up to the next cached size
+    assert max(Image.open(io.BytesIO(response.get_data())).size) == 256
+    entries = len(server.thumbnail_cache.entries)
+    assert client.get('/attachments/50/thumbnail?size=256').get_data() == response.get_data()
+    assert len(server.thumbnail_cache.entries) == entries
+    assert client.get('/attachments/50/thumbnail?size=big').status_code == 400
+
+
+def test_thumbnail_of_broken_image(client, server, tmp_path, monkeypatch):
+    attachment = dict(server.chat_db.attachment(75))
+    broken = tmp_path / 'broken.jpeg'
+    broken.write_bytes(b'not a jpeg')
+    attachment['path'] = str(broken)
+    monkeypatch.setattr(server, 'attachment_file', lambda attachment_id: (attachment, str(broken)))
+    builds = []
+    build = server.thumbnail_cache.build
+    monkeypatch.setattr(server.thumbnail_cache, 'build', lambda *args: builds.append(args) or build(*args))
+    assert client.get('/attachments/75/thumbnail').status_code == 415
+    assert client.get('/attachments/75/thumbnail').status_code == 415
+    assert len(builds) == 1
+    # A replaced file gets a new key and is tried again
+    broken.write_bytes(b'still not a jpeg')
+    assert client.get('/attachments/75/thumbnail').status_code == 415
+    assert len(builds) == 2
+
+
+@pytest.mark.parametrize('mime_type', ['image/heic', 'video/quicktime'])
+def test_no_thumbnail_for_unreadable_types(client, server, monkeypatch, mime_type):
+    attachment = dict(server.chat_db.attachment(100), mime_type=mime_type)
+    monkeypatch.setattr(server.chat_db, 'attachments_for', lambda message_id: [attachment])
+    monkeypatch.setattr(server, 'attachment_file', lambda attachment_id: (attachment, attachment['path']))
+    [info] = client.get('/messages/100/attachments').get_json()['attachments']
+    assert info['thumbnail_url'] is None
+    assert client.get('/attachments/100/thumbnail').status_code == 415
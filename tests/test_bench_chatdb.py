@@ -0,0 +1,25 @@
+import os
+
+import chatdb
+from bench_chatdb import make_chat_db
+
+
+def test_generated_db_reads_like_chat_db(chat_db):
+    rows = chat_db.messages_since(0)
+    assert [rowid for rowid, _ in rows] == list(range(1, len(rows) + 1))
+    assert all(message[1] for _, message in rows)
+    # What we send to a group chat has no handle
+    assert any(message[0] is None and message[5] for _, message in rows)
+    assert chat_db.has_imessage_history('+15550000001')
+    assert not chat_db.has_imessage_history('+15550000003')
+
+
+def test_attachments_written_to_disk(tmp_path):
+    path = str(tmp_path / 'chat.db')
+    make_chat_db(path, 50, handles=5, groups=0, attachments_dir=str(tmp_path / 'Attachments'))
+    db = chatdb.ChatDB(path)
+    [attachment] = db.attachments_for(25)
+    assert attachment['mime_type'] == 'image/jpeg'
+    assert os.path.getsize(attachment['path']) == attachment['size']
+    assert db.attachments_for(24) == []
+    db.close()
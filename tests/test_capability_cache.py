@@ -0,0 +1,35 @@
+import json
+import time
+
+from capability_cache import CapabilityCache
+
+
+def test_puts_are_saved_together(tmp_path):
+    path = tmp_path / 'cache.json'
+    cache = CapabilityCache(str(path), save_delay=0.2)
+    for i in range(100):
+        cache.put(f'+1555{i:07d}', i % 2)
+    assert not path.exists()
+    time.sleep(0.5)
+    assert len(json.loads(path.read_text())) == 100
+    assert cache.timer is None and not cache.dirty
+
+    reloaded = CapabilityCache(str(path))
+    assert reloaded.get('+15550000001') is True
+    assert reloaded.get('+15550000002') is False
+
+
+def test_save_writes_pending_puts(tmp_path):
+    path = tmp_path / 'cache.json'
+    cache = CapabilityCache(str(path), save_delay=60)
+    cache.put('+15550000001', True)
+    cache.save()
+    assert json.loads(path.read_text())[0][0] == '+15550000001'
+
+
+def test_expired_entries(tmp_path):
+    cache = CapabilityCache(None, positive_ttl=10, negative_ttl=-1)
+    cache.put('+15550000001', True)
+    cache.put('+15550000002', False)
+    assert cache.get('+15550000001') is True
+    assert cache.get('+15550000002') is None
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from capability_cache import CapabilityCache
+from capability_checker import ERROR, BulkJob, CapabilityChecker
+
+
+def make_checker(ui_check, db_numbers=()):
+    cache = CapabilityCache(None)
+    return cache, CapabilityChecker(cache, lambda number: number in db_numbers, ui_check)
+
+
+def test_sources():
+    cache, checker = make_checker(lambda number: number.endswith('2'), db_numbers={'+15550000001'})
+    assert checker.lookup('555-000-0001') == (True, 'db')
+    assert checker.lookup('5550000002') == (True, 'ui')
+    assert checker.lookup('5550000003') == (False, 'ui')
+    assert checker.lookup('5550000003') == (False, 'cache')
+
+
+def test_failed_ui_check_is_not_cached():
+    answers = [None, RuntimeError('Messages did not open'), True]
+
+    def ui_check(number):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    cache, checker = make_checker(ui_check)
+    assert checker.lookup('5550000004') == (None, ERROR)
+    assert cache.get('+15550000004') is None
+    assert checker.lookup('5550000004') == (None, ERROR)
+    assert checker.lookup('5550000004') == (True, 'ui')
+    assert cache.get('+15550000004') is True
+
+
+def test_concurrent_lookups_share_one_check():
+    release = threading.Event()
+    calls = []
+
+    def ui_check(number):
+        calls.append(number)
+        release.wait(5)
+        return True
+
+    _, checker = make_checker(ui_check)
+    flights = [checker.submit('5550000005') for _ in range(5)]
+    assert len({id(flight) for flight in flights}) == 1
+    release.set()
+    assert flights[0].event.wait(5)
+    assert flights[0].result == (True, 'ui')
+    assert calls == ['+15550000005']
+
+
+def test_bulk_job_lists_invalid_numbers():
+    _, checker = make_checker(lambda number: True)
+    job = BulkJob(checker, ['555-000-0006', 'n/a', '', '(555) 000-0006', 'call me'])
+    assert job.numbers == ['+15550000006']
+    assert job.status()['invalid'] == ['n/a', 'call me']
+    job.start()
+    assert [result['source'] for result in job.iter_results()] == ['ui']
+
+
+def test_numbers_match_contact_handles():
+    # Normalized like contacts: no +1 on a local number, and 00 is the
+    # international prefix rather than part of the number
+    checked = []
+    _, checker = make_checker(lambda number: checked.append(number) or True)
+    checker.lookup('555-0100')
+    checker.lookup('0044 20 7946 0958')
+    assert checked == ['5550100', '+442079460958']
+
+
+def test_lookup_rejects_invalid_number():
+    _, checker = make_checker(lambda number: True)
+    with pytest.raises(ValueError):
+        checker.lookup('---')
+
+
+def test_bulk_route(client):
+    response = client.post('/check_imessage/bulk', json={'numbers': ['nope', '', '???']})
+    assert response.status_code == 400
+    assert response.get_json()['invalid'] == ['nope', '???']
+    response = client.post('/check_imessage/bulk', json={'numbers': ['nope', '+15550000001']})
+    assert response.status_code == 202
+    assert response.get_json()['invalid'] == ['nope']
+    assert client.get('/check_imessage/nope').status_code == 400
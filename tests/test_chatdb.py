@@ -0,0 +1,74 @@
+import sqlite3
+
+import chatdb
+from bench_chatdb import attributed_body
+from conftest import MESSAGES
+
+
+def test_decode_attributed_body():
+    assert chatdb.decode_attributed_body(attributed_body('hello there')) == 'hello there'
+    # Longer than 127 bytes takes the 0x81 + int16 length
+    long_text = 'ü' * 200
+    assert chatdb.decode_attributed_body(attributed_body(long_text)) == long_text
+    assert chatdb.decode_attributed_body(b'not a typedstream') is None
+
+
+def test_text_only_in_attributed_body_is_decoded(chat_db, chat_db_path):
+    conn = sqlite3.connect(chat_db_path)
+    rowid, body = conn.execute(
+        "SELECT ROWID, attributedBody FROM message WHERE text IS NULL AND cache_has_attachments = 0 LIMIT 1").fetchone()
+    conn.close()
+    [(_, message)] = chat_db.messages_since(rowid - 1, limit=1)
+    assert message[1] == chatdb.decode_attributed_body(body)
+    assert message[1]
+
+
+def test_attachment_placeholder(chat_db):
+    rows = dict(chat_db.messages_since(0))
+    # Every 25th message has a photo; some of those have a caption too
+    texts = [rows[rowid][1] for rowid in range(25, MESSAGES + 1, 25)]
+    assert chatdb.ATTACHMENT_TEXT in texts
+    assert all(chatdb.OBJECT_REPLACEMENT not in text for text in texts)
+
+
+def test_pages_cover_every_message_once(chat_db):
+    seen = []
+    before = None
+    while True:
+        page, before = chat_db.messages_between(before=before, limit=64)
+        seen += page
+        if before is None:
+            break
+    assert len(seen) == MESSAGES
+    assert len({rowid for rowid, _ in seen}) == MESSAGES
+    timestamps = [message[6] for _, message in seen]
+    assert timestamps == sorted(timestamps, reverse=True)
+
+
+def test_pages_for_handle(chat_db):
+    handle = '+15550000001'
+    everything = [rowid for rowid, message in chat_db.messages_since(0) if message[0] == handle]
+    seen = []
+    page, before = chat_db.messages_for_handle(handle, limit=5)
+    seen += page
+    while before is not None:
+        page, before = chat_db.messages_for_handle(handle, before=before, limit=5)
+        seen += page
+    assert sorted(rowid for rowid, _ in seen) == sorted(everything)
+    assert all(message[0] == handle for _, message in seen)
+
+
+def test_messages_between_bounds(chat_db):
+    rows = chat_db.messages_since(0)
+    start, end = rows[100][1][6], rows[200][1][6]
+    page, _ = chat_db.messages_between(start, end, limit=1000)
+    assert page
+    assert all(start <= message[6] < end for _, message in page)
+
+
+def test_chats_pages_by_last_message(chat_db):
+    first, cursor = chat_db.chats(limit=10)
+    rest, _ = chat_db.chats(before=cursor, limit=100)
+    chats = first + rest
+    assert len(chats) == 23
+    assert len({chat['chat_identifier'] for chat in chats}) == 23
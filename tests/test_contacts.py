@@ -0,0 +1,119 @@
+import pytest
+
+from contacts import ContactIndex, Contacts, parse_vcards, to_e164
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('(555) 010-0100', '+15550100100'),
+    ('1-555-010-0100', '+15550100100'),
+    ('+44 20 7946 0958', '+442079460958'),
+    ('011 44 20 7946 0958', '+442079460958'),
+    ('0044 20 7946 0958', '+442079460958'),
+    ('tel:+1-555-010-0100', '+15550100100'),
+    ('555 010 0100 ext. 12', '+15550100100'),
+    ('5550100100;w12', '+15550100100'),
+    ('Someone@Example.COM', 'someone@example.com'),
+    (' Someone@Example.com ', 'someone@example.com'),
+    ('12345', '12345'),
+    # Too short to be a full number, so it doesn't get +1
+    ('555-0100', '5550100'),
+    ('555 010 010', '555010010'),
+    ('n/a', None),
+    ('+', None),
+])
+def test_to_e164(raw, expected):
+    assert to_e164(raw) == expected
+
+
+def test_to_e164_other_country():
+    assert to_e164('020 7946 0958', country_code='44') == '+442079460958'
+
+
+VCARDS = """BEGIN:VCARD
+VERSION:3.0
+FN:Zoë Adams
+TEL;TYPE=CELL:(555) 010-0001
+TEL;TYPE=CELL;TYPE=pref:(555) 010-0002
+END:VCARD
+BEGIN:VCARD
+VERSION:2.1
+N:Adams;John;;;
+TEL:555-010-0003
+EMAIL:JOHN@example.com
+END:VCARD
+BEGIN:VCARD
+VERSION:3.0
+FN:John Adams
+TEL:555-010-0004
+END:VCARD
+BEGIN:VCARD
+VERSION:3.0
+FN:No Number
+END:VCARD
+"""
+
+
+def test_parse_vcards():
+    cards = parse_vcards(VCARDS)
+    assert [name for name, _ in cards] == ['Zoë Adams', 'John Adams', 'John Adams']
+    assert cards[0][1] == [('(555) 010-0001', False), ('(555) 010-0002', True)]
+
+
+def test_preferred_handle_first():
+    contacts = Contacts(parse_vcards(VCARDS))
+    assert contacts.contacts[0].handles == ('+15550100002', '+15550100001')
+    assert contacts.contacts[1].handles == ('+15550100003', 'john@example.com')
+    assert contacts.by_handle['+15550100001'] == 'Zoë Adams'
+
+
+def test_resolve():
+    contacts = Contacts(parse_vcards(VCARDS))
+    assert [c.name for c in contacts.resolve('zoe adams')] == ['Zoë Adams']
+    assert len(contacts.resolve('John Adams')) == 2
+    assert [c.name for c in contacts.resolve('zo')] == ['Zoë Adams']
+    assert len(contacts.resolve('adams')) == 3
+    assert contacts.resolve('nobody') == []
+
+
+def test_index_keeps_last_good_file(tmp_path):
+    path = tmp_path / 'contacts.vcf'
+    path.write_text(VCARDS)
+    index = ContactIndex(str(path))
+    assert index.reload()
+    assert index.name_for('+15550100004') == 'John Adams'
+    path.write_text('BEGIN:VCARD\nFN:Broken\nEND:VCARD\n' + ' ' * 10)
+    assert not index.reload()
+    assert len(index) == 3
+
+
+def test_exact():
+    contacts = Contacts(parse_vcards(VCARDS))
+    assert [c.name for c in contacts.exact(' Zoë Adams ')] == ['Zoë Adams']
+    assert contacts.exact('zoe adams') == []
+    assert contacts.exact('Zo') == []
+    assert len(contacts.exact('John Adams')) == 2
+
+
+def test_send_by_name(client, server, tmp_path, monkeypatch):
+    path = tmp_path / 'contacts.vcf'
+    path.write_text(VCARDS)
+    index = ContactIndex(str(path))
+    index.reload()
+    monkeypatch.setattr(server, 'contact_index', index)
+    sent = []
+    monkeypatch.setattr(server, 'send', lambda recipient, message: sent.append(recipient) or FakeJob())
+
+    assert client.post('/send', json={'recipient': 'Zoë Adams', 'message': 'hi'}).status_code == 202
+    assert sent == ['+15550100002']
+    response = client.post('/send', json={'recipient': 'zo', 'message': 'hi'})
+    assert response.status_code == 404
+    assert [c['name'] for c in response.get_json()['matches']] == ['Zoë Adams']
+    response = client.post('/send', json={'recipient': 'John Adams', 'message': 'hi'})
+    assert response.status_code == 409
+    assert len(response.get_json()['matches']) == 2
+    assert sent == ['+15550100002']
+
+
+class FakeJob:
+    def to_dict(self):
+        return {'job_id': 'test', 'status': 'queued'}
@@ -0,0 +1,55 @@
+import random
+import sqlite3
+
+from bench_chatdb import add_messages
+from conversations import ConversationIndex
+from ingest import MessageIngestor
+
+
+def summaries(conversations):
+    page, _ = conversations.page(1000)
+    return page
+
+
+def rebuilt(chat_db, ingestor):
+    conversations = ConversationIndex(chat_db)
+    conversations.update(dict(ingestor.messages.items(len(ingestor.messages))), {}, set())
+    return conversations
+
+
+def test_incremental_matches_rebuild(chat_db, chat_db_path):
+    ingestor = MessageIngestor(chat_db, deletion_check_interval=1)
+    conversations = ConversationIndex(chat_db)
+    ingestor.add_listener(conversations.update)
+    ingestor.ingest()
+    assert summaries(conversations) == summaries(rebuilt(chat_db, ingestor))
+
+    rng = random.Random(5)
+    members = {21: [1, 2, 3]}
+    add_messages(chat_db_path, 601, 50, rng, handles=20, members=members)
+    conn = sqlite3.connect(chat_db_path)
+    # Everything in one chat, so the conversation has to disappear
+    conn.execute("DELETE FROM message WHERE ROWID IN (SELECT message_id FROM chat_message_join WHERE chat_id = 7)")
+    conn.execute("DELETE FROM message WHERE ROWID IN (10, 11, 12)")
+    # Renames are picked up along with the chat's next message
+    conn.execute("UPDATE chat SET display_name = 'Renamed' WHERE ROWID = 21")
+    conn.commit()
+    conn.close()
+    ingestor.ingest()
+
+    incremental = summaries(conversations)
+    assert incremental == summaries(rebuilt(chat_db, ingestor))
+    by_chat = {summary['chat_id']: summary for summary, _ in incremental}
+    assert 7 not in by_chat
+    assert by_chat[21]['display_name'] == 'Renamed'
+    assert sum(summary['message_count'] for summary, _ in incremental) == len(ingestor.messages)
+
+
+def test_summary_counts(chat_db):
+    ingestor = MessageIngestor(chat_db)
+    ingestor.ingest()
+    conversations = rebuilt(chat_db, ingestor)
+    for summary, last in summaries(conversations):
+        assert summary['sent_count'] + summary['received_count'] == summary['message_count']
+        assert summary['participants']
+        assert ingestor.messages.get(last) is not None
@@ -0,0 +1,59 @@
+import csv
+import gzip
+import io
+import json
+
+import export
+from message_index import TIMESTAMP
+
+
+def export_lines(client, query=''):
+    response = client.get('/messages/export?' + query)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_export_everything_newest_first(client, server):
+    lines = export_lines(client)
+    assert len(lines) == len(server.messages)
+    assert [(line['timestamp'], line['id']) for line in lines] == sorted(
+        ((line['timestamp'], line['id']) for line in lines), reverse=True)
+
+
+def test_resume_from_cursor(client):
+    lines = export_lines(client)
+    for k in (0, 41, len(lines) - 2):
+        assert export_lines(client, 'before=' + lines[k]['cursor']) == lines[k + 1:]
+    assert export_lines(client, 'before=' + lines[-1]['cursor']) == []
+
+
+def test_start_and_end(client):
+    lines = export_lines(client)
+    start, end = lines[70]['timestamp'], lines[20]['timestamp']
+    in_range = export_lines(client, f'start={start}&end={end}')
+    assert in_range == [line for line in lines if start <= line['timestamp'] < end]
+    assert 0 < len(in_range) < len(lines)
+    # A cursor inside the range narrows it further
+    resumed = export_lines(client, f'start={start}&end={end}&before={lines[40]["cursor"]}')
+    assert resumed == [line for line in lines[41:] if start <= line['timestamp'] < end]
+
+
+def test_gzipped_csv(client):
+    lines = export_lines(client)
+    response = client.get('/messages/export?format=csv&gzip=true')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    assert 'messages.csv.gz' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.get_data()).decode())))
+    assert [int(row['id']) for row in rows] == [line['id'] for line in lines]
+    assert [row['cursor'] for row in rows] == [line['cursor'] for line in lines]
+    assert [row['message'] for row in rows] == [line['message'] or '' for line in lines]
+
+
+def test_chunks_line_up(server):
+    # Paging through the index a few messages at a time gives the same rows
+    whole = list(export.iter_messages(server.messages))
+    assert list(export.iter_messages(server.messages, chunk_size=7)) == whole
+    start, end = whole[70][1][TIMESTAMP], whole[20][1][TIMESTAMP]
+    assert list(export.iter_messages(server.messages, start=start, end=end, chunk_size=3)) == [
+        (rowid, message) for rowid, message in whole if start <= message[TIMESTAMP] < end]
@@ -0,0 +1,86 @@
+import random
+import sqlite3
+import time
+
+import chatdb
+from bench_chatdb import add_messages
+from conftest import MESSAGES
+from ingest import MessageIngestor
+
+
+def write(path, sql, params=()):
+    conn = sqlite3.connect(path)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_first_pass_indexes_everything(chat_db):
+    ingestor = MessageIngestor(chat_db)
+    added, changed, removed = ingestor.ingest()
+    assert len(added) == MESSAGES
+    assert not changed and not removed
+    assert ingestor.last_rowid == MESSAGES
+    assert ingestor.ingest() == ({}, {}, set())
+
+
+def test_watermark_follows_fetched_rows(chat_db, chat_db_path, monkeypatch):
+    ingestor = MessageIngestor(chat_db)
+    ingestor.ingest()
+    # A row committed between the fetch and any later MAX(ROWID) must
+    # still be picked up by the next pass
+    fetch = chat_db.messages_since
+
+    def fetch_then_write(rowid, limit=None):
+        rows = fetch(rowid, limit)
+        add_messages(chat_db_path, MESSAGES + 1, 1, random.Random(1), handles=20)
+        return rows
+
+    monkeypatch.setattr(chat_db, 'messages_since', fetch_then_write)
+    ingestor.ingest()
+    assert ingestor.last_rowid == MESSAGES
+    monkeypatch.setattr(chat_db, 'messages_since', fetch)
+    added, _, _ = ingestor.ingest()
+    assert list(added) == [MESSAGES + 1]
+    assert ingestor.messages.get(MESSAGES + 1) is not None
+
+
+def test_recent_edit_is_picked_up_next_pass(chat_db_path):
+    db = chatdb.ChatDB(chat_db_path)
+    ingestor = MessageIngestor(db)
+    add_messages(chat_db_path, MESSAGES + 1, 1, random.Random(2), handles=20, start=int(time.time()) - 30 * MESSAGES)
+    ingestor.ingest()
+    ingestor.ingest()
+    rowid = MESSAGES + 1
+    write(chat_db_path, "UPDATE message SET text = 'edited', attributedBody = NULL, date_edited = ? WHERE ROWID = ?",
+          (chatdb.to_apple_time(time.time()), rowid))
+    _, changed, _ = ingestor.ingest()
+    assert list(changed) == [rowid]
+    assert ingestor.messages.get(rowid)[1] == 'edited'
+    db.close()
+
+
+def test_old_edits_and_deletions_wait_for_the_full_check(chat_db, chat_db_path):
+    ingestor = MessageIngestor(chat_db, deletion_check_interval=3)
+    ingestor.ingest()
+    write(chat_db_path, "UPDATE message SET text = 'edited', attributedBody = NULL, date_edited = ? WHERE ROWID = 5",
+          (chatdb.to_apple_time(time.time()),))
+    write(chat_db_path, "DELETE FROM message WHERE ROWID = 7")
+    # Message 5 was sent long before the edit window, so only the pass
+    # that also checks for deletions sees it
+    assert ingestor.ingest() == ({}, {}, set())
+    _, changed, removed = ingestor.ingest()
+    assert list(changed) == [5]
+    assert removed == {7}
+    assert ingestor.messages.get(7) is None
+    assert len(ingestor.messages) == MESSAGES - 1
+
+
+def test_messages_added_and_deleted_between_checks(chat_db, chat_db_path):
+    ingestor = MessageIngestor(chat_db, deletion_check_interval=2)
+    ingestor.ingest()
+    write(chat_db_path, "DELETE FROM message WHERE ROWID = 1")
+    add_messages(chat_db_path, MESSAGES + 1, 1, random.Random(3), handles=20)
+    added, _, removed = ingestor.ingest()
+    assert list(added) == [MESSAGES + 1]
+    assert removed == {1}
@@ -0,0 +1,35 @@
+import metrics
+
+
+def test_counter_and_labels():
+    registry = metrics.Registry()
+    counter = registry.counter('test_total', 'A counter', ['kind'])
+    counter.inc(kind='a')
+    counter.inc(2, kind='b "quoted"')
+    assert registry.counter('test_total', 'Again') is counter
+    assert counter.render() == [
+        '# HELP test_total A counter',
+        '# TYPE test_total counter',
+        'test_total{kind="a"} 1',
+        'test_total{kind="b \\"quoted\\""} 2',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram('test_seconds', 'A histogram', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1.0"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        'test_seconds_sum 3.65',
+        'test_seconds_count 4',
+    ]
+
+
+def test_gauge_callback():
+    gauge = metrics.Gauge('test_size', 'A gauge', callback=lambda: 7)
+    assert gauge.render()[-1] == 'test_size 7'
+    broken = metrics.Gauge('test_broken', 'A gauge', callback=lambda: 1 / 0)
+    assert broken.render()[-1] == 'test_broken NaN'
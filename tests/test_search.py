@@ -0,0 +1,51 @@
+import pytest
+
+from search_index import SearchIndex, to_fts_query
+
+
+def test_to_fts_query():
+    assert to_fts_query('dinner "running  late" birth*') == '"dinner" "running late" "birth"*'
+    assert to_fts_query('"" -- ') == ''
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    index.update({
+        1: ('+15550000001', 'dinner tonight', '', '', '', 0, 100),
+        2: ('+15550000002', 'running late for dinner', '', '', '', 1, 200),
+        3: ('+15550000001', 'see you tomorrow', '', '', '', 0, 300),
+    }, {}, set())
+    return index
+
+
+def test_search(index):
+    assert sorted(rowid for rowid, _ in index.search('dinner')) == [1, 2]
+    assert [rowid for rowid, _ in index.search('dinner', order='recent')] == [2, 1]
+    assert [rowid for rowid, _ in index.search('dinner', handle='+15550000001')] == [1]
+    assert [rowid for rowid, _ in index.search('dinner', start=150)] == [2]
+    assert [rowid for rowid, _ in index.search('tom*')] == [3]
+
+
+def test_edits_and_deletions(index):
+    index.update({}, {1: ('+15550000001', 'lunch instead', '', '', '', 0, 100)}, {2})
+    assert index.search('dinner') == []
+    assert [rowid for rowid, _ in index.search('lunch')] == [1]
+
+
+@pytest.mark.parametrize('limit, offset', [(0, 0), (-1, 0), (101, 0), (20, -1)])
+def test_limit_and_offset_bounds(index, limit, offset):
+    with pytest.raises(ValueError):
+        index.search('dinner', limit=limit, offset=offset)
+
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=-1', 'limit=1000', 'offset=-5', 'limit=x'])
+def test_route_rejects_bad_paging(client, query):
+    assert client.get(f'/search?q=dinner&{query}').status_code == 400
+
+
+def test_route_pages(client):
+    first = client.get('/search?q=dinner&limit=2&order=recent').get_json()
+    assert len(first['results']) == 2 and first['next_offset'] == 2
+    second = client.get('/search?q=dinner&limit=2&order=recent&offset=2').get_json()
+    assert first['results'][0] != second['results'][0]
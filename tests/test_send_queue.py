@@ -0,0 +1,84 @@
+import threading
+import time
+
+from applescript import ScriptExecutor, ScriptResult, StubBackend
+from send_queue import FAILED, FINISHED, SENT, UNKNOWN, SendJob, SendQueue
+
+
+def all_ok(args):
+    return '\n'.join('ok' for _ in args[::2])
+
+
+def make_queue(response=all_ok, workers=2, batch_size=10):
+    backend = StubBackend({'send_batch': response})
+    executor = ScriptExecutor(lambda: backend, workers=1)
+    return backend, SendQueue(executor, workers=workers, batch_size=batch_size, per_minute=60000, burst=1000)
+
+
+def wait_finished(jobs, timeout=5):
+    deadline = time.monotonic() + timeout
+    while any(job.status not in FINISHED for job in jobs):
+        assert time.monotonic() < deadline, [job.status for job in jobs]
+        time.sleep(0.01)
+
+
+def sent_messages(backend):
+    # (recipient, message) in the order the scripts were run
+    return [(args[i], args[i + 1]) for _, args in backend.calls for i in range(0, len(args), 2)]
+
+
+def test_per_recipient_order():
+    backend, sends = make_queue(workers=3, batch_size=2)
+    jobs = [sends.submit(f'+1555000000{i % 4}', f'message {i}') for i in range(40)]
+    wait_finished(jobs)
+    assert {job.status for job in jobs} == {SENT}
+    sent = sent_messages(backend)
+    assert len(sent) == 40
+    for r in range(4):
+        recipient = f'+1555000000{r}'
+        assert [m for to, m in sent if to == recipient] == [f'message {i}' for i in range(r, 40, 4)]
+
+
+def test_batches_up_to_batch_size():
+    release = threading.Event()
+
+    def response(args):
+        release.wait(5)
+        return all_ok(args)
+
+    backend, sends = make_queue(response, workers=1, batch_size=3)
+    first = sends.submit('+15550000001', 'first')
+    while not backend.calls:
+        time.sleep(0.01)
+    # Piled up behind the first run, then sent three at a time
+    rest = [sends.submit('+15550000001', f'message {i}') for i in range(7)]
+    release.set()
+    wait_finished([first] + rest)
+    assert [len(args) // 2 for _, args in backend.calls] == [1, 3, 3, 1]
+
+
+def send_batch(response, count):
+    backend, sends = make_queue(response)
+    jobs = [SendJob(f'+1555000000{i}', f'message {i}') for i in range(count)]
+    sends.send_batch(jobs)
+    assert len(backend.calls) == 1
+    return jobs
+
+
+def test_result_lines():
+    jobs = send_batch(lambda args: 'ok\nerror: buddy not found\nok', 3)
+    assert [job.status for job in jobs] == [SENT, FAILED, SENT]
+    assert jobs[1].error == 'buddy not found'
+
+
+def test_failed_run_is_unknown():
+    # A run that timed out after reporting on the first message: that one
+    # counts, the rest may or may not have gone out
+    jobs = send_batch(lambda args: ScriptResult(-1, 'ok\n', 'send_batch timed out after 30s'), 3)
+    assert [job.status for job in jobs] == [SENT, UNKNOWN, UNKNOWN]
+    assert jobs[1].error == 'send_batch timed out after 30s'
+
+
+def test_too_many_lines_are_unknown():
+    jobs = send_batch(lambda args: 'ok\nok\nok', 2)
+    assert [job.status for job in jobs] == [UNKNOWN, UNKNOWN]
@@ -0,0 +1,49 @@
+import snapshot
+from conftest import MESSAGES
+from ingest import MessageIngestor
+
+
+def views(index):
+    # Everything a route reads from the index, newest first
+    everything = len(index)
+    result = {
+        'all': index.items(everything),
+        'received': index.items(everything, sent=False),
+        'recent_contacts': index.recent_contacts(everything),
+    }
+    for handle in index.by_handle:
+        result['by_handle', handle] = index.items(everything, handle=handle)
+        result['received_by_handle', handle] = index.items(everything, handle=handle, sent=False)
+    return result
+
+
+def test_round_trip(chat_db, tmp_path):
+    ingestor = MessageIngestor(chat_db)
+    ingestor.ingest()
+    index = ingestor.messages
+    # Removed slots and replaced text, so save() has to compact first
+    index.remove_many(range(1, MESSAGES, 7))
+    edited = {rowid: index.get(rowid)[:1] + ('edited',) + index.get(rowid)[2:] for rowid in range(2, MESSAGES, 11)
+              if index.get(rowid) is not None}
+    index.add_many(edited)
+    assert index.store.dead_text or len(index.store.rowid) != len(index.store.slots)
+    expected = views(index)
+
+    path = str(tmp_path / 'message_index.snapshot')
+    snapshot.save(index, path, db_filepath=chat_db.path, last_rowid=MESSAGES, last_edit=0)
+    assert len(index.store.rowid) == len(index.store.slots)
+    assert views(index) == expected
+
+    loaded, header = snapshot.load(path)
+    assert header['last_rowid'] == MESSAGES
+    assert len(loaded) == len(index)
+    assert views(loaded) == expected
+    assert loaded.get(2)[1] == 'edited'
+
+    # The loaded index keeps taking updates
+    rowid = MESSAGES + 1
+    message = index.get(3)[:6] + (10 ** 12,)
+    for i in (index, loaded):
+        i.add_many({rowid: message})
+    assert views(loaded) == views(index)
+    assert loaded.items(1)[0][0] == rowid
@@ -0,0 +1,197 @@
+import os
+import time
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+import metrics
+
+# Requested sizes are rounded up to one of these, so the cache holds a few
+# variants per attachment rather than one per pixel width clients ask for
+SIZES = (128, 256, 512, 1024)
+
+THUMBNAILS = metrics.counter('imessage_thumbnails_total', 'Thumbnail requests by outcome', ['result'])
+BUILD_SECONDS = metrics.histogram('imessage_thumbnail_build_seconds', 'Time decoding and resizing one thumbnail')
+
+
+class ThumbnailError(Exception):
+    # The source can't be made into a thumbnail: not an image Pillow reads,
+    # or broken
+    pass
+
+
+class Busy(Exception):
+    # Too many thumbnails are already waiting to be built
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def readable_types():
+    # MIME types of the image formats the installed Pillow can open. HEIC
+    # is only among them with a plugin such as pillow-heif.
+    from PIL import Image
+    Image.init()
+    return frozenset(Image.MIME[fmt] for fmt in Image.OPEN if Image.MIME.get(fmt, '').startswith('image/'))
+
+
+def can_thumbnail(mime_type):
+    return mime_type in readable_types()
+
+
+def thumbnail_size(requested):
+    for size in SIZES:
+        if requested <= size:
+            return size
+    return SIZES[-1]
+
+
+def build_thumbnail(source, destination, size):
+    # JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding (draft),
+    # which is most of the work saved on camera photos
+    from PIL import Image, ImageOps
+    tmp_path = f'{destination}.{threading.get_ident()}.tmp'
+    try:
+        with Image.open(source) as img:
+            img.draft('RGB', (size, size))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((size, size))
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                img = img.convert('RGBA')
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel('A'))
+                img = background
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.save(tmp_path, 'JPEG', quality=80)
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise ThumbnailError(str(e)) from e
+    os.replace(tmp_path, destination)
+
+
+class ThumbnailCache:
+    # JPEG thumbnails on disk under directory, evicted least recently used
+    # once they add up to more than max_bytes. Misses are built on a small
+    # worker pool; requests for a thumbnail that is already being built wait
+    # for that build instead of starting another, and at most max_pending
+    # builds queue up before callers are told to come back later. A source
+    # that fails to build is remembered for failure_ttl seconds, so it
+    # isn't decoded again on every request.
+    def __init__(self, directory, max_bytes=256 * 2**20, workers=2, max_pending=256, failure_ttl=3600,
+                 max_failures=10000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.failure_ttl = failure_ttl
+        self.max_failures = max_failures
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='thumbnail')
+        self.pending = {}
+        # key -> (monotonic expiry, error), oldest first
+        self.failures = OrderedDict()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        # Recency survives restarts through the files' mtimes, which hits
+        # touch
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            found.append((st.st_mtime, name, st.st_size))
+        with self.lock:
+            for _, name, size in sorted(found):
+                self.entries[name] = size
+                self.total_bytes += size
+            self.evict()
+
+    def key(self, source, size):
+        # Tied to the source file as it is now, so a replaced file gets a
+        # new thumbnail
+        st = os.stat(source)
+        digest = hashlib.sha1(f'{source}\0{st.st_mtime_ns}\0{st.st_size}'.encode()).hexdigest()[:24]
+        return f'{digest}-{size}.jpg'
+
+    def get(self, source, requested_size, timeout=10):
+        # Path of the cached thumbnail, or None if it is still being built
+        # after timeout seconds. Raises ThumbnailError or Busy.
+        size = thumbnail_size(requested_size)
+        name = self.key(source, size)
+        path = os.path.join(self.directory, name)
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+                THUMBNAILS.inc(result='hit')
+                try:
+                    os.utime(path)
+                    return path
+                except FileNotFoundError:
+                    self.total_bytes -= self.entries.pop(name)
+            failure = self.failures.get(name)
+            if failure is not None:
+                if failure[0] > time.monotonic():
+                    THUMBNAILS.inc(result='known_error')
+                    raise ThumbnailError(failure[1])
+                del self.failures[name]
+            future = self.pending.get(name)
+            if future is None:
+                if len(self.pending) >= self.max_pending:
+                    THUMBNAILS.inc(result='busy')
+                    raise Busy()
+                THUMBNAILS.inc(result='miss')
+                future = self.pending[name] = self.pool.submit(self.build, source, name, size)
+            else:
+                THUMBNAILS.inc(result='shared')
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            return None
+
+    def build(self, source, name, size):
+        path = os.path.join(self.directory, name)
+        try:
+            start = time.perf_counter()
+            build_thumbnail(source, path, size)
+            BUILD_SECONDS.observe(time.perf_counter() - start)
+            with self.lock:
+                self.entries[name] = os.path.getsize(path)
+                self.total_bytes += self.entries[name]
+                self.evict(keep=name)
+            return path
+        except ThumbnailError as e:
+            THUMBNAILS.inc(result='error')
+            with self.lock:
+                # The key changes with the file, so a replaced one is
+                # tried again straight away
+                self.failures[name] = (time.monotonic() + self.failure_ttl, str(e))
+                while len(self.failures) > self.max_failures:
+                    self.failures.popitem(last=False)
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(name, None)
+
+    def evict(self, keep=None):
+        # Called with the lock held
+        while self.total_bytes > self.max_bytes and self.entries:
+            name, size = next(iter(self.entries.items()))
+            if name == keep:
+                break
+            del self.entries[name]
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        self.pool.shutdown(wait=False)
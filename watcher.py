@@ -0,0 +1,195 @@
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class PollingBackend:
+    # Stats the files and reports a change when mtime or size moves
+    def __init__(self, paths, poll_interval=0.5):
+        self.paths = paths
+        self.poll_interval = poll_interval
+        self.signature = self.stat()
+
+    def stat(self):
+        signature = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return signature
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            signature = self.stat()
+            if signature != self.signature:
+                self.signature = signature
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(self.poll_interval, remaining))
+            else:
+                time.sleep(self.poll_interval)
+
+    def close(self):
+        pass
+
+
+class InotifyBackend:
+    # Watches the parent directory so chat.db-wal being created, truncated
+    # or replaced is seen as well as plain writes
+    def __init__(self, paths):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.names = {os.path.basename(path).encode() for path in paths}
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        directories = {os.path.dirname(os.path.abspath(path)) for path in paths}
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        for directory in directories:
+            if libc.inotify_add_watch(self.fd, directory.encode(), mask) < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                return False
+            if self.drain():
+                return True
+
+    def drain(self):
+        changed = False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name in self.names:
+                changed = True
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class KqueueBackend:
+    # macOS: vnode events on the files themselves, plus the directory so a
+    # newly created chat.db-wal gets picked up
+    def __init__(self, paths):
+        if not hasattr(select, 'kqueue'):
+            raise OSError('kqueue is not available')
+        self.paths = paths
+        self.directory = os.path.dirname(os.path.abspath(paths[0]))
+        self.kq = select.kqueue()
+        self.fds = {}
+        self.open_all()
+
+    def register(self, path):
+        try:
+            fd = os.open(path, os.O_RDONLY | getattr(os, 'O_EVTONLY', 0))
+        except FileNotFoundError:
+            return
+        self.fds[fd] = path
+        event = select.kevent(
+            fd,
+            filter=select.KQ_FILTER_VNODE,
+            flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+            fflags=(select.KQ_NOTE_WRITE | select.KQ_NOTE_EXTEND |
+                    select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME),
+        )
+        self.kq.control([event], 0, 0)
+
+    def open_all(self):
+        self.register(self.directory)
+        for path in self.paths:
+            self.register(path)
+
+    def close_all(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = {}
+
+    def wait(self, timeout):
+        events = self.kq.control(None, 16, timeout)
+        if not events:
+            return False
+        for event in events:
+            if (self.fds.get(event.ident) == self.directory or
+                    event.fflags & (select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME)):
+                # Files may have come or gone, re-register everything
+                self.close_all()
+                self.open_all()
+                break
+        return True
+
+    def close(self):
+        self.close_all()
+        self.kq.close()
+
+
+class ChangeWatcher:
+    def __init__(self, backend, debounce=0.1, max_delay=0.5):
+        self.backend = backend
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+    def wait_for_change(self, timeout=None):
+        if not self.backend.wait(timeout):
+            return False
+        # Messages writes in bursts (wal, then db, then wal again); wait
+        # for things to go quiet, but never longer than max_delay
+        deadline = time.monotonic() + self.max_delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.backend.wait(min(self.debounce, remaining)):
+                return True
+
+    def close(self):
+        self.backend.close()
+
+
+BACKENDS = {
+    'kqueue': KqueueBackend,
+    'inotify': InotifyBackend,
+    'poll': PollingBackend,
+}
+
+
+def create_watcher(paths, mode='auto'):
+    if mode == 'interval':
+        return None
+    if mode == 'auto':
+        for name in ('kqueue', 'inotify'):
+            try:
+                return ChangeWatcher(BACKENDS[name](paths))
+            except (OSError, AttributeError):
+                pass
+        return ChangeWatcher(PollingBackend(paths))
+    return ChangeWatcher(BACKENDS[mode](paths))